@@ -0,0 +1,247 @@
+# Bootstrap statistics and bidimensional regression of the estimates of
+# saved projects, from the command line e.g.
+#
+#   python analysis.py study/ --output statistics.csv --resamples 10000
+#
+# writes one row per statistic of every participant and facility.
+import argparse
+import os
+import sys
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Resamples evaluated at once per participant, bounds the memory per worker
+BOOTSTRAP_BATCH = 1000
+
+STATISTIC_COLUMNS = ['project', 'facility_id', 'participant', 'n', 'unit', 'statistic', 'estimate', 'ci_low', 'ci_high']
+
+BDR_KEYS = ['r', 'scale', 'rotation', 'translation_x', 'translation_y', 'distortion']
+STATISTICS = (['mean_distance', 'median_distance', 'mean_angle_error', 'median_angle_error'] +
+              ['bdr_' + key for key in BDR_KEYS])
+
+
+# Euclidean bidimensional regression (Friedman & Kohler) of estimated onto
+# true coordinates, est ~ translation + scale * rotation * true. Works on
+# arrays of shape (..., n, 2) so whole batches of resamples are fitted at once.
+def bidimensional_regression(true_xy, est_xy):
+    true_xy = np.asarray(true_xy, dtype=np.float64)
+    est_xy = np.asarray(est_xy, dtype=np.float64)
+    w = true_xy[..., 0] + 1j * true_xy[..., 1]
+    z = est_xy[..., 0] + 1j * est_xy[..., 1]
+    w_mean = w.mean(axis=-1, keepdims=True)
+    z_mean = z.mean(axis=-1, keepdims=True)
+    dw = w - w_mean
+    dz = z - z_mean
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b = (np.conj(dw) * dz).sum(axis=-1) / (np.abs(dw)**2).sum(axis=-1)
+        residual = dz - b[..., None] * dw
+        total = (np.abs(dz)**2).sum(axis=-1)
+        r_squared = 1 - (np.abs(residual)**2).sum(axis=-1) / total
+    translation = z_mean[..., 0] - b * w_mean[..., 0]
+    return {
+        'r': np.sqrt(np.clip(r_squared, 0, None)),
+        'scale': np.abs(b),
+        'rotation': np.degrees(np.angle(b)),
+        'translation_x': translation.real,
+        'translation_y': translation.imag,
+        # Distortion index in percent, 0 for a perfect similarity transform
+        'distortion': 100 * np.sqrt(np.clip(1 - r_squared, 0, None)),
+    }
+
+
+# Statistics of one sample, vectorized over the leading resample axis
+def sample_statistics(distance, angle_error, true_xy, est_xy):
+    stats = {
+        'mean_distance': distance.mean(axis=-1),
+        'median_distance': np.median(distance, axis=-1),
+        'mean_angle_error': angle_error.mean(axis=-1),
+        'median_angle_error': np.median(angle_error, axis=-1),
+    }
+    for key, value in bidimensional_regression(true_xy, est_xy).items():
+        stats['bdr_' + key] = value
+    return stats
+
+def confidence_interval(samples, confidence: float):
+    samples = samples[np.isfinite(samples)]
+    if len(samples) == 0:
+        return (np.nan, np.nan)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(samples, [tail, 100 - tail])
+    return (float(low), float(high))
+
+# Point estimates and percentile bootstrap intervals for one participant.
+# Runs in a worker process; the seed makes the result independent of how
+# participants are spread over workers.
+def bootstrap_participant(distance, angle_error, true_xy, est_xy, resamples: int, seed, confidence: float):
+    n = len(distance)
+    if n == 0:
+        return {'n': 0, 'estimate': {key: np.nan for key in STATISTICS}, 'ci': {key: (np.nan, np.nan) for key in STATISTICS}}
+    estimate = {key: float(value) for key, value in sample_statistics(distance, angle_error, true_xy, est_xy).items()}
+    result = {'n': n, 'estimate': estimate, 'ci': {}}
+    if n < 2 or resamples <= 0:
+        result['ci'] = {key: (np.nan, np.nan) for key in estimate}
+        return result
+
+    rng = np.random.default_rng(seed)
+    collected = {key: [] for key in estimate}
+    for start in range(0, resamples, BOOTSTRAP_BATCH):
+        rows = rng.integers(0, n, (min(BOOTSTRAP_BATCH, resamples - start), n))
+        stats = sample_statistics(distance[rows], angle_error[rows], true_xy[rows], est_xy[rows])
+        for key, value in stats.items():
+            collected[key].append(value)
+    for key, values in collected.items():
+        result['ci'][key] = confidence_interval(np.concatenate(values), confidence)
+    return result
+
+# Distribution of angle errors in equal bins between 0 and 180 degrees
+def angle_histogram(angle_error, bins: int = 18):
+    angle_error = np.asarray(angle_error, dtype=np.float64)
+    counts, edges = np.histogram(angle_error[np.isfinite(angle_error)], bins=bins, range=(0, 180))
+    return counts, edges
+
+
+# Aggregate accuracy statistics for a metrics.ErrorTable: per participant
+# with bootstrap confidence intervals computed in a process pool, and for
+# the facility with a bootstrap over participants. Distances are in meters
+# when a scale was set, otherwise in pixels. Edge points are left out of the
+# configuration fit unless include_edges is set, unlabeled estimates without
+# a true position always. Pass an executor to share one pool between tables.
+def analyze(table, resamples: int = 10000, seed: int = 0, confidence: float = 0.95,
+            include_edges: bool = False, workers: int = None, executor=None):
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            return analyze(table, resamples, seed, confidence, include_edges, executor=executor)
+    return collect_analysis(submit_analysis(executor, table, resamples, seed, confidence, include_edges))
+
+# Submit the participant bootstraps of a table to executor without waiting
+# for them, collect_analysis waits and completes the result
+def submit_analysis(executor, table, resamples: int = 10000, seed: int = 0, confidence: float = 0.95,
+                    include_edges: bool = False):
+    keep = np.isfinite(table.true_xy).all(axis=1)
+    if not include_edges:
+        keep &= ~table.is_edge
+    metric = bool(keep.any()) and bool(np.isfinite(table.distance_m[keep]).all())
+    distance = table.distance_m if metric else table.distance_px
+
+    seeds = np.random.SeedSequence(seed).spawn(len(table.participant_ids) + 1)
+    futures = {}
+    histograms = {}
+    for index, id in enumerate(table.participant_ids):
+        rows = np.flatnonzero((table.participant_index == index) & keep)
+        futures[id] = executor.submit(bootstrap_participant, distance[rows], table.angle_error[rows], table.true_xy[rows],
+                                      table.est_xy[rows], resamples, seeds[index], confidence)
+        histograms[id] = angle_histogram(table.angle_error[rows])[0].tolist()
+    return {'unit': 'm' if metric else 'px', 'futures': futures, 'histograms': histograms,
+            'resamples': resamples, 'seed': seeds[-1], 'confidence': confidence}
+
+def collect_analysis(pending):
+    participants = {id: future.result() for id, future in pending['futures'].items()}
+    for id, histogram in pending['histograms'].items():
+        participants[id]['angle_histogram'] = histogram
+    return {
+        'unit': pending['unit'],
+        'participants': participants,
+        'facility': facility_summary(participants, pending['resamples'], pending['seed'], pending['confidence']),
+    }
+
+# Facility statistics as the mean over participants, with a bootstrap that
+# resamples whole participants
+def facility_summary(participants, resamples: int, seed, confidence: float):
+    keys = ['mean_distance', 'median_distance', 'mean_angle_error', 'median_angle_error', 'bdr_r', 'bdr_distortion']
+    values = np.array([[result['estimate'][key] for key in keys] for result in participants.values() if result['n'] > 0])
+    summary = {'participants': len(values), 'estimate': {}, 'ci': {}}
+    if len(values) == 0:
+        return summary
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(values), (resamples, len(values))) if len(values) > 1 and resamples > 0 else None
+    for column, key in enumerate(keys):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            summary['estimate'][key] = float(np.nanmean(values[:, column]))
+        if rows is None:
+            summary['ci'][key] = (np.nan, np.nan)
+        else:
+            with warnings.catch_warnings():
+                # Resamples made only of participants without a value
+                warnings.simplefilter('ignore', RuntimeWarning)
+                samples = np.nanmean(values[rows, column], axis=1)
+            summary['ci'][key] = confidence_interval(samples, confidence)
+    return summary
+
+
+# Rows of STATISTIC_COLUMNS for the result of analyze, the facility rows have
+# an empty participant
+def statistic_rows(result, project: str = '', facility_id: str = ''):
+    common = {'project': project, 'facility_id': facility_id, 'unit': result['unit']}
+    summaries = [(id, participant['n'], participant) for id, participant in result['participants'].items()]
+    summaries.append(('', result['facility']['participants'], result['facility']))
+    for participant, n, summary in summaries:
+        for key, value in summary['estimate'].items():
+            low, high = summary['ci'].get(key, (np.nan, np.nan))
+            yield dict(common, participant=participant, n=n, statistic=key, estimate=value, ci_low=low, ci_high=high)
+
+
+def main(argv=None):
+    # Imported here so the module stays light for the viewer and the workers
+    from batch import find_projects
+    from export import open_output
+    from project import load_project
+    import metrics
+
+    parser = argparse.ArgumentParser(description='Bootstrap statistics and bidimensional regression of saved projects.')
+    parser.add_argument('projects', nargs='+', help='project files, directories or glob patterns')
+    parser.add_argument('--output', default='-', help='output file, - for stdout')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='output format, guessed from the file extension by default')
+    parser.add_argument('--resamples', type=int, default=10000, help='bootstrap resamples')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of the intervals')
+    parser.add_argument('--include-edges', action='store_true', help='include edge points in the statistics')
+    parser.add_argument('--workers', type=int, help='number of worker processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+
+    # All projects share one pool. Bootstraps of the next projects are
+    # submitted while earlier ones run, and rows are written in project order.
+    workers = args.workers or os.cpu_count() or 1
+    writer = open_output(args.output, STATISTIC_COLUMNS, args.format)
+    counts = {'done': 0, 'failed': 0}
+    pending = deque()
+
+    def write_next():
+        path, facility_id, analysis = pending.popleft()
+        for row in statistic_rows(collect_analysis(analysis), path, facility_id):
+            writer.write(row)
+        counts['done'] += 1
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path in find_projects(args.projects):
+                try:
+                    project = load_project(path)
+                except (OSError, ValueError, KeyError) as error:
+                    print('{}: {}'.format(path, error), file=sys.stderr)
+                    counts['failed'] += 1
+                    continue
+                reference = None
+                if project.reference_point is not None:
+                    point = project.reference_point
+                    reference = (point.x, point.y, point.dir_x, point.dir_y)
+                table = metrics.compute_errors(project.participants, reference, project.scale_value)
+                pending.append((path, project.facility_id, submit_analysis(executor, table, args.resamples, args.seed,
+                                                                           args.confidence, args.include_edges)))
+                # Bounds the projects held in memory
+                if len(pending) > workers:
+                    write_next()
+            while pending:
+                write_next()
+    finally:
+        writer.close()
+
+    print('{} projects analyzed, {} failed'.format(counts['done'], counts['failed']), file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
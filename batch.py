@@ -0,0 +1,143 @@
+# Compute the metrics of many saved projects from the command line, e.g.
+#
+#   python batch.py study/ --estimates estimates.csv --participants participants.jsonl
+#
+# Projects are analyzed in a process pool and rows are written as soon as a
+# project is done, so memory use does not grow with the size of the study.
+# With --cache, results are kept on disk by a hash of the project inputs and
+# projects that did not change since an earlier run are not recomputed.
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from project import load_project, PROJECT_EXTENSION
+from metriccache import MetricCache, input_key
+from export import open_output
+import metrics
+
+ESTIMATE_COLUMNS = ['project', 'facility_id', 'participant', 'estimate', 'kind', 'x', 'y', 'true_x', 'true_y',
+                    'distance_px', 'distance_m', 'angle', 'angle_error']
+PARTICIPANT_COLUMNS = ['project', 'facility_id', 'participant', 'count', 'distance_px', 'distance_m', 'angle_error']
+
+
+# Project files named by directories (searched recursively) and glob patterns
+def find_projects(patterns):
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for folder, _, names in os.walk(pattern):
+                for name in sorted(names):
+                    if name.endswith(PROJECT_EXTENSION):
+                        yield os.path.join(folder, name)
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+
+# Runs in a worker process, returns the estimate and participant rows and
+# whether they came from the cache
+def analyze_project(path: str, cache_folder: str = None):
+    cache = MetricCache(cache_folder) if cache_folder else None
+    cached = cache.lookup(path) if cache is not None else None
+    if cached is None:
+        project = load_project(path)
+        key = input_key(project) if cache is not None else None
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                # Same inputs under a new file signature, e.g. saved again
+                cache.link(path, key)
+    if cached is not None:
+        table, facility_id = cached
+    else:
+        reference = None
+        if project.reference_point is not None:
+            point = project.reference_point
+            reference = (point.x, point.y, point.dir_x, point.dir_y)
+        table = metrics.compute_errors(project.participants, reference, project.scale_value)
+        facility_id = project.facility_id
+        if cache is not None:
+            cache.put(key, table, facility_id, path)
+
+    common = {'project': path, 'facility_id': facility_id}
+    estimates = [dict(common, **row) for row in table.rows()]
+    participants = [dict(common, **row) for row in table.participantRows()]
+    return estimates, participants, cached is not None
+
+
+# Analyze projects in parallel and hand every finished project to on_result.
+# Only a bounded number of projects is in flight at any time.
+def run(paths, on_result, on_error, workers: int = None, cache_folder: str = None):
+    workers = workers or os.cpu_count() or 1
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while True:
+            while len(running) < 4 * workers:
+                path = next(paths, None)
+                if path is None:
+                    break
+                running[executor.submit(analyze_project, path, cache_folder)] = path
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                try:
+                    on_result(path, *future.result())
+                except Exception as error:
+                    on_error(path, error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute distance and angle errors for saved annotation projects.')
+    parser.add_argument('projects', nargs='+', help='project files, directories or glob patterns')
+    parser.add_argument('--estimates', help='output file for per-estimate rows, - for stdout')
+    parser.add_argument('--participants', help='output file for per-participant rows, - for stdout')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='output format, guessed from the file extension by default')
+    parser.add_argument('--workers', type=int, help='number of worker processes, defaults to the number of cores')
+    parser.add_argument('--cache', help='folder for cached results of unchanged projects')
+    parser.add_argument('--cache-size', type=int, default=1024, help='cache size limit in MiB')
+    args = parser.parse_args(argv)
+    if not args.estimates and not args.participants:
+        parser.error('give --estimates and/or --participants')
+
+    outputs = []
+    estimate_writer = participant_writer = None
+    if args.estimates:
+        estimate_writer = open_output(args.estimates, ESTIMATE_COLUMNS, args.format)
+        outputs.append(estimate_writer)
+    if args.participants:
+        participant_writer = open_output(args.participants, PARTICIPANT_COLUMNS, args.format)
+        outputs.append(participant_writer)
+
+    counts = {'done': 0, 'failed': 0, 'hits': 0, 'misses': 0}
+
+    def on_result(path, estimates, participants, cached):
+        if estimate_writer is not None:
+            for row in estimates:
+                estimate_writer.write(row)
+        if participant_writer is not None:
+            for row in participants:
+                participant_writer.write(row)
+        counts['done'] += 1
+        counts['hits' if cached else 'misses'] += 1
+
+    def on_error(path, error):
+        print('{}: {}'.format(path, error), file=sys.stderr)
+        counts['failed'] += 1
+
+    try:
+        run(find_projects(args.projects), on_result, on_error, args.workers, args.cache)
+    finally:
+        for writer in outputs:
+            writer.close()
+
+    print('{} projects analyzed, {} failed'.format(counts['done'], counts['failed']), file=sys.stderr)
+    if args.cache:
+        MetricCache(args.cache, args.cache_size * 1024 * 1024).evict()
+        print('cache: {} hits, {} misses'.format(counts['hits'], counts['misses']), file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# Reproducible benchmarks for scene building, hit testing, zooming, image
+# loading and metric computation. Runs on the offscreen Qt platform, e.g.
+#
+#   python benchmarks.py --landmarks 100 --participants 50 --estimates 100 --output bench.json
+#
+# Results are written as JSON so runs of different commits can be compared.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt6.QtCore import QPoint, QPointF, Qt, PYQT_VERSION_STR, QT_VERSION_STR
+from PyQt6.QtGui import QImage, QColor, QWheelEvent
+from PyQt6.QtWidgets import QApplication
+from points import TrueLandmark, EstimatedLandmark, EdgePoint, ReferenceLandmark, Participant
+
+
+# Synthetic facility with estimates scattered around their true landmarks
+class Facility():
+    def __init__(self, landmarks: int, participants: int, estimates: int, size: int = 4000, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.size = size
+        true_xy = rng.uniform(0, size, (landmarks, 2))
+        self.true_landmarks = [TrueLandmark(x, y, 'L' + str(index)) for index, (x, y) in enumerate(true_xy.tolist())]
+        self.reference = ReferenceLandmark(size / 2, size / 2, 'R', size / 2 + 100, size / 2)
+        self.participants = []
+        self.estimates = []
+        for p in range(participants):
+            participant = Participant('P' + str(p))
+            targets = rng.integers(0, landmarks, estimates)
+            offsets = rng.normal(0, size / 40, (estimates, 2))
+            for index, (target, (dx, dy)) in enumerate(zip(targets.tolist(), offsets.tolist())):
+                landmark = self.true_landmarks[target]
+                cls = EdgePoint if index % 4 == 3 else EstimatedLandmark
+                self.estimates.append((participant, cls(landmark.x + dx, landmark.y + dy, 'E' + str(index),
+                                                        landmark.x, landmark.y, participant.id)))
+            self.participants.append(participant)
+
+
+# Run fn repeat times and collect wall clock seconds; setup runs untimed
+def measure(fn, repeat: int, setup=None):
+    timings = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(state)
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+    }
+
+
+def new_window(facility):
+    import main
+    window = main.MainWindow()
+    window.resize(1280, 800)
+    window.show()
+    for participant in facility.participants:
+        window.participants.append(Participant(participant.id))
+        window.participantSelector.addItem(participant.id)
+    return window
+
+# Add every point of the facility through the normal MainWindow path
+def populate(window, facility):
+    window.handle_point_created(facility.reference)
+    for landmark in facility.true_landmarks:
+        window.handle_point_created(landmark)
+    # Estimates are grouped by participant
+    indices = {participant: index for index, participant in enumerate(facility.participants)}
+    for owner, estimate in facility.estimates:
+        if window.participantSelector.currentIndex() != indices[owner]:
+            window.participantSelector.setCurrentIndex(indices[owner])
+        window.handle_point_created(estimate)
+
+
+class _Click():
+    def __init__(self, pos):
+        self._pos = pos
+
+    def pos(self):
+        return self._pos
+
+
+def run_benchmarks(args):
+    app = QApplication.instance() or QApplication(sys.argv)
+    facility = Facility(args.landmarks, args.participants, args.estimates, seed=args.seed)
+    results = {}
+    windows = []
+
+    # Scene building: point objects, registry and layers
+    def create(state):
+        window, fac = state
+        populate(window, fac)
+    def create_setup():
+        fac = Facility(args.landmarks, args.participants, args.estimates, seed=args.seed)
+        window = new_window(fac)
+        windows.append(window)
+        return window, fac
+    results['create_points'] = measure(create, args.repeat, create_setup)
+
+    window = new_window(facility)
+    windows.append(window)
+    populate(window, facility)
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = os.path.join(folder, 'facility.jpg')
+        image = QImage(args.image_size, args.image_size, QImage.Format.Format_RGB32)
+        image.fill(QColor('white'))
+        image.save(image_path, quality=90)
+        results['load_image'] = measure(lambda _: window.viewer.loadImage(image_path), args.repeat)
+        app.processEvents()
+
+        # Hit testing plus deletion of estimates at random positions
+        rng = np.random.default_rng(args.seed)
+        window.toolSelector.setCurrentText('Delete')
+        viewer = window.viewer
+        viewer.fitInView(viewer.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio)
+
+        def delete(targets):
+            for estimate in targets:
+                viewer.currentTool.mousePressEvent(_Click(viewer.mapFromScene(QPointF(estimate.x, estimate.y))))
+        def delete_setup():
+            estimates = [estimate for _, estimate in facility.estimates if estimate in window.registry]
+            picks = rng.choice(len(estimates), min(args.deletes, len(estimates)), replace=False)
+            return [estimates[index] for index in picks.tolist()]
+        results['delete_hit_test'] = measure(delete, args.repeat, delete_setup)
+
+        # Zoom in and out by wheel ticks, repainting after each
+        center = QPointF(viewer.viewport().width() / 2, viewer.viewport().height() / 2)
+        def zoom(_):
+            for delta in [120] * args.zoom_steps + [-120] * args.zoom_steps:
+                event = QWheelEvent(center, viewer.mapToGlobal(center), QPoint(0, 0), QPoint(0, delta),
+                                    Qt.MouseButton.NoButton, Qt.KeyboardModifier.NoModifier,
+                                    Qt.ScrollPhase.NoScrollPhase, False)
+                viewer.wheelEvent(event)
+                viewer.viewport().repaint()
+        results['zoom_repaint'] = measure(zoom, args.repeat)
+
+        results['metrics'] = measure(lambda _: window.calculateError(), args.repeat)
+
+    for window in windows:
+        window.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the annotation tool on a synthetic facility.')
+    parser.add_argument('--landmarks', type=int, default=100)
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--estimates', type=int, default=100, help='estimates per participant')
+    parser.add_argument('--deletes', type=int, default=100, help='deletions per repetition')
+    parser.add_argument('--zoom-steps', type=int, default=10, help='wheel ticks in each direction')
+    parser.add_argument('--image-size', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file for the results, printed to stdout by default')
+    args = parser.parse_args(argv)
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'qt': QT_VERSION_STR,
+        'pyqt': PYQT_VERSION_STR,
+        'machine': platform.machine(),
+        'parameters': vars(args),
+        'results': run_benchmarks(args),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
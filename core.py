@@ -0,0 +1,28 @@
+# Qt-free entry point for scripts, notebooks and batch workers. The data
+# model is imported right away, the NumPy-backed metrics and project modules
+# are only imported when one of their names is first used.
+import importlib
+from points import Point, TrueLandmark, ReferenceLandmark, EstimatedPoint, EstimatedLandmark, EdgePoint, Participant
+from registry import AnnotationRegistry
+
+_LAZY = {
+    'metrics': ('metrics', None),
+    'compute_errors': ('metrics', 'compute_errors'),
+    'ErrorTable': ('metrics', 'ErrorTable'),
+    'project': ('project', None),
+    'Project': ('project', 'Project'),
+    'load_project': ('project', 'load_project'),
+    'save_project': ('project', 'save_project'),
+}
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module 'core' has no attribute " + repr(name))
+    module_name, attribute = _LAZY[name]
+    module = importlib.import_module(module_name)
+    value = module if attribute is None else getattr(module, attribute)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
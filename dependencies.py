@@ -0,0 +1,85 @@
+from points import TrueLandmark
+
+
+# Links true landmarks to the estimates of them. Estimates keep copies of
+# their landmark's coordinates, so when a landmark is moved or replaced the
+# graph tells which estimates have to follow. An estimate is linked to the
+# landmark at its true coordinates when either of them is added. When a
+# landmark is removed its estimates wait for a new landmark with the same
+# ID, which then replaces it.
+class DependencyGraph():
+    def __init__(self):
+        self.dependents = {}
+        self.sources = {}
+        self.orphans = {}
+        self.orphaned = {}
+        self.by_position = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def landmarkOf(self, estimate):
+        return self.sources.get(estimate)
+
+    def dependentsOf(self, landmark):
+        return list(self.dependents.get(landmark, ()))
+
+    # Register a landmark. Returns the estimates it took over from a removed
+    # landmark with the same ID; their true coordinates are now stale.
+    def addLandmark(self, landmark: TrueLandmark):
+        self.dependents.setdefault(landmark, {})
+        self.by_position.setdefault((landmark.x, landmark.y), landmark)
+        adopted = list(self.orphans.pop(landmark.id, ()))
+        for estimate in adopted:
+            del self.orphaned[estimate]
+            self.link(estimate, landmark)
+        return adopted
+
+    def removeLandmark(self, landmark: TrueLandmark):
+        dependents = self.dependents.pop(landmark, {})
+        if self.by_position.get((landmark.x, landmark.y)) is landmark:
+            del self.by_position[(landmark.x, landmark.y)]
+        if dependents:
+            orphans = self.orphans.setdefault(landmark.id, {})
+            for estimate in dependents:
+                del self.sources[estimate]
+                orphans[estimate] = None
+                self.orphaned[estimate] = landmark.id
+
+    # Update the position index after a landmark was moved to new coordinates
+    def moveLandmark(self, landmark: TrueLandmark, old_x: float, old_y: float):
+        if self.by_position.get((old_x, old_y)) is landmark:
+            del self.by_position[(old_x, old_y)]
+        self.by_position.setdefault((landmark.x, landmark.y), landmark)
+        return self.dependentsOf(landmark)
+
+    # Register an estimate, returns the landmark it depends on or None
+    def addEstimate(self, estimate):
+        landmark = self.by_position.get((estimate.true_x, estimate.true_y))
+        if landmark is not None:
+            self.link(estimate, landmark)
+        return landmark
+
+    def removeEstimate(self, estimate):
+        landmark = self.sources.pop(estimate, None)
+        if landmark is not None:
+            del self.dependents[landmark][estimate]
+        id = self.orphaned.pop(estimate, None)
+        if id is not None:
+            del self.orphans[id][estimate]
+            if not self.orphans[id]:
+                del self.orphans[id]
+
+    def link(self, estimate, landmark):
+        previous = self.sources.get(estimate)
+        if previous is not None:
+            del self.dependents[previous][estimate]
+        self.sources[estimate] = landmark
+        self.dependents.setdefault(landmark, {})[estimate] = None
+
+    def clear(self):
+        self.dependents.clear()
+        self.sources.clear()
+        self.orphans.clear()
+        self.orphaned.clear()
+        self.by_position.clear()
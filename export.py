@@ -0,0 +1,241 @@
+# Export of per-estimate results as CSV, JSON Lines or a compressed columnar
+# format. Results flow through generators in chunks of a fixed number of
+# rows, so memory use does not depend on the size of the study:
+#
+#   document tables -> result_chunks -> writer.writeChunk
+#
+# The columnar format stores every chunk column by column, each column
+# compressed on its own; read_columnar reads it back chunk by chunk.
+import csv
+import json
+import math
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import metrics
+
+EXPORT_COLUMNS = ['facility_id', 'image', 'participant', 'estimate', 'kind', 'distance_px', 'distance_m', 'angle_error']
+FLOAT_COLUMNS = {'distance_px', 'distance_m', 'angle_error'}
+# Rows per chunk
+EXPORT_CHUNK = 65536
+COLUMNAR_EXTENSION = '.dtcol'
+COLUMNAR_MAGIC = b'DTCOL001'
+CHUNK = struct.Struct('<4sI')
+LENGTH = struct.Struct('<I')
+# Fast zlib level; the shuffled float columns compress well even at level 1
+COMPRESSION_LEVEL = 1
+
+
+def _plain(value):
+    # NaN marks a missing value, written as an empty CSV cell or JSON null
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+# Results of the annotations of one image, one ErrorTable per participant so
+# only one participant's estimates are held at a time
+def participant_tables(participants, reference=None, scale_value=None):
+    for participant in participants:
+        if len(participant.estimates):
+            yield metrics.compute_errors([participant], reference, scale_value)
+
+# Rechunk (facility ID, image ID, ErrorTable) sources into dicts of columns
+# with chunk_size rows each, the last chunk may be shorter
+def result_chunks(sources, chunk_size: int = EXPORT_CHUNK):
+    pieces = []
+    count = 0
+    for facility_id, image, table in sources:
+        columns = table_columns(facility_id, image, table)
+        start = 0
+        while start < len(table):
+            stop = min(start + chunk_size - count, len(table))
+            pieces.append({name: column[start:stop] for name, column in columns.items()})
+            count += stop - start
+            start = stop
+            if count == chunk_size:
+                yield join_pieces(pieces)
+                pieces = []
+                count = 0
+    if count:
+        yield join_pieces(pieces)
+
+def table_columns(facility_id, image, table):
+    count = len(table)
+    participant_ids = np.array(table.participant_ids, dtype=object)
+    return {
+        'facility_id': np.full(count, facility_id, dtype=object),
+        'image': np.full(count, image, dtype=object),
+        'participant': participant_ids[table.participant_index] if count else np.empty(0, dtype=object),
+        'estimate': np.array(table.estimate_ids, dtype=object),
+        'kind': np.where(table.is_edge, 'edge', 'landmark').astype(object),
+        'distance_px': table.distance_px,
+        'distance_m': table.distance_m,
+        'angle_error': table.angle_error,
+    }
+
+def join_pieces(pieces):
+    if len(pieces) == 1:
+        return pieces[0]
+    return {name: np.concatenate([piece[name] for piece in pieces]) for name in pieces[0]}
+
+def chunk_rows(chunk, columns):
+    return zip(*[chunk[name].tolist() for name in columns])
+
+
+class CsvRowWriter():
+    def __init__(self, file, columns):
+        self.file = file
+        self.columns = columns
+        self.writer = csv.writer(file)
+        self.writer.writerow(columns)
+
+    def write(self, row):
+        self.writer.writerow([_plain(row[column]) for column in self.columns])
+
+    def writeChunk(self, chunk):
+        self.writer.writerows([_plain(value) for value in row] for row in chunk_rows(chunk, self.columns))
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class JsonLinesRowWriter():
+    def __init__(self, file, columns):
+        self.file = file
+        self.columns = columns
+
+    def write(self, row):
+        self.file.write(json.dumps({column: _plain(row[column]) for column in self.columns}) + '\n')
+
+    def writeChunk(self, chunk):
+        self.file.write(''.join(json.dumps({column: _plain(value) for column, value in zip(self.columns, row)}) + '\n'
+                                for row in chunk_rows(chunk, self.columns)))
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+# Float columns are stored byte shuffled: the first bytes of all values, then
+# the second bytes and so on, which groups the similar sign and exponent
+# bytes for zlib. Text columns are dictionary encoded: the number of
+# distinct values, their byte lengths, the UTF-8 values and one uint32 code
+# per row. Facility, image, participant and kind repeat within a chunk, and
+# np.unique keeps the encoding out of Python loops over the rows.
+def encode_column(name: str, values):
+    if name in FLOAT_COLUMNS:
+        data = np.ascontiguousarray(values, dtype='<f8').view(np.uint8).reshape(-1, 8).T.tobytes()
+    else:
+        labels, codes = np.unique(np.asarray(values).astype(str), return_inverse=True)
+        encoded = [label.encode('utf-8') for label in labels.tolist()]
+        data = (LENGTH.pack(len(encoded)) + np.array([len(label) for label in encoded], dtype='<u4').tobytes()
+                + b''.join(encoded) + codes.astype('<u4').tobytes())
+    return zlib.compress(data, COMPRESSION_LEVEL)
+
+def decode_column(data: bytes, count: int, is_float: bool):
+    data = zlib.decompress(data)
+    if is_float:
+        return np.frombuffer(data, dtype=np.uint8, count=8 * count).reshape(8, count).T.copy().view('<f8').ravel()
+    size = LENGTH.unpack_from(data)[0]
+    lengths = np.frombuffer(data, dtype='<u4', count=size, offset=LENGTH.size)
+    ends = np.cumsum(lengths) + LENGTH.size + 4 * size
+    starts = ends - lengths
+    labels = np.array([data[start:end].decode('utf-8') for start, end in zip(starts.tolist(), ends.tolist())] + [''],
+                      dtype=object)[:size]
+    offset = int(ends[-1]) if size else LENGTH.size
+    return labels[np.frombuffer(data, dtype='<u4', count=count, offset=offset)]
+
+def encode_chunk(columns, chunk):
+    count = len(chunk[columns[0]])
+    parts = [CHUNK.pack(b'CHNK', count)]
+    for name in columns:
+        data = encode_column(name, chunk[name])
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+# Compressed columnar output: magic, JSON header with the columns, then one
+# record per chunk with the row count and every column compressed on its own.
+# Float columns are byte shuffled float64, text columns are dictionary
+# encoded, see encode_column. With workers, chunks are compressed on a
+# thread pool (zlib releases the GIL) while keeping at most two chunks per
+# worker in memory. Writing to sys.stdout.buffer leaves it open.
+class ColumnarWriter():
+    def __init__(self, file, columns, workers: int = 0):
+        self.file = file
+        self.columns = columns
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.window = 2 * workers
+        self.running = deque()
+        header = json.dumps({'columns': columns, 'float_columns': sorted(FLOAT_COLUMNS & set(columns))}).encode('utf-8')
+        file.write(COLUMNAR_MAGIC + LENGTH.pack(len(header)) + header)
+
+    def writeChunk(self, chunk):
+        if self.executor is None:
+            self.file.write(encode_chunk(self.columns, chunk))
+            return
+        self.running.append(self.executor.submit(encode_chunk, self.columns, chunk))
+        while len(self.running) >= self.window:
+            self.file.write(self.running.popleft().result())
+
+    def close(self):
+        while self.running:
+            self.file.write(self.running.popleft().result())
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.file is sys.stdout.buffer:
+            self.file.flush()
+        else:
+            self.file.close()
+
+# Chunks of a columnar file as dicts of columns
+def read_columnar(path: str):
+    with open(path, 'rb') as file:
+        if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError('not a columnar export: ' + path)
+        header = json.loads(file.read(LENGTH.unpack(file.read(LENGTH.size))[0]))
+        float_columns = set(header['float_columns'])
+        while True:
+            record = file.read(CHUNK.size)
+            if not record:
+                return
+            tag, count = CHUNK.unpack(record)
+            if tag != b'CHNK':
+                raise ValueError('corrupt columnar export: ' + path)
+            chunk = {}
+            for name in header['columns']:
+                data = file.read(LENGTH.unpack(file.read(LENGTH.size))[0])
+                chunk[name] = decode_column(data, count, name in float_columns)
+            yield chunk
+
+
+# Format from the file extension: csv, jsonl or columnar
+def guess_format(path: str):
+    if path.endswith(COLUMNAR_EXTENSION):
+        return 'columnar'
+    if path.endswith(('.jsonl', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+def open_output(path: str, columns, format: str = None, workers: int = 0):
+    format = format or guess_format(path)
+    if format == 'columnar':
+        return ColumnarWriter(sys.stdout.buffer if path == '-' else open(path, 'wb'), columns, workers)
+    file = sys.stdout if path == '-' else open(path, 'w', newline='')
+    return JsonLinesRowWriter(file, columns) if format == 'jsonl' else CsvRowWriter(file, columns)
+
+# Write all chunks of the sources, returns the number of rows written
+def export(path: str, sources, format: str = None, chunk_size: int = EXPORT_CHUNK, workers: int = 0):
+    writer = open_output(path, EXPORT_COLUMNS, format, workers)
+    count = 0
+    try:
+        for chunk in result_chunks(sources, chunk_size):
+            writer.writeChunk(chunk)
+            count += len(chunk['estimate'])
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,234 @@
+import numpy as np
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QRectF, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtWidgets import QGraphicsItem, QComboBox
+from tiles import TileCache
+
+# Cells along the longer side of the density grid
+HEATMAP_SIZE = 512
+# Opacity of the densest cell
+HEATMAP_ALPHA = 200
+# Kernels are cut off at this many standard deviations
+KERNEL_EXTENT = 3
+
+# Selector entries besides the true landmark IDs
+NO_HEATMAP = 'No Heatmap'
+ALL_ESTIMATES = 'All Estimates'
+
+
+# Bandwidth of an isotropic Gaussian kernel by Scott's rule
+def scott_bandwidth(xy):
+    if len(xy) < 2:
+        return 0.0
+    return float(np.mean(np.std(xy, axis=0)) * len(xy)**(-1 / 6))
+
+# Blur a grid with a Gaussian of sigma cells along both axes, as one FFT
+# convolution per axis. The grid is zero padded so nothing wraps around.
+def gaussian_blur(grid, sigma: float):
+    if sigma <= 0:
+        return grid
+    radius = int(np.ceil(KERNEL_EXTENT * sigma))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma)**2)
+    kernel /= kernel.sum()
+    for axis in (0, 1):
+        count = grid.shape[axis]
+        length = count + 2 * radius
+        shape = [1, 1]
+        shape[axis] = -1
+        spectrum = np.fft.rfft(grid, n=length, axis=axis) * np.fft.rfft(kernel, n=length).reshape(shape)
+        grid = np.take(np.fft.irfft(spectrum, n=length, axis=axis), np.arange(radius, radius + count), axis=axis)
+    return grid
+
+# Binned kernel density estimate of points over a scene rectangle given as
+# (x, y, width, height), on a grid of HEATMAP_SIZE cells along its longer
+# side. Returns the density grid, rows along y.
+def density_grid(xy, rect, bandwidth: float = None, size: int = HEATMAP_SIZE):
+    x, y, width, height = rect
+    cell = max(width, height) / size
+    columns = max(1, int(np.ceil(width / cell)))
+    rows = max(1, int(np.ceil(height / cell)))
+    grid = np.zeros((rows, columns))
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    xy = xy[np.isfinite(xy).all(axis=1)]
+    if len(xy) == 0:
+        return grid
+
+    gx = np.floor((xy[:, 0] - x) / cell).astype(np.int64)
+    gy = np.floor((xy[:, 1] - y) / cell).astype(np.int64)
+    inside = (gx >= 0) & (gx < columns) & (gy >= 0) & (gy < rows)
+    grid = np.bincount(gy[inside] * columns + gx[inside], minlength=rows * columns).reshape(rows, columns).astype(np.float64)
+    if bandwidth is None:
+        bandwidth = scott_bandwidth(xy)
+    return gaussian_blur(grid, max(bandwidth / cell, 1.0))
+
+# Color table from transparent blue over green and yellow to opaque red, as
+# premultiplied ARGB
+def _color_table():
+    stops = np.array([[0.0, 0, 0, 255], [0.35, 0, 200, 120], [0.65, 255, 230, 0], [1.0, 230, 30, 0]])
+    levels = np.linspace(0, 1, 256)
+    rgb = np.column_stack([np.interp(levels, stops[:, 0], stops[:, channel]) for channel in (1, 2, 3)])
+    alpha = np.sqrt(levels) * HEATMAP_ALPHA
+    rgb = rgb * alpha[:, None] / 255
+    table = (alpha.astype(np.uint32) << 24) | (rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2].astype(np.uint32)
+    table[0] = 0
+    return table
+
+COLOR_TABLE = _color_table()
+
+# Map a density grid through the color table into a QImage
+def render_density(grid):
+    peak = grid.max() if grid.size else 0
+    if peak <= 0:
+        levels = np.zeros(grid.shape, dtype=np.uint8)
+    else:
+        levels = np.clip(grid * (255 / peak), 0, 255).astype(np.uint8)
+    pixels = np.ascontiguousarray(COLOR_TABLE[levels])
+    rows, columns = pixels.shape
+    image = QImage(pixels.data, columns, rows, 4 * columns, QImage.Format.Format_ARGB32_Premultiplied)
+    # Detach from the NumPy buffer before it goes away
+    return image.copy()
+
+
+class HeatmapTask(QRunnable):
+    def __init__(self, key, coords, landmark, rect, renderer):
+        super().__init__()
+        self.key = key
+        self.coords = coords
+        self.landmark = landmark
+        self.rect = rect
+        self.renderer = renderer
+
+    def run(self):
+        coords = self.coords
+        if self.landmark is not None:
+            coords = coords[(coords[:, 2] == self.landmark[0]) & (coords[:, 3] == self.landmark[1])]
+        rect = self.rect
+        if rect is None:
+            rect = fit_rect(coords[:, :2])
+        image = render_density(density_grid(coords[:, :2], rect))
+        self.renderer.rendered.emit(self.key, image, QRectF(*rect))
+
+# Rectangle around points with room for the kernel tails
+def fit_rect(xy):
+    xy = xy[np.isfinite(xy).all(axis=1)]
+    if len(xy) == 0:
+        return (0.0, 0.0, 1.0, 1.0)
+    low = xy.min(axis=0)
+    high = xy.max(axis=0)
+    margin = max(KERNEL_EXTENT * scott_bandwidth(xy), 10.0)
+    return (float(low[0] - margin), float(low[1] - margin),
+            float(high[0] - low[0] + 2 * margin), float(high[1] - low[1] + 2 * margin))
+
+
+# Computes heatmaps on a worker thread and keeps recent ones in a cache keyed
+# by what they show and the version of the estimates they were computed from.
+# Only the heatmap last requested is reported through ready, with its key.
+class HeatmapRenderer(QObject):
+    ready = pyqtSignal(object, QImage, QRectF)
+    rendered = pyqtSignal(object, QImage, QRectF)
+
+    def __init__(self, budget: int = 64 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.cache = TileCache(budget)
+        self.pending = set()
+        self.wanted = None
+        self.rendered.connect(self.onRendered)
+
+    # Request the heatmap of the estimate rows (x, y, true_x, true_y) in
+    # coords, restricted to one true landmark position if landmark is set.
+    # rect is the scene area (x, y, width, height), or None to fit the points.
+    def request(self, key, coords, landmark=None, rect=None):
+        self.wanted = key
+        cached = self.cache.get(('heatmap', key))
+        if cached is not None:
+            self.wanted = None
+            self.ready.emit(key, *cached)
+            return True
+        if key not in self.pending:
+            self.pending.add(key)
+            self.pool.start(HeatmapTask(key, coords, landmark, rect, self))
+        return False
+
+    def cancel(self):
+        self.wanted = None
+
+    def shutdown(self):
+        self.wanted = None
+        self.pool.clear()
+        self.pool.waitForDone()
+
+    def onRendered(self, key, image, rect):
+        self.pending.discard(key)
+        self.cache.put(('heatmap', key), _CachedHeatmap(image, rect))
+        if key == self.wanted:
+            self.wanted = None
+            self.ready.emit(key, image, rect)
+
+# Cache entry sized like its image for the cache budget
+class _CachedHeatmap(tuple):
+    def __new__(cls, image, rect):
+        return super().__new__(cls, (image, rect))
+
+    def sizeInBytes(self):
+        return self[0].sizeInBytes()
+
+
+# Heatmap image stretched over its scene rectangle
+class HeatmapItem(QGraphicsItem):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image = None
+        self.rect = QRectF()
+
+    def setImage(self, image, rect: QRectF):
+        self.prepareGeometryChange()
+        self.image = image
+        self.rect = QRectF(rect)
+        self.update()
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self.image = None
+        self.rect = QRectF()
+
+    def boundingRect(self):
+        return self.rect
+
+    def paint(self, painter, option, widget=None):
+        if self.image is None:
+            return
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+        painter.drawImage(self.rect, self.image)
+
+
+# Choice between no heatmap, all estimates and the estimates of one true
+# landmark. The landmark IDs are refreshed from the registry when the list
+# is opened.
+class HeatmapSelector(QComboBox):
+    def __init__(self, registry, parent=None):
+        super().__init__(parent)
+        self.setRegistry(registry)
+        self.addItems([NO_HEATMAP, ALL_ESTIMATES])
+
+    # Registries count their versions independently, so the list is rebuilt
+    # the next time it is opened
+    def setRegistry(self, registry):
+        self.registry = registry
+        self.version = None
+
+    def showPopup(self):
+        if self.version != self.registry.version:
+            self.version = self.registry.version
+            current = self.currentText()
+            self.blockSignals(True)
+            self.clear()
+            self.addItems([NO_HEATMAP, ALL_ESTIMATES] + self.registry.trueLandmarkIds())
+            index = self.findText(current)
+            self.setCurrentIndex(max(index, 0))
+            self.blockSignals(False)
+            if index < 0:
+                self.currentTextChanged.emit(self.currentText())
+        super().showPopup()
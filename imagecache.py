@@ -0,0 +1,325 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from PyQt6.QtCore import Qt, QSize, QStandardPaths
+from PyQt6.QtGui import QImage, QImageReader, QImageWriter
+
+# Entry layout: header, one level record per pyramid level, then the raw
+# pixel rows of every level starting at page aligned offsets
+CACHE_MAGIC = b'DTIMGC01'
+CACHE_EXTENSION = '.img'
+SIGNATURE_EXTENSION = '.sig'
+PREVIEW_EXTENSION = '.jpg'
+# Longer side of the previews shown while the full image loads
+PREVIEW_SIZE = 512
+# Folder below the user cache folder shared by the viewer and pregenerate.py
+CACHE_NAME = 'sketchmap-images'
+HEADER = struct.Struct('<8sI')
+LEVEL = struct.Struct('<IIIIQ')
+PAGE = mmap.ALLOCATIONGRANULARITY
+# Downsampled levels are stored until the longer side is at most this size
+MIN_LEVEL_SIZE = 1024
+
+
+def default_cache_folder():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericCacheLocation), CACHE_NAME)
+
+# Hash of the file content, so renamed or copied plans share an entry
+def file_hash(path: str):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Path, size and modification time of a file; a file with an unchanged
+# signature is not hashed again
+def file_signature(filename: str):
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+# Full resolution image followed by halved levels for zoomed out views
+def image_levels(image: QImage):
+    format = QImage.Format.Format_ARGB32_Premultiplied if image.hasAlphaChannel() else QImage.Format.Format_RGB32
+    levels = [image.convertToFormat(format)]
+    while max(levels[-1].width(), levels[-1].height()) > MIN_LEVEL_SIZE:
+        previous = levels[-1]
+        levels.append(previous.scaled(max(1, previous.width() // 2), max(1, previous.height() // 2),
+                                      Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation))
+    return levels
+
+
+# Read-only mapping of a cache entry. The images point straight into the
+# mapping, so the pixels live in the page cache shared by all processes and
+# are never copied into the heap.
+class MappedImage():
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count = HEADER.unpack_from(self.map, 0)
+            if magic != CACHE_MAGIC:
+                raise ValueError('not an image cache entry: ' + path)
+            view = memoryview(self.map)
+            self.levels = []
+            for index in range(count):
+                width, height, stride, format, offset = LEVEL.unpack_from(self.map, HEADER.size + index * LEVEL.size)
+                if offset + stride * height > len(self.map):
+                    raise ValueError('truncated image cache entry: ' + path)
+                self.levels.append(QImage(view[offset:offset + stride * height], width, height, stride, QImage.Format(format)))
+        except (ValueError, struct.error):
+            self.map.close()
+            raise
+
+    def image(self):
+        return self.levels[0]
+
+
+# On-disk cache of decoded images and their downsampled levels, keyed by the
+# hash of the image file, plus small JPEG previews shown while an image is
+# loading. Content hashes are remembered in small signature files, so files
+# are only hashed again when they change. Entries are written to a temporary
+# file and renamed into place, so concurrent instances sharing the folder
+# only ever see whole entries. Least recently opened entries and previews
+# are deleted when they grow past their budgets; mappings held by other
+# instances stay valid on POSIX and entries that cannot be deleted while in
+# use are skipped.
+class DiskImageCache():
+    def __init__(self, folder: str, budget: int = 2 * 1024 * 1024 * 1024, preview_budget: int = 256 * 1024 * 1024):
+        self.folder = folder
+        self.budget = budget
+        self.preview_budget = preview_budget
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        # (path, size, mtime) -> content hash, saves rehashing unchanged files
+        self.hashes = {}
+        # Mappings handed out in this session, kept alive for their images
+        # until released
+        self.mappings = {}
+
+    def entryPath(self, key: str):
+        return os.path.join(self.folder, key + CACHE_EXTENSION)
+
+    def previewPath(self, key: str):
+        return os.path.join(self.folder, key + PREVIEW_EXTENSION)
+
+    def signaturePath(self, signature):
+        name = hashlib.blake2b(json.dumps(signature).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.folder, name + SIGNATURE_EXTENSION)
+
+    # Content hash of a file if it is known without hashing, else None
+    def knownKey(self, filename: str):
+        signature = file_signature(filename)
+        with self.lock:
+            key = self.hashes.get(signature)
+        if key is None:
+            try:
+                with open(self.signaturePath(signature), 'r') as file:
+                    key = file.read().strip() or None
+            except OSError:
+                return None
+            with self.lock:
+                self.hashes[signature] = key
+        return key
+
+    def key(self, filename: str):
+        key = self.knownKey(filename)
+        if key is None:
+            signature = file_signature(filename)
+            key = file_hash(filename)
+            with self.lock:
+                self.hashes[signature] = key
+            try:
+                self.replace(self.signaturePath(signature), lambda file: file.write(key.encode('ascii')))
+            except OSError:
+                pass
+        return key
+
+    # Write a file atomically through a temporary file in the cache folder
+    def replace(self, path: str, write):
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.folder)
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                write(file)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # Mapped image of a file, or None if it is not cached yet
+    def open(self, filename: str):
+        key = self.key(filename)
+        with self.lock:
+            mapped = self.mappings.get(key)
+        if mapped is not None:
+            return mapped
+        path = self.entryPath(key)
+        try:
+            mapped = MappedImage(path)
+            # Mark as recently used for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            return self.mappings.setdefault(key, mapped)
+
+    # Forget the mapping of a file once its images are no longer used. Images
+    # still drawn keep the memory mapped, copies of them must not outlive it.
+    def release(self, filename: str):
+        key = self.knownKey(filename)
+        if key is not None:
+            with self.lock:
+                self.mappings.pop(key, None)
+
+    def contains(self, filename: str):
+        return os.path.exists(self.entryPath(self.key(filename)))
+
+    # Store a decoded image of a file and return its mapping, or None with
+    # map=False when the caller does not need the image
+    def store(self, filename: str, image: QImage, map: bool = True):
+        key = self.key(filename)
+        levels = image_levels(image)
+        offset = HEADER.size + len(levels) * LEVEL.size
+        records = []
+        for level in levels:
+            offset = -(-offset // PAGE) * PAGE
+            records.append((level.width(), level.height(), level.bytesPerLine(), level.format().value, offset))
+            offset += level.sizeInBytes()
+
+        def write(file):
+            file.write(HEADER.pack(CACHE_MAGIC, len(levels)))
+            for record in records:
+                file.write(LEVEL.pack(*record))
+            for level, record in zip(levels, records):
+                file.seek(record[4])
+                file.write(level.constBits().asstring(level.sizeInBytes()))
+        self.replace(self.entryPath(key), write)
+        if not self.hasPreview(filename):
+            self.storePreview(filename, levels[-1], image.size())
+        self.evict(keep=key)
+        return self.open(filename) if map else None
+
+    def hasPreview(self, filename: str):
+        return os.path.exists(self.previewPath(self.key(filename)))
+
+    # Store a preview of a file, image may already be downsampled. size is the
+    # size of the full image, kept in the preview to place it in the scene.
+    def storePreview(self, filename: str, image: QImage, size: QSize = None):
+        size = size or image.size()
+        if max(image.width(), image.height()) > PREVIEW_SIZE:
+            image = image.scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        path = self.previewPath(self.key(filename))
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.folder)
+        os.close(handle)
+        try:
+            writer = QImageWriter(temp_path, b'jpg')
+            writer.setText('full_size', '{}x{}'.format(size.width(), size.height()))
+            if not writer.write(image):
+                raise OSError('could not write preview: ' + writer.errorString())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # Preview of a file and the size of the full image, or None. Never hashes
+    # the file, so it is cheap enough for the GUI thread.
+    def preview(self, filename: str):
+        key = self.knownKey(filename)
+        if key is None:
+            return None
+        path = self.previewPath(key)
+        reader = QImageReader(path)
+        width, _, height = reader.text('full_size').partition('x')
+        image = reader.read()
+        if image.isNull() or not width.isdigit() or not height.isdigit():
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image, QSize(int(width), int(height))
+
+    # Mapped image of a file, decoding and caching it on a miss. Returns None
+    # if the file cannot be decoded; a cache that cannot be written falls
+    # back to the decoded image.
+    def load(self, filename: str, decode):
+        mapped = self.open(filename)
+        if mapped is not None:
+            if not self.hasPreview(filename):
+                try:
+                    self.storePreview(filename, mapped.levels[-1], mapped.image().size())
+                except OSError:
+                    pass
+            return mapped.image(), mapped.levels
+        image = decode(filename)
+        if image.isNull():
+            return None
+        try:
+            mapped = self.store(filename, image)
+        except OSError:
+            mapped = None
+        if mapped is None:
+            return image, [image]
+        return mapped.image(), mapped.levels
+
+    # Delete the least recently used entries and previews until each fit
+    # their budget, then the signature files of images with neither left
+    def evict(self, keep: str = None):
+        removed = self.evictFiles(CACHE_EXTENSION, self.budget, keep)
+        removed += self.evictFiles(PREVIEW_EXTENSION, self.preview_budget, keep)
+        if removed:
+            self.evictSignatures()
+
+    # Returns the number of files deleted
+    def evictFiles(self, extension: str, budget: int, keep: str = None):
+        entries = []
+        kept = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(extension):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            if name == str(keep) + extension:
+                kept = stat.st_size
+            else:
+                entries.append((stat.st_mtime, stat.st_size, name))
+        used = kept + sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in sorted(entries):
+            if used <= budget:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                # Removed by another instance, or in use on Windows
+                continue
+            used -= size
+            removed += 1
+        return removed
+
+    # Delete signature files whose image has no entry and no preview anymore
+    def evictSignatures(self):
+        names = os.listdir(self.folder)
+        cached = {os.path.splitext(name)[0] for name in names if name.endswith((CACHE_EXTENSION, PREVIEW_EXTENSION))}
+        for name in names:
+            if not name.endswith(SIGNATURE_EXTENSION):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                with open(path, 'r') as file:
+                    key = file.read().strip()
+                if key not in cached:
+                    os.remove(path)
+            except OSError:
+                continue
+        with self.lock:
+            self.hashes = {signature: key for signature, key in self.hashes.items() if key in cached}
@@ -0,0 +1,46 @@
+# Check that the core imports without PyQt6 and within its time budget.
+# Every measurement runs in a fresh interpreter with PyQt6 blocked.
+import subprocess
+import sys
+
+# Budgets in milliseconds for running the statement in a fresh interpreter,
+# timed from just before it; interpreter start-up is not included
+IMPORT_BUDGETS = {
+    'import core': 50,
+    'import core; core.compute_errors': 400,
+    'import core; core.load_project': 400,
+}
+
+_MEASURE = """
+import sys, time
+sys.modules['PyQt6'] = None
+start = time.perf_counter()
+{statement}
+print((time.perf_counter() - start) * 1000)
+"""
+
+def measure(statement: str, repeat: int = 5):
+    # Best of several runs to hide disk cache and scheduler noise
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _MEASURE.format(statement=statement)],
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output))
+    return min(timings)
+
+def main():
+    failed = False
+    for statement, budget in IMPORT_BUDGETS.items():
+        try:
+            elapsed = measure(statement)
+        except subprocess.CalledProcessError as error:
+            print('FAIL  {}: {}'.format(statement, error.stderr.strip().splitlines()[-1]))
+            failed = True
+            continue
+        status = 'ok  ' if elapsed <= budget else 'FAIL'
+        failed = failed or elapsed > budget
+        print('{}  {:7.1f} ms / {:4d} ms  {}'.format(status, elapsed, budget, statement))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# Bulk import of coordinates digitized elsewhere. Tables are CSV files with a
+# header; one table may hold true landmarks, estimates or both:
+#
+#   kind       true, reference, landmark or edge. Without it rows with a
+#              participant are landmark estimates, other rows true landmarks
+#   id         point ID (the 'estimate' column of exported tables also works)
+#   x, y       scene coordinates in pixels
+#   participant            owner of an estimate
+#   true_x, true_y         position of the estimated true landmark, or
+#   landmark               ID of the estimated true landmark instead
+#   dir_x, dir_y           reference direction of a reference landmark
+#
+# Rows are read lazily and handed out in chunks, so large tables are never
+# held in memory as a whole.
+import csv
+import math
+from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint
+
+IMPORT_CHUNK = 5000
+IMPORT_KINDS = ('true', 'reference', 'landmark', 'edge')
+
+
+def _number(row, column: str, line: int):
+    value = row.get(column)
+    if value is None or value.strip() == '':
+        raise ValueError('line ' + str(line) + ': missing ' + column)
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError('line ' + str(line) + ': ' + column + ' is not a number: ' + repr(value)) from None
+
+def _optional_number(row, column: str, line: int):
+    value = row.get(column)
+    if value is None or value.strip() == '':
+        return math.nan
+    return _number(row, column, line)
+
+# Points of a CSV table as (point, participant ID) pairs, the participant ID
+# is None for true and reference landmarks. true_landmarks maps IDs to known
+# true landmarks and is extended with the landmarks read, so estimates can
+# refer to landmarks by ID. Unresolved estimates get NaN true coordinates,
+# like points placed with the quick estimate tool.
+def read_points(file, true_landmarks=None):
+    true_landmarks = {} if true_landmarks is None else true_landmarks
+    reader = csv.DictReader(file)
+    if reader.fieldnames is None:
+        return
+    columns = set(reader.fieldnames)
+    missing = {'x', 'y'} - columns
+    if missing:
+        raise ValueError('missing columns: ' + ', '.join(sorted(missing)))
+    id_column = 'id' if 'id' in columns else 'estimate'
+
+    for row in reader:
+        line = reader.line_num
+        kind = (row.get('kind') or '').strip().lower()
+        participant = (row.get('participant') or '').strip() or None
+        if not kind:
+            kind = 'landmark' if participant is not None else 'true'
+        if kind not in IMPORT_KINDS:
+            raise ValueError('line ' + str(line) + ': unknown kind ' + repr(kind))
+        id = (row.get(id_column) or '').strip()
+        x = _number(row, 'x', line)
+        y = _number(row, 'y', line)
+
+        if kind == 'true':
+            point = TrueLandmark(x, y, id)
+            true_landmarks.setdefault(id, point)
+            yield point, None
+        elif kind == 'reference':
+            yield ReferenceLandmark(x, y, id, _number(row, 'dir_x', line), _number(row, 'dir_y', line)), None
+        else:
+            if participant is None:
+                raise ValueError('line ' + str(line) + ': estimate without participant')
+            true_x = _optional_number(row, 'true_x', line)
+            true_y = _optional_number(row, 'true_y', line)
+            landmark = true_landmarks.get((row.get('landmark') or '').strip())
+            if (math.isnan(true_x) or math.isnan(true_y)) and landmark is not None:
+                true_x, true_y = landmark.x, landmark.y
+            cls = EdgePoint if kind == 'edge' else EstimatedLandmark
+            yield cls(x, y, id, true_x, true_y, participant), participant
+
+# Read a CSV file in chunks of at most chunk_size (point, participant ID)
+# pairs. Tables with landmarks should be read before the estimates that
+# refer to them by ID.
+def read_csv(path: str, true_landmarks=None, chunk_size: int = IMPORT_CHUNK):
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        chunk = []
+        for pair in read_points(file, true_landmarks):
+            chunk.append(pair)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
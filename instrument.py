@@ -0,0 +1,302 @@
+# Latency instrumentation for the interactive paths: tool clicks, point
+# handlers, image loads and repaints, plus an event loop stall detector.
+# Recording is off by default; disabled timers are a shared no-op object so
+# the instrumented code pays one attribute check per call.
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from functools import wraps
+import numpy as np
+from PyQt6.QtCore import QObject, QTimer, Qt
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QCheckBox, QPushButton, QTableWidget,
+                             QTableWidgetItem, QPlainTextEdit, QFileDialog, QHeaderView)
+
+# Samples kept per series for the rolling statistics
+WINDOW = 2048
+# Histogram bucket edges in seconds, 50 us to 10 s with two buckets per octave
+BUCKETS = 50e-6 * 2**(np.arange(36) / 2)
+# Event loop heartbeat interval and the lag counted as a stall, in seconds
+TICK_INTERVAL = 0.02
+STALL_THRESHOLD = 0.1
+# Stall reports with the GUI thread stack that are kept
+MAX_STALLS = 20
+
+
+# Rolling window of latencies in seconds plus lifetime totals
+class Series():
+    def __init__(self):
+        self.samples = np.zeros(WINDOW)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.samples[self.count % WINDOW] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def window(self):
+        return self.samples[:min(self.count, WINDOW)]
+
+    def summary(self):
+        window = self.window()
+        p50, p90, p99 = np.percentile(window, [50, 90, 99]) if len(window) else (0.0, 0.0, 0.0)
+        counts = np.histogram(np.clip(window, BUCKETS[0], BUCKETS[-1]), bins=BUCKETS)[0]
+        return {
+            'count': self.count, 'mean': self.total / self.count if self.count else 0.0, 'max': self.max,
+            'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+            'histogram': counts.tolist(),
+        }
+
+
+class _Timer():
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+# Collects latency series by name, safe to use from worker threads
+class Recorder():
+    def __init__(self):
+        self.enabled = False
+        self.series = {}
+        self.stalls = deque(maxlen=MAX_STALLS)
+        self.lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = Series()
+            series.add(seconds)
+
+    # Context manager timing a block while recording is enabled
+    def timer(self, name: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def stall(self, seconds: float, stack):
+        self.record('event_loop.stall', seconds)
+        with self.lock:
+            self.stalls.append({'time': time.time(), 'duration': seconds, 'stack': stack})
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+            self.stalls.clear()
+
+    def summary(self):
+        with self.lock:
+            series = {name: series.summary() for name, series in sorted(self.series.items())}
+            stalls = list(self.stalls)
+        return {'buckets': BUCKETS.tolist(), 'series': series, 'stalls': stalls}
+
+    def dump(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+recorder = Recorder()
+
+# Decorator timing every call of a function while recording is enabled
+def timed(name: str):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# Measures how late a short GUI thread timer fires. A watchdog thread takes
+# a snapshot of the GUI thread stack when the heartbeat stops, so stalls can
+# be traced to the code that blocked the event loop.
+class StallDetector(QObject):
+    def __init__(self, recorder: Recorder, parent=None):
+        super().__init__(parent)
+        self.recorder = recorder
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setInterval(int(TICK_INTERVAL * 1000))
+        self.timer.timeout.connect(self.tick)
+        self.gui_thread = threading.get_ident()
+        self.heartbeat = time.perf_counter()
+        self.stack = None
+        self.watchdog = None
+        self.running = threading.Event()
+
+    def start(self):
+        if self.timer.isActive():
+            return
+        self.heartbeat = time.perf_counter()
+        self.stack = None
+        self.timer.start()
+        self.running.set()
+        self.watchdog = threading.Thread(target=self.watch, name='stall-watchdog', daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.running.clear()
+        if self.watchdog is not None:
+            self.watchdog.join()
+            self.watchdog = None
+
+    def tick(self):
+        now = time.perf_counter()
+        lag = max(now - self.heartbeat - TICK_INTERVAL, 0.0)
+        self.heartbeat = now
+        self.recorder.record('event_loop.lag', lag)
+        if lag >= STALL_THRESHOLD:
+            self.recorder.stall(lag, self.stack)
+        self.stack = None
+
+    def watch(self):
+        while self.running.is_set():
+            time.sleep(TICK_INTERVAL)
+            if self.stack is None and time.perf_counter() - self.heartbeat > STALL_THRESHOLD:
+                frame = sys._current_frames().get(self.gui_thread)
+                if frame is not None:
+                    self.stack = ''.join(traceback.format_stack(frame))
+
+
+# Table of the recorded series with the histogram of the selected one
+class DebugPanel(QDialog):
+    COLUMNS = ['series', 'count', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms']
+
+    def __init__(self, recorder: Recorder, detector: StallDetector, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Performance')
+        self.resize(640, 480)
+        self.recorder = recorder
+        self.detector = detector
+        self.summary = {'series': {}, 'stalls': []}
+
+        self.enabledBox = QCheckBox('Record')
+        self.enabledBox.setChecked(recorder.enabled)
+        self.resetBtn = QPushButton('Reset')
+        self.dumpBtn = QPushButton('Dump...')
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.details = QPlainTextEdit()
+        self.details.setReadOnly(True)
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setInterval(1000)
+
+        self.enabledBox.toggled.connect(self.setRecording)
+        self.resetBtn.clicked.connect(self.reset)
+        self.dumpBtn.clicked.connect(self.dump)
+        self.table.itemSelectionChanged.connect(self.showDetails)
+        self.refreshTimer.timeout.connect(self.refresh)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.enabledBox)
+        buttons.addStretch()
+        buttons.addWidget(self.resetBtn)
+        buttons.addWidget(self.dumpBtn)
+        layout = QVBoxLayout()
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        layout.addWidget(self.details)
+        self.setLayout(layout)
+
+    def setRecording(self, enabled: bool):
+        self.recorder.enabled = enabled
+        if enabled:
+            self.detector.start()
+        else:
+            self.detector.stop()
+
+    def reset(self):
+        self.recorder.reset()
+        self.refresh()
+
+    def dump(self):
+        filename, _ = QFileDialog.getSaveFileName(self, 'Dump Timings', 'timings.json', 'JSON Files (*.json)')
+        if filename:
+            self.recorder.dump(filename)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refreshTimer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refreshTimer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        selected = self.selectedSeries()
+        self.summary = self.recorder.summary()
+        series = self.summary['series']
+        self.table.setRowCount(len(series))
+        for row, (name, values) in enumerate(series.items()):
+            cells = [name, str(values['count'])] + ['{:.2f}'.format(values[key] * 1000) for key in ('mean', 'p50', 'p90', 'p99', 'max')]
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if column > 0:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+            if name == selected:
+                self.table.selectRow(row)
+        self.showDetails()
+
+    def selectedSeries(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        item = self.table.item(rows[0].row(), 0)
+        return item.text() if item is not None else None
+
+    # Text histogram of the selected series and the latest stall stacks
+    def showDetails(self):
+        lines = []
+        name = self.selectedSeries()
+        values = self.summary['series'].get(name)
+        if values is not None:
+            counts = values['histogram']
+            peak = max(max(counts), 1)
+            lines.append(name + ', last ' + str(min(values['count'], WINDOW)) + ' calls')
+            for low, count in zip(BUCKETS, counts):
+                if count:
+                    lines.append('{:>10.2f} ms {:>6} {}'.format(low * 1000, count, '#' * max(1, round(40 * count / peak))))
+            lines.append('')
+        for stall in reversed(self.summary['stalls']):
+            lines.append('Stall of {:.0f} ms at {}'.format(stall['duration'] * 1000, time.strftime('%H:%M:%S', time.localtime(stall['time']))))
+            lines.append(stall['stack'] or '  (no stack captured)')
+        self.details.setPlainText('\n'.join(lines))
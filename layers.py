@@ -0,0 +1,467 @@
+from itertools import count
+from math import cos, sin, pi, isnan
+import numpy as np
+from PyQt6.QtCore import QPointF, QLineF, QRectF, Qt
+from PyQt6.QtGui import QPen, QBrush, QColor, QFont, QFontMetricsF, QPolygonF
+from PyQt6.QtWidgets import QGraphicsItem
+from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint, EstimatedPoint
+
+# Radius of a point marker in scene units
+MARKER_RADIUS = 5
+# Extra scene distance searched around the exposed area for labels
+LABEL_MARGIN = 200
+
+# Level of detail: labels are hidden below this zoom factor
+LABEL_MIN_SCALE = 0.75
+# Markers smaller than this on screen, or more visible markers than
+# MAX_DETAILED_MARKERS, are merged into one dot per cell of CLUSTER_CELL_PX
+CLUSTER_RADIUS_PX = 3
+CLUSTER_CELL_PX = 6
+MAX_DETAILED_MARKERS = 2000
+# Lines are snapped to device pixels and deduplicated below full zoom or
+# above this count; the estimate ends are snapped to coarser cells until at
+# most MAX_SIMPLIFIED_LINES remain
+MAX_DETAILED_LINES = 2000
+MAX_SIMPLIFIED_LINES = 3000
+
+TRUE_COLOR = '#77dd77'
+REFERENCE_COLOR = '#a1caf1'
+ESTIMATE_COLOR = '#fd7c6e'
+EDGE_COLOR = '#b39eb5'
+
+# Pens, brushes and the label font are shared by all layers
+_pens = {}
+_brushes = {}
+_dot_pens = {}
+_font = None
+_versions = count()
+
+def shared_pen(color: str):
+    pen = _pens.get(color)
+    if pen is None:
+        pen = _pens[color] = QPen(QColor(color))
+    return pen
+
+def shared_brush(color: str):
+    brush = _brushes.get(color)
+    if brush is None:
+        brush = _brushes[color] = QBrush(QColor(color))
+    return brush
+
+# Round pen drawing a filled marker of the given pixel radius with drawPoints
+def dot_pen(color: str, radius: float):
+    key = (color, round(radius * 2) / 2)
+    pen = _dot_pens.get(key)
+    if pen is None:
+        pen = _dot_pens[key] = QPen(QColor(color), 2 * key[1], Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
+    return pen
+
+# Distinct rows of an integer array, packed into one key per row when the
+# value ranges allow it since that is much faster than np.unique(axis=0)
+def unique_rows(rows):
+    if len(rows) == 0:
+        return rows
+    low = rows.min(axis=0)
+    span = rows.max(axis=0) - low + 1
+    try:
+        keys = np.unique(np.ravel_multi_index(tuple((rows - low).T), tuple(span.tolist())))
+    except ValueError:
+        return np.unique(rows, axis=0)
+    return np.column_stack(np.unravel_index(keys, tuple(span.tolist()))) + low
+
+# QPolygonF filled straight from an (n, 2) array without per-point objects
+def polygon_from_array(xy):
+    xy = np.ascontiguousarray(xy, dtype=np.float64).reshape(-1, 2)
+    polygon = QPolygonF()
+    polygon.resize(len(xy))
+    if len(xy):
+        buffer = polygon.data()
+        buffer.setsize(xy.nbytes)
+        np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = xy
+    return polygon
+
+def shared_font():
+    global _font
+    if _font is None:
+        _font = QFont('Arial', 10)
+    return _font
+
+
+# Base for items drawing a whole set of annotations. Coordinates are kept in
+# a growable NumPy array; removal swaps the last row into the freed slot so
+# insert and delete are constant time.
+class ArrayLayer(QGraphicsItem):
+    columns = 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.points = []
+        self.slots = {}
+        self.coords = np.empty((64, self.columns))
+        self.bounds = QRectF()
+        # Changes on every change of the points, for derived caches. Drawn from
+        # one counter so versions of different layers never collide.
+        self.version = next(_versions)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, point):
+        return point in self.slots
+
+    def rowFor(self, point):
+        return (point.x, point.y)
+
+    # Scene rectangle covered when drawing this point
+    def extentFor(self, point):
+        return QRectF(point.x - MARKER_RADIUS, point.y - MARKER_RADIUS, 2 * MARKER_RADIUS, 2 * MARKER_RADIUS)
+
+    def add(self, point):
+        self.addMany([point])
+
+    def addMany(self, points):
+        points = list(points)
+        if not points:
+            return
+        start = len(self.points)
+        end = start + len(points)
+        if end > len(self.coords):
+            grown = np.empty((max(end, 2 * len(self.coords)), self.columns))
+            grown[:start] = self.coords[:start]
+            self.coords = grown
+        self.coords[start:end] = [self.rowFor(point) for point in points]
+
+        extent = QRectF()
+        for index, point in enumerate(points, start):
+            self.slots[point] = index
+            extent = extent.united(self.extentFor(point))
+        self.points.extend(points)
+        self.version = next(_versions)
+
+        if not self.bounds.contains(extent):
+            self.prepareGeometryChange()
+            self.bounds = self.bounds.united(extent)
+        self.update(extent)
+
+    def remove(self, point):
+        index = self.slots.pop(point)
+        last = len(self.points) - 1
+        if index != last:
+            moved = self.points[last]
+            self.points[index] = moved
+            self.coords[index] = self.coords[last]
+            self.slots[moved] = index
+        self.points.pop()
+        self.version = next(_versions)
+        self.update(self.extentFor(point))
+
+    # Refresh the stored coordinates after a point was changed in place
+    def refresh(self, point, old_extent=None):
+        self.refreshMany([point], old_extent)
+
+    # Refresh several changed points with one geometry change and update.
+    # old_extent covers where they were drawn before the change.
+    def refreshMany(self, points, old_extent=None):
+        points = [point for point in points if point in self.slots]
+        if not points:
+            return
+        self.coords[[self.slots[point] for point in points]] = [self.rowFor(point) for point in points]
+        self.version = next(_versions)
+        extent = QRectF()
+        for point in points:
+            extent = extent.united(self.extentFor(point))
+        if not self.bounds.contains(extent):
+            self.prepareGeometryChange()
+            self.bounds = self.bounds.united(extent)
+        self.update(extent if old_extent is None else extent.united(old_extent))
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self.points = []
+        self.slots = {}
+        self.bounds = QRectF()
+        self.version = next(_versions)
+        self.update()
+
+    def boundingRect(self):
+        return self.bounds
+
+    # Indices of the points intersecting a scene rectangle
+    def visibleIndices(self, rect: QRectF, margin: float = MARKER_RADIUS):
+        coords = self.coords[:len(self.points)]
+        mask = ((coords[:, 0] >= rect.left() - margin) & (coords[:, 0] <= rect.right() + margin) &
+                (coords[:, 1] >= rect.top() - margin) & (coords[:, 1] <= rect.bottom() + margin))
+        return np.flatnonzero(mask)
+
+    # Map scene coordinate arrays to device pixels with the painter transform
+    @staticmethod
+    def toDevice(painter, x, y):
+        transform = painter.worldTransform()
+        return (transform.m11() * x + transform.m21() * y + transform.dx(),
+                transform.m12() * x + transform.m22() * y + transform.dy())
+
+
+# Markers and labels of one kind of point
+class PointLayer(ArrayLayer):
+    def __init__(self, color: str, parent=None):
+        super().__init__(parent)
+        self.color = color
+        self.metrics = QFontMetricsF(shared_font())
+
+    def extentFor(self, point):
+        # Marker plus the label drawn to its lower right
+        return QRectF(point.x - MARKER_RADIUS, point.y - MARKER_RADIUS,
+                      3 * MARKER_RADIUS + self.metrics.horizontalAdvance(point.id) + 4,
+                      3 * MARKER_RADIUS + self.metrics.height() + 4)
+
+    # Point whose marker lies within tolerance of a scene position
+    def pointAt(self, pos: QPointF, tolerance: float = MARKER_RADIUS):
+        if not self.points:
+            return None
+        coords = self.coords[:len(self.points)]
+        distances = (coords[:, 0] - pos.x())**2 + (coords[:, 1] - pos.y())**2
+        index = int(np.argmin(distances))
+        if distances[index] <= tolerance**2:
+            return self.points[index]
+        return None
+
+    def paint(self, painter, option, widget=None):
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        labels = scale >= LABEL_MIN_SCALE
+        indices = self.visibleIndices(option.exposedRect, LABEL_MARGIN if labels else MARKER_RADIUS)
+        if len(indices) == 0:
+            return
+        if MARKER_RADIUS * scale < CLUSTER_RADIUS_PX or len(indices) > MAX_DETAILED_MARKERS:
+            self.paintClustered(painter, indices, max(MARKER_RADIUS * scale, 2))
+            return
+        points = self.points
+        coords = self.coords
+
+        painter.setPen(shared_pen(self.color))
+        painter.setBrush(shared_brush(self.color))
+        for index in indices:
+            painter.drawEllipse(QPointF(coords[index, 0], coords[index, 1]), MARKER_RADIUS, MARKER_RADIUS)
+
+        if not labels:
+            return
+        painter.setPen(shared_pen('black'))
+        painter.setFont(shared_font())
+        offset = MARKER_RADIUS + 4
+        ascent = self.metrics.ascent()
+        for index in indices:
+            painter.drawText(QPointF(coords[index, 0] + offset, coords[index, 1] + offset + ascent), points[index].id)
+
+    # Draw one dot per occupied screen cell instead of every marker
+    def paintClustered(self, painter, indices, radius: float):
+        x, y = self.toDevice(painter, self.coords[indices, 0], self.coords[indices, 1])
+        cell = max(CLUSTER_CELL_PX, radius)
+        cells = unique_rows(np.floor(np.column_stack((x, y)) / cell).astype(np.int64))
+        centers = (cells + 0.5) * cell
+
+        painter.save()
+        painter.resetTransform()
+        painter.setPen(dot_pen(self.color, radius))
+        painter.drawPoints(polygon_from_array(centers))
+        painter.restore()
+
+
+# Lines between estimated points and their true landmark
+class ConnectionLayer(ArrayLayer):
+    columns = 4
+
+    def rowFor(self, point):
+        return (point.x, point.y, point.true_x, point.true_y)
+
+    def extentFor(self, point):
+        # Estimates without a true landmark yet have no line
+        if isnan(point.true_x) or isnan(point.true_y):
+            return QRectF(point.x - 1, point.y - 1, 2, 2)
+        return QRectF(QPointF(point.x, point.y), QPointF(point.true_x, point.true_y)).normalized().adjusted(-1, -1, 1, 1)
+
+    def visibleIndices(self, rect: QRectF, margin: float = 1):
+        coords = self.coords[:len(self.points)]
+        min_x = np.minimum(coords[:, 0], coords[:, 2])
+        max_x = np.maximum(coords[:, 0], coords[:, 2])
+        min_y = np.minimum(coords[:, 1], coords[:, 3])
+        max_y = np.maximum(coords[:, 1], coords[:, 3])
+        mask = ((max_x >= rect.left() - margin) & (min_x <= rect.right() + margin) &
+                (max_y >= rect.top() - margin) & (min_y <= rect.bottom() + margin))
+        return np.flatnonzero(mask)
+
+    def paint(self, painter, option, widget=None):
+        indices = self.visibleIndices(option.exposedRect)
+        if len(indices) == 0:
+            return
+        painter.setPen(shared_pen('black'))
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        if scale >= 1 and len(indices) <= MAX_DETAILED_LINES:
+            # Point pairs, one pair per line
+            painter.drawLines(polygon_from_array(self.coords[indices]))
+            return
+
+        # Snap the ends to device pixels, or to the marker cluster cells when
+        # markers are clustered, then drop lines without length and duplicates
+        coords = self.coords[indices]
+        x1, y1 = self.toDevice(painter, coords[:, 0], coords[:, 1])
+        x2, y2 = self.toDevice(painter, coords[:, 2], coords[:, 3])
+        cell = CLUSTER_CELL_PX if MARKER_RADIUS * scale < CLUSTER_RADIUS_PX else 1
+        true_ends = (np.floor(np.column_stack((x2, y2)) / cell) + 0.5) * cell
+        estimate_cell = cell
+        while True:
+            estimate_ends = (np.floor(np.column_stack((x1, y1)) / estimate_cell) + 0.5) * estimate_cell
+            lines = np.rint(np.column_stack((estimate_ends, true_ends))).astype(np.int64)
+            lines = unique_rows(lines[(lines[:, 0] != lines[:, 2]) | (lines[:, 1] != lines[:, 3])])
+            # Bundle lines of nearby estimates going to the same landmark
+            if len(lines) <= MAX_SIMPLIFIED_LINES or estimate_cell >= 64:
+                break
+            estimate_cell *= 2
+
+        painter.save()
+        painter.resetTransform()
+        painter.drawLines(polygon_from_array(lines))
+        painter.restore()
+
+
+# Reference landmark with an arrow pointing in the reference direction
+class ReferenceItem(QGraphicsItem):
+    def __init__(self, reference: ReferenceLandmark, parent=None):
+        super().__init__(parent)
+        self.reference = reference
+        self.arrow_head = create_arrow_head(reference.x, reference.y, reference.dir_x, reference.dir_y)
+        metrics = QFontMetricsF(shared_font())
+        self.bounds = QRectF(QPointF(reference.x, reference.y), QPointF(reference.dir_x, reference.dir_y)).normalized()
+        self.bounds = self.bounds.united(self.arrow_head.boundingRect())
+        self.bounds = self.bounds.united(QRectF(reference.x - MARKER_RADIUS, reference.y - MARKER_RADIUS,
+                                                3 * MARKER_RADIUS + metrics.horizontalAdvance(reference.id) + 4,
+                                                3 * MARKER_RADIUS + metrics.height() + 4))
+        self.ascent = metrics.ascent()
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        reference = self.reference
+        painter.setPen(shared_pen('black'))
+        painter.drawLine(QLineF(reference.x, reference.y, reference.dir_x, reference.dir_y))
+        painter.setBrush(shared_brush('black'))
+        painter.drawPolygon(self.arrow_head)
+
+        painter.setPen(shared_pen(REFERENCE_COLOR))
+        painter.setBrush(shared_brush(REFERENCE_COLOR))
+        painter.drawEllipse(QPointF(reference.x, reference.y), MARKER_RADIUS, MARKER_RADIUS)
+
+        painter.setPen(shared_pen('black'))
+        painter.setFont(shared_font())
+        offset = MARKER_RADIUS + 4
+        painter.drawText(QPointF(reference.x + offset, reference.y + offset + self.ascent), reference.id)
+
+def create_arrow_head(x, y, dir_x, dir_y):
+    line = QLineF(x, y, dir_x, dir_y)
+    angle = line.angle()  # Get the angle of the line
+    arrow_size = 10  # Set the size of the arrow head
+
+    # Calculate the points of the arrow head
+    p1 = QPointF(dir_x, dir_y)
+    p2 = QPointF(dir_x + arrow_size * cos((angle + 150) * pi / 180),
+                dir_y - arrow_size * sin((angle + 150) * pi / 180))  # Flip y-coordinate
+    p3 = QPointF(dir_x + arrow_size * cos((angle - 150) * pi / 180),
+                dir_y - arrow_size * sin((angle - 150) * pi / 180))  # Flip y-coordinate
+
+    # Create a QPolygonF from the points
+    return QPolygonF([p1, p2, p3])
+
+
+# All annotation layers of one scene
+class AnnotationLayers():
+    def __init__(self, scene):
+        self.scene = scene
+        self.connections = ConnectionLayer()
+        self.true_landmarks = PointLayer(TRUE_COLOR)
+        self.estimates = PointLayer(ESTIMATE_COLOR)
+        self.edges = PointLayer(EDGE_COLOR)
+        self.reference = None
+
+        for z, layer in enumerate([self.connections, self.true_landmarks, self.estimates, self.edges]):
+            layer.setZValue(z - 1)
+            scene.addItem(layer)
+        # True landmarks rarely change, keep their rendering while panning
+        self.true_landmarks.setCacheMode(QGraphicsItem.CacheMode.DeviceCoordinateCache)
+
+    def layerFor(self, point):
+        if isinstance(point, EdgePoint):
+            return self.edges
+        if isinstance(point, EstimatedLandmark):
+            return self.estimates
+        if isinstance(point, TrueLandmark):
+            return self.true_landmarks
+        return None
+
+    def add(self, point):
+        self.addMany([point])
+
+    # Add points of any kind, one layer update per kind
+    def addMany(self, points):
+        by_layer = {}
+        for point in points:
+            if isinstance(point, ReferenceLandmark):
+                self.setReference(point)
+                continue
+            by_layer.setdefault(self.layerFor(point), []).append(point)
+        for layer, layer_points in by_layer.items():
+            layer.addMany(layer_points)
+            if layer is self.estimates or layer is self.edges:
+                self.connections.addMany(layer_points)
+
+    def remove(self, point):
+        if isinstance(point, ReferenceLandmark):
+            if self.reference is not None and self.reference.reference is point:
+                self.setReference(None)
+            return
+        self.layerFor(point).remove(point)
+        if isinstance(point, EstimatedPoint):
+            self.connections.remove(point)
+
+    # Scene area drawn for points in any layer, taken before changing them
+    # in place so refreshMany can clear where they were
+    def extentOf(self, points):
+        extent = QRectF()
+        for point in points:
+            for layer in [self.true_landmarks, self.estimates, self.edges, self.connections]:
+                if point in layer:
+                    extent = extent.united(layer.extentFor(point))
+        return extent
+
+    # Redraw points changed in place, in every layer showing them
+    def refreshMany(self, points, old_extent=None):
+        points = list(points)
+        for layer in [self.true_landmarks, self.estimates, self.edges, self.connections]:
+            layer.refreshMany([point for point in points if point in layer], old_extent)
+
+    def setReference(self, reference):
+        if self.reference is not None:
+            self.scene.removeItem(self.reference)
+            self.reference = None
+        if reference is not None:
+            self.reference = ReferenceItem(reference)
+            self.reference.setZValue(3)
+            self.reference.setCacheMode(QGraphicsItem.CacheMode.DeviceCoordinateCache)
+            self.scene.addItem(self.reference)
+
+    def clear(self):
+        for layer in [self.connections, self.true_landmarks, self.estimates, self.edges]:
+            layer.clear()
+        self.setReference(None)
+
+    # Topmost point near a scene position, used for hit testing
+    def pointAt(self, pos: QPointF, tolerance: float = MARKER_RADIUS):
+        reference = self.reference
+        if reference is not None:
+            ref = reference.reference
+            if (ref.x - pos.x())**2 + (ref.y - pos.y())**2 <= tolerance**2:
+                return ref
+        for layer in [self.edges, self.estimates, self.true_landmarks]:
+            point = layer.pointAt(pos, tolerance)
+            if point is not None:
+                return point
+        return None
@@ -0,0 +1,179 @@
+import os
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader
+from tiles import TileCache
+from instrument import timed
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.bmp')
+
+
+# Decode an image file, safe to call from worker threads
+@timed('image.decode')
+def decode_image(filename: str):
+    reader = QImageReader(filename)
+    reader.setAutoTransform(True)
+    return reader.read()
+
+# Sorted image files in a folder, matching the filter of the load dialog
+def image_files(folder: str):
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class DecodeTask(QRunnable):
+    def __init__(self, filename: str, loader):
+        super().__init__()
+        self.filename = filename
+        self.loader = loader
+
+    def run(self):
+        image = self.loader.read(self.filename)
+        # Signals emitted from the worker are delivered in the GUI thread
+        self.loader.decoded.emit(self.filename, image)
+
+
+# Decodes images on worker threads and keeps recently decoded and prefetched
+# images in a bounded cache. Only the image last requested with load() is
+# reported through imageLoaded, so cancelled and prefetched decodes just fill
+# the cache. With a disk cache, images decoded in earlier sessions are mapped
+# from it instead of being decoded again, and prefetching only fills the disk
+# cache; prefetched images are mapped again when they are shown.
+class ImageLoader(QObject):
+    imageLoaded = pyqtSignal(str, QImage)
+    loadFailed = pyqtSignal(str)
+    decoded = pyqtSignal(str, QImage)
+
+    def __init__(self, budget: int = 512 * 1024 * 1024, diskCache=None, parent=None):
+        super().__init__(parent)
+        self.diskCache = diskCache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.cache = TileCache(budget)
+        self.pending = set()
+        self.wanted = None
+        self.decoded.connect(self.onDecoded)
+
+    # Request an image, returns True if it was served from the cache
+    def load(self, filename: str):
+        self.wanted = filename
+        image = self.cache.get((filename, 'image'))
+        if image is not None:
+            self.wanted = None
+            self.imageLoaded.emit(filename, image)
+            return True
+        self.decode(filename)
+        return False
+
+    # Decode images in the background without showing them
+    def prefetch(self, filenames):
+        for filename in filenames:
+            if self.cache.get((filename, 'image')) is None:
+                self.decode(filename)
+
+    def cancel(self):
+        self.wanted = None
+
+    # Wait for running decodes, called before the application quits
+    def shutdown(self):
+        self.wanted = None
+        self.pool.clear()
+        self.pool.waitForDone()
+
+    def isLoading(self):
+        return self.wanted is not None
+
+    # Runs on the worker threads
+    def read(self, filename: str):
+        if self.diskCache is None:
+            return decode_image(filename)
+        try:
+            result = self.diskCache.load(filename, decode_image)
+        except OSError:
+            return decode_image(filename)
+        return QImage() if result is None else result[0]
+
+    # Cached preview of an image and the size of the full image, or None
+    def preview(self, filename: str):
+        if self.diskCache is None:
+            return None
+        try:
+            return self.diskCache.preview(filename)
+        except OSError:
+            return None
+
+    # Full resolution image and downsampled levels of a loaded image
+    def levelsFor(self, filename: str, image: QImage):
+        if self.diskCache is not None:
+            try:
+                mapped = self.diskCache.open(filename)
+            except OSError:
+                mapped = None
+            if mapped is not None:
+                return mapped.levels
+        return [image]
+
+    # Drop an image that is no longer shown, with the memory mapping behind it
+    def release(self, filename: str):
+        if self.diskCache is None or filename in self.pending:
+            return
+        self.cache.discard(filename)
+        try:
+            self.diskCache.release(filename)
+        except OSError:
+            pass
+
+    def decode(self, filename: str):
+        if filename in self.pending:
+            return
+        self.pending.add(filename)
+        self.pool.start(DecodeTask(filename, self))
+
+    def onDecoded(self, filename: str, image: QImage):
+        self.pending.discard(filename)
+        if filename != self.wanted and self.diskCache is not None:
+            # Prefetched into the disk cache, mapped again when shown
+            self.release(filename)
+            return
+        if not image.isNull():
+            self.cache.put((filename, 'image'), image)
+        if filename != self.wanted:
+            return
+        self.wanted = None
+        if image.isNull():
+            self.loadFailed.emit(filename)
+        else:
+            self.imageLoaded.emit(filename, image)
+
+
+# Previous/next navigation through the images of a folder
+class FolderNavigator():
+    def __init__(self, prefetch_count: int = 2):
+        self.prefetch_count = prefetch_count
+        self.files = []
+        self.index = -1
+
+    def setCurrent(self, filename: str):
+        folder = os.path.dirname(os.path.abspath(filename))
+        self.files = image_files(folder)
+        path = os.path.abspath(filename)
+        self.index = self.files.index(path) if path in self.files else -1
+
+    def current(self):
+        if 0 <= self.index < len(self.files):
+            return self.files[self.index]
+        return None
+
+    def step(self, offset: int):
+        if not self.files:
+            return None
+        self.index = max(0, min(len(self.files) - 1, self.index + offset))
+        return self.files[self.index]
+
+    # Neighbouring images, closest first
+    def neighbours(self):
+        result = []
+        for distance in range(1, self.prefetch_count + 1):
+            for index in (self.index + distance, self.index - distance):
+                if 0 <= index < len(self.files):
+                    result.append(self.files[index])
+        return result
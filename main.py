@@ -21,43 +21,98 @@
 
 # CONTINUE: do the calculation tool and export
 
-from PyQt6.QtWidgets import QDialog, QLabel, QLineEdit, QGraphicsTextItem, QHBoxLayout
-from PyQt6.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QMainWindow, QPushButton, QVBoxLayout, QWidget, QFileDialog, QGraphicsEllipseItem, QGraphicsLineItem, QComboBox, QInputDialog, QGraphicsPolygonItem
-from PyQt6.QtGui import QPixmap, QPen, QColor, QBrush, QCursor, QPolygonF, QFont, QTransform
-from PyQt6.QtCore import Qt, QRectF, QPointF, QLineF, pyqtSignal, QObject
+from PyQt6.QtWidgets import QDialog, QLabel, QLineEdit, QGraphicsTextItem, QHBoxLayout, QMessageBox
+from PyQt6.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QMainWindow, QPushButton, QVBoxLayout, QWidget, QFileDialog, QGraphicsEllipseItem, QGraphicsLineItem, QComboBox, QInputDialog, QGraphicsPolygonItem, QGraphicsPixmapItem, QProgressDialog
+from PyQt6.QtGui import QPixmap, QImage, QImageReader, QPen, QColor, QBrush, QCursor, QPolygonF, QFont, QTransform, QShortcut, QKeySequence
+from PyQt6.QtCore import Qt, QRectF, QPointF, QLineF, pyqtSignal, QObject, QTimer
 from abc import ABC, abstractmethod
-from math import cos, sin, pi
+from math import cos, sin, pi, isnan
 import copy
-from tools import ReferenceMarkingTool, TrueLandmarkTool, EstimatedLandmarkTool, DeleteTool, SetScaleTool
-from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint
-
-class Participant():
-    def __init__(self, id: str):
-        self.id = id
-        self.estimates = []
-
-    def addEstimate(self, estimate: EstimatedLandmark):
-        self.estimates.append(estimate)
-
-    def removeEstimate(self, estimate: EstimatedLandmark):
-        self.estimates.remove(estimate)
-        del estimate
-
-
+from tools import ReferenceMarkingTool, TrueLandmarkTool, EstimatedLandmarkTool, UnlabeledEstimateTool, DeleteTool, MoveTool, SetScaleTool
+from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint, Participant
+import metrics
+import spatial
+from tiles import TileCache, TileLoader, TiledImageItem, ImageItem, PreviewItem, TILED_THRESHOLD
+from registry import AnnotationRegistry
+from layers import AnnotationLayers
+from workspace import ImageDocument, Workspace, ThumbnailStrip, THUMBNAIL_SIZE
+from loader import ImageLoader, FolderNavigator, decode_image, image_files
+from imagecache import DiskImageCache, default_cache_folder
+from pregenerate import FolderPreparer
+from instrument import recorder, timed, StallDetector, DebugPanel
+from project import Journal, save_project, load_project, point_record, update_record, point_from_record, find_point, journal_path, PROJECT_EXTENSION
+from importer import read_csv
+from sync import parse_address, DEFAULT_ADDRESS
+from syncclient import SyncClient
+from export import open_output, participant_tables, result_chunks, EXPORT_COLUMNS, COLUMNAR_EXTENSION
+from heatmap import HeatmapItem, HeatmapRenderer, HeatmapSelector, NO_HEATMAP, ALL_ESTIMATES
+import os
+import time
 
 class ImageViewer(QGraphicsView):
     def __init__(self, parent=None):
         super(ImageViewer, self).__init__(parent)
         self.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
-        self.setScene(QGraphicsScene(self))
+        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.SmartViewportUpdate)
+        self.setOptimizationFlag(QGraphicsView.OptimizationFlag.DontAdjustForAntialiasing, True)
+        self.setCacheMode(QGraphicsView.CacheModeFlag.CacheBackground)
         self.currentTool = None
+        self.tileCache = TileCache()
+        self.tileLoader = TileLoader(self.tileCache, self)
+        self.document = None
+        self.setDocument(ImageDocument())
+
+    # Show the scene of a document, restoring its zoom and position
+    def setDocument(self, document):
+        if self.document is not None:
+            self.document.transform = self.transform()
+            self.document.center = self.mapToScene(self.viewport().rect().center())
+        self.document = document
+        self.setScene(document.scene)
+        if document.transform is not None:
+            self.setTransform(document.transform)
+            self.centerOn(document.center)
+        else:
+            self.resetTransform()
+
+    # Layers, heatmap and image of the document shown
+    @property
+    def layers(self):
+        return self.document.layers
+
+    @property
+    def heatmap(self):
+        return self.document.heatmap
+
+    @property
+    def imageItem(self):
+        return self.document.imageItem
 
+    # Load an image synchronously
+    @timed('image.load')
     def loadImage(self, filename):
-        pixmap = QPixmap(filename)
-        self.scene().clear()
-        pixmap_item = self.scene().addPixmap(pixmap)
-        pixmap_item.setZValue(-10)
-        self.setSceneRect(QRectF(pixmap.rect()))
+        if self.isTiled(filename):
+            self.setImageItem(TiledImageItem(filename, self.tileCache, self.tileLoader))
+        else:
+            self.setImage(decode_image(filename))
+
+    # Very large scans are shown as a tiled pyramid decoded on demand
+    @staticmethod
+    def isTiled(filename):
+        size = QImageReader(filename).size()
+        return size.width() * size.height() > TILED_THRESHOLD
+
+    # Show an already decoded image, optionally with downsampled levels.
+    # The image is drawn from its own memory, which may be memory-mapped.
+    def setImage(self, image: QImage, levels=None):
+        image_item = ImageItem(levels or [image])
+        # Static background, only re-rendered when the zoom changes
+        image_item.setCacheMode(ImageItem.CacheMode.DeviceCoordinateCache)
+        self.setImageItem(image_item)
+
+    # Replace the image, annotation layers stay in the scene
+    def setImageItem(self, image_item):
+        self.document.setImageItem(image_item)
 
     def wheelEvent(self, event):
         factor = 1.15 if event.angleDelta().y() > 0 else 1 / 1.15
@@ -68,35 +123,99 @@ class ImageViewer(QGraphicsView):
 
     def mousePressEvent(self, event):
         if self.currentTool:
-            self.currentTool.mousePressEvent(event)
+            with recorder.timer('tool.' + type(self.currentTool).__name__):
+                self.currentTool.mousePressEvent(event)
         else:
             super().mousePressEvent(event)
 
+    def paintEvent(self, event):
+        with recorder.timer('viewer.paint'):
+            super().paintEvent(event)
+
     def enterEvent(self, event):
         QApplication.setOverrideCursor(QCursor(Qt.CursorShape.CrossCursor))
 
     def leaveEvent(self, event):
         QApplication.restoreOverrideCursor()
 
+# Reference landmark as used by the metrics
+def reference_tuple(reference):
+    return (reference.x, reference.y, reference.dir_x, reference.dir_y)
+
+# Property of MainWindow forwarding to the document shown
+def document_attribute(name):
+    return property(lambda self: getattr(self.viewer.document, name),
+                    lambda self, value: setattr(self.viewer.document, name, value))
+
 class MainWindow(QMainWindow):
+    # Annotation state of the image shown, kept per document
+    registry = document_attribute('registry')
+    participants = document_attribute('participants')
+    reference_point = document_attribute('reference_point')
+    scale_value = document_attribute('scale_value')
+    imageFile = document_attribute('filename')
+    projectPath = document_attribute('projectPath')
+    journal = document_attribute('journal')
+    generation = document_attribute('generation')
+    dependencies = document_attribute('dependencies')
+    liveErrors = document_attribute('liveErrors')
+
     def __init__(self):
         super(MainWindow, self).__init__()
         self.resize(800, 600)
         self.viewer = ImageViewer()
+        self.workspace = Workspace()
+        self.workspace.add(self.viewer.document)
+        self.thumbnailStrip = ThumbnailStrip()
+        self.thumbnailStrip.addDocument(self.viewer.document)
+        self.closeImageBtn = QPushButton('Close Image')
         self.loadBtn = QPushButton('Load Image')
+        self.previousBtn = QPushButton('Previous')
+        self.nextBtn = QPushButton('Next')
+        self.imageLoader = ImageLoader(diskCache=self.openImageCache(), parent=self)
+        self.workspace.release = self.imageLoader.release
+        # Previews and levels of the other images of a folder, made in the background
+        self.folderPreparer = None
+        self.preparedFolder = None
+        self.folder = FolderNavigator()
+        self.progressDialog = None
         self.facility_id_input = QLineEdit()
         self.facility_id_input.setPlaceholderText("Facility ID")
         self.exportBtn = QPushButton('Export')
+        self.saveBtn = QPushButton('Save Project')
+        self.openProjectBtn = QPushButton('Open Project')
+        self.importBtn = QPushButton('Import CSV')
+        # Live sharing of the edits of one document with other annotators
+        self.syncBtn = QPushButton('Start Sync')
+        self.syncClient = SyncClient(self)
+        self.syncAddress = DEFAULT_ADDRESS
+        self.syncDocument = None
+        self.applyingRemote = False
+        # Records collected for one batch record, see startBatch
+        self.batch = None
+        self.imageRequested = None
+        # Latency recording, enabled from the debug panel (Ctrl+Shift+D)
+        self.stallDetector = StallDetector(recorder, self)
+        self.debugPanel = None
+        self.debugShortcut = QShortcut(QKeySequence('Ctrl+Shift+D'), self)
 
         # Participant stuff
         self.createParticipantBtn = QPushButton('Create Participant')
+        self.autoAssignBtn = QPushButton('Auto-assign Estimates')
         self.participantSelector = QComboBox()
-        self.participants = []
-        self.true_landmarks = []
         self.estimated_landmarks = []
         self.estimated_edges = []
-        self.reference_point = None
-        self.scale_value = None
+        self.errors = None
+        # Mean errors of the current participant, kept up to date while editing
+        self.errorLabel = QLabel()
+        self.errorLabel.setWordWrap(True)
+
+        # Density of the estimates, recomputed shortly after edits
+        self.heatmapSelector = HeatmapSelector(self.registry)
+        self.heatmapRenderer = HeatmapRenderer(parent=self)
+        self.heatmapTimer = QTimer(self)
+        self.heatmapTimer.setSingleShot(True)
+        self.heatmapTimer.setInterval(200)
 
         # Tools
         self.toolSelector = QComboBox()
@@ -105,10 +224,14 @@ class MainWindow(QMainWindow):
         self.toolSelector.addItem('Set Reference')
         self.trueLandmarkTool = TrueLandmarkTool(self.viewer)
         self.toolSelector.addItem('True Landmark')
-        self.estimatedLandmarkTool = EstimatedLandmarkTool(self.viewer, self.true_landmarks, self.participantSelector)
+        self.estimatedLandmarkTool = EstimatedLandmarkTool(self.viewer, self.registry, self.participantSelector)
         self.toolSelector.addItem('Estimate Point')
-        self.deleteTool = DeleteTool(self.viewer)
+        self.unlabeledEstimateTool = UnlabeledEstimateTool(self.viewer, self.registry, self.participantSelector)
+        self.toolSelector.addItem('Quick Estimate')
+        self.deleteTool = DeleteTool(self.viewer, self.registry)
         self.toolSelector.addItem('Delete')
+        self.moveTool = MoveTool(self.viewer, self.registry)
+        self.toolSelector.addItem('Move')
         self.scaleTool = SetScaleTool(self.viewer)
         self.toolSelector.addItem('Set Scale')
 
@@ -117,13 +240,35 @@ class MainWindow(QMainWindow):
 
         # Connect UI elements to functions
         self.loadBtn.clicked.connect(self.loadImage)
+        self.closeImageBtn.clicked.connect(self.closeDocument)
+        self.thumbnailStrip.documentSelected.connect(self.showDocument)
+        self.previousBtn.clicked.connect(self.showPreviousImage)
+        self.nextBtn.clicked.connect(self.showNextImage)
+        self.saveBtn.clicked.connect(self.saveData)
+        self.openProjectBtn.clicked.connect(self.openProject)
+        self.importBtn.clicked.connect(self.importCoordinates)
+        self.syncBtn.clicked.connect(self.toggleSync)
+        self.exportBtn.clicked.connect(self.exportResults)
+        self.syncClient.received.connect(self.handle_sync_received)
+        self.syncClient.disconnected.connect(self.handle_sync_disconnected)
+        self.facility_id_input.editingFinished.connect(self.handle_facility_changed)
+        self.imageLoader.imageLoaded.connect(self.handle_image_loaded)
+        self.imageLoader.loadFailed.connect(self.handle_image_failed)
         self.createParticipantBtn.clicked.connect(self.createParticipant)
         self.toolSelector.currentTextChanged.connect(self.onToolSelectionChanged)
         self.trueLandmarkTool.signalEmitter.signal.connect(self.handle_point_created)
         self.estimatedLandmarkTool.signalEmitter.signal.connect(self.handle_point_created)
+        self.unlabeledEstimateTool.signalEmitter.signal.connect(self.handle_point_created)
+        self.autoAssignBtn.clicked.connect(self.autoAssign)
+        self.heatmapSelector.currentTextChanged.connect(self.updateHeatmap)
+        self.heatmapTimer.timeout.connect(self.updateHeatmap)
+        self.heatmapRenderer.ready.connect(self.handle_heatmap_ready)
         self.referenceTool.signalEmitter.signal.connect(self.handle_point_created)
         self.deleteTool.signalEmitter.signal.connect(self.handle_item_deleted)
+        self.moveTool.signalEmitter.signal.connect(self.handle_point_moved)
+        self.participantSelector.currentIndexChanged.connect(self.updateErrorLabel)
         self.scaleTool.signalEmitter.signal.connect(self.handle_scale_set)
+        self.debugShortcut.activated.connect(self.showDebugPanel)
 
         # Set up UI
         # Create main layout
@@ -135,19 +280,31 @@ class MainWindow(QMainWindow):
         # Create first container
         container1 = QVBoxLayout()
         container1.addWidget(self.loadBtn)
+        container1.addWidget(self.closeImageBtn)
+        navigation = QHBoxLayout()
+        navigation.addWidget(self.previousBtn)
+        navigation.addWidget(self.nextBtn)
+        container1.addLayout(navigation)
         container1.addWidget(self.facility_id_input)
 
         # Create second container
         container2 = QVBoxLayout()
         container2.addWidget(self.participantSelector)
         container2.addWidget(self.createParticipantBtn)
+        container2.addWidget(self.errorLabel)
 
         # Create third container
         container3 = QVBoxLayout()
         container3.addWidget(self.toolSelector)
+        container3.addWidget(self.autoAssignBtn)
+        container3.addWidget(self.heatmapSelector)
 
         # Create fourth container
         container4 = QVBoxLayout()
+        container4.addWidget(self.openProjectBtn)
+        container4.addWidget(self.saveBtn)
+        container4.addWidget(self.importBtn)
+        container4.addWidget(self.syncBtn)
         container4.addWidget(self.exportBtn)
 
         # Add all containers to the left column
@@ -167,17 +324,212 @@ class MainWindow(QMainWindow):
 
         # Add left column and right column to the main layout
         main_layout.addWidget(left_widget)
-        main_layout.addWidget(self.viewer)
+        right_column = QVBoxLayout()
+        right_column.addWidget(self.viewer)
+        right_column.addWidget(self.thumbnailStrip)
+        main_layout.addLayout(right_column)
 
         # Create a widget to set as the central widget
         central_widget = QWidget()
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
 
+    # Decoded images are kept between sessions in the user cache folder
+    def openImageCache(self):
+        try:
+            return DiskImageCache(default_cache_folder())
+        except OSError:
+            return None
+
+    # Prepare previews for the folder of an image, starting with the images
+    # after it since those are usually opened next
+    def prepareFolder(self, filename):
+        cache = self.imageLoader.diskCache
+        folder = os.path.dirname(os.path.abspath(filename))
+        if cache is None or folder == self.preparedFolder:
+            return
+        files = image_files(folder)
+        path = os.path.abspath(filename)
+        start = files.index(path) + 1 if path in files else 0
+        files = files[start:] + files[:start]
+        if self.folderPreparer is None:
+            # Tiled images are decoded on demand and not cached whole
+            self.folderPreparer = FolderPreparer(cache.folder, max_pixels=TILED_THRESHOLD, parent=self)
+            self.folderPreparer.progress.connect(self.handle_prepare_progress)
+            self.folderPreparer.failed.connect(self.handle_prepare_failed)
+            self.folderPreparer.finished.connect(self.handle_prepare_finished)
+        self.preparedFolder = folder
+        self.folderPreparer.start(files)
+
+    def handle_prepare_progress(self, done, total):
+        self.statusBar().showMessage('Preparing images: {} of {}'.format(done, total))
+
+    def handle_prepare_failed(self, message):
+        QMessageBox.warning(self, 'Prepare Images', 'Preparing the images stopped: ' + message)
+
+    def handle_prepare_finished(self, done, failed):
+        self.statusBar().showMessage('Prepared {} images'.format(done) + (', {} failed'.format(failed) if failed else ''), 5000)
+
+    # Open one or more images, each in its own document
     def loadImage(self):
-        filename, _ = QFileDialog.getOpenFileName(self, "Load Image", "", "Image Files (*.png *.jpg *.bmp)")
-        if filename:
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Load Image", "", "Image Files (*.png *.jpg *.bmp)")
+        if filenames:
+            for filename in filenames[1:]:
+                self.addDocument(filename)
+            self.folder.setCurrent(filenames[0])
+            self.openImage(filenames[0])
+            self.prepareFolder(filenames[0])
+
+    def showPreviousImage(self):
+        current = self.folder.current()
+        filename = self.folder.step(-1)
+        if filename and filename != current:
+            self.openImage(filename)
+
+    def showNextImage(self):
+        current = self.folder.current()
+        filename = self.folder.step(1)
+        if filename and filename != current:
+            self.openImage(filename)
+
+    # Document shown
+    @property
+    def document(self):
+        return self.viewer.document
+
+    # Document of an image, created if the image is not open yet. The image
+    # is attached to the document shown if that has none yet, or to another
+    # empty document.
+    def addDocument(self, filename=None):
+        document = self.workspace.find(filename) if filename else None
+        if document is not None:
+            return document
+        empty = [document for document in self.workspace if document.isEmpty()]
+        if filename and self.document.filename is None:
+            document = self.document
+        elif filename and empty:
+            document = empty[0]
+        else:
+            document = self.workspace.add(ImageDocument())
+            self.thumbnailStrip.addDocument(document)
+        document.filename = filename
+        self.thumbnailStrip.updateDocument(document)
+        return document
+
+    # Switch to the document of an image, opening it if needed
+    def openImage(self, filename):
+        document = self.workspace.find(filename)
+        created = document is None
+        if created:
+            document = self.addDocument(filename)
+        self.showDocument(document)
+        if created:
+            self.record({'op': 'image', 'path': filename})
+
+    # Show a document with its annotations, loading its image if it was
+    # released or not loaded yet
+    def showDocument(self, document):
+        if document is not self.document:
+            self.document.currentParticipant = self.participantSelector.currentIndex()
+            self.viewer.setDocument(document)
+        self.workspace.touch(document)
+
+        self.participantSelector.clear()
+        self.participantSelector.addItems([participant.id for participant in document.participants])
+        self.participantSelector.setCurrentIndex(document.currentParticipant if document.participants else -1)
+        self.facility_id_input.setText(document.facility_id)
+        self.updateErrorLabel()
+        self.estimatedLandmarkTool.registry = document.registry
+        self.unlabeledEstimateTool.registry = document.registry
+        self.deleteTool.registry = document.registry
+        self.moveTool.registry = document.registry
+        self.heatmapSelector.setRegistry(document.registry)
+        self.thumbnailStrip.setCurrentDocument(document)
+        self.setWindowTitle(document.title())
+
+        self.imageLoader.cancel()
+        self.hideProgress()
+        if document.filename:
+            self.folder.setCurrent(document.filename)
+            if document.needsImage():
+                self.loadDocumentImage(document.filename)
+        if document.syncPending:
+            self.applyRemote()
+        self.scheduleHeatmap()
+
+    # Decode the image in the background and prefetch its neighbours in the folder
+    def loadDocumentImage(self, filename):
+        self.imageRequested = time.perf_counter()
+        if self.viewer.isTiled(filename):
             self.viewer.loadImage(filename)
+            self.workspace.trim(keep=self.document)
+        elif not self.imageLoader.load(filename) and not self.showPreview(filename):
+            self.showProgress(filename)
+        self.imageLoader.prefetch([neighbour for neighbour in self.folder.neighbours() if not self.viewer.isTiled(neighbour)])
+
+    # Show the cached preview while the image loads, returns False if there
+    # is none
+    def showPreview(self, filename):
+        if self.document.imageItem is not None:
+            return isinstance(self.document.imageItem, PreviewItem)
+        preview = self.imageLoader.preview(filename)
+        if preview is None:
+            return False
+        image, size = preview
+        self.viewer.setImageItem(PreviewItem(image, size.width(), size.height()))
+        return True
+
+    # Close the document shown and switch to the one used last before it
+    def closeDocument(self):
+        document = self.document
+        if document is self.syncDocument:
+            self.syncClient.disconnectFrom()
+            self.syncDocument = None
+        if document.journal is not None:
+            document.journal.close()
+            document.journal = None
+        self.workspace.remove(document)
+        self.thumbnailStrip.removeDocument(document)
+        if len(self.workspace) == 0:
+            self.thumbnailStrip.addDocument(self.workspace.add(ImageDocument()))
+        self.showDocument(max(self.workspace, key=lambda other: other.lastShown))
+
+    def showProgress(self, filename):
+        if self.progressDialog is None:
+            self.progressDialog = QProgressDialog(self)
+            self.progressDialog.setWindowTitle('Load Image')
+            self.progressDialog.setRange(0, 0)
+            self.progressDialog.setMinimumDuration(300)
+            self.progressDialog.setWindowModality(Qt.WindowModality.WindowModal)
+            self.progressDialog.canceled.connect(self.imageLoader.cancel)
+        self.progressDialog.setLabelText('Decoding ' + os.path.basename(filename))
+        self.progressDialog.reset()
+        self.progressDialog.setRange(0, 0)
+
+    def hideProgress(self):
+        if self.progressDialog is not None:
+            self.progressDialog.reset()
+
+    # Catch the image decoded event
+    def handle_image_loaded(self, filename, image):
+        self.hideProgress()
+        if self.document.filename != filename:
+            return
+        levels = self.imageLoader.levelsFor(filename, image)
+        self.viewer.setImage(image, levels)
+        if self.document.thumbnail is None:
+            self.document.thumbnail = levels[-1].scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                                                        Qt.TransformationMode.SmoothTransformation)
+            self.thumbnailStrip.updateDocument(self.document)
+        self.workspace.trim(keep=self.document)
+        if recorder.enabled and self.imageRequested is not None:
+            recorder.record('image.open', time.perf_counter() - self.imageRequested)
+        self.imageRequested = None
+        self.scheduleHeatmap()
+
+    def handle_image_failed(self, filename):
+        self.hideProgress()
+        QMessageBox.warning(self, 'Load Image', 'Could not read ' + filename)
 
     # Participant handling
     # Create participant and add to participant selector
@@ -187,6 +539,7 @@ class MainWindow(QMainWindow):
             self.participantSelector.addItem(id)
             self.participantSelector.setCurrentIndex(self.participantSelector.count()-1)
             self.participants.append(Participant(id))
+            self.record({'op': 'participant', 'id': id})
 
     # Get currently selected participant
     def getCurrentParticipant(self):
@@ -194,6 +547,7 @@ class MainWindow(QMainWindow):
     
     # Tool handling
     def onToolSelectionChanged(self, text):
+        self.moveTool.cancel()
         if text == 'None':
             self.viewer.setTool(None)
         elif text == 'Set Reference':
@@ -202,62 +556,593 @@ class MainWindow(QMainWindow):
             self.viewer.setTool(self.trueLandmarkTool)
         elif text == 'Estimate Point':
             self.viewer.setTool(self.estimatedLandmarkTool)
+        elif text == 'Quick Estimate':
+            self.viewer.setTool(self.unlabeledEstimateTool)
         elif text == 'Delete':
             self.viewer.setTool(self.deleteTool)
+        elif text == 'Move':
+            self.viewer.setTool(self.moveTool)
         elif text == 'Set Scale':
             self.viewer.setTool(self.scaleTool)
 
     # Catch the point creation event
+    @timed('handle_point_created')
     def handle_point_created(self, point):
-        participant = self.getCurrentParticipant()
+        participant = None
 
         if isinstance(point, EstimatedLandmark):
+            participant = self.getCurrentParticipant()
             participant.addEstimate(point)
+            self.registry.add(point, participant)
         elif isinstance(point, EdgePoint):
+            participant = self.getCurrentParticipant()
             participant.addEstimate(point)
+            self.registry.add(point, participant)
         elif isinstance(point, ReferenceLandmark):
             if self.reference_point:
                  # Remove the old reference point
-                self.handle_item_deleted(self.reference_point.marker)
+                self.handle_item_deleted(self.reference_point)
             self.reference_point = point
+            self.registry.add(point)
         elif isinstance(point, TrueLandmark):
-            self.true_landmarks.append(point)
+            self.registry.add(point)
+        self.viewer.layers.add(point)
+        self.record(point_record('point', point, participant))
+        self.trackPoints([(point, participant)])
+        self.updateErrorLabel()
+        self.scheduleHeatmap()
 
     # Catch the item deletion event
-    def handle_item_deleted(self, item):
-        # Find the point to which the item belongs and remove it
-        for true_landmark in self.true_landmarks:
-            if item == true_landmark.marker:
-                # Remove the true_landmark from the list
-                self.true_landmarks.remove(true_landmark)
-                item.scene().removeItem(item)
-                break
-
-        if self.reference_point and item == self.reference_point.marker:
+    @timed('handle_item_deleted')
+    def handle_item_deleted(self, point):
+        if point not in self.registry:
+            return
+
+        participant = self.registry.remove(point)
+        if participant is not None:
+            participant.removeEstimate(point)
+            self.dependencies.removeEstimate(point)
+            self.liveErrors.remove(point)
+        elif point is self.reference_point:
             self.reference_point = None
-            item.scene().removeItem(item)
-
-        # Loop through all participants and look for the item
-        for participant in self.participants:
-            for estimate in participant.estimates:
-                if item == estimate.marker:
-                    # Remove the estimate from the participant
-                    participant.removeEstimate(estimate)
-                    item.scene().removeItem(item)
-                    break
+            self.liveErrors.setReference(None)
+        elif isinstance(point, TrueLandmark):
+            self.dependencies.removeLandmark(point)
+        self.viewer.layers.remove(point)
+        self.record(point_record('delete', point, participant))
+        self.updateErrorLabel()
+        self.scheduleHeatmap()
+
+    # Catch the point moved event, (point, x, y). Estimates of a moved true
+    # landmark follow it, and only their lines and errors are recomputed.
+    @timed('handle_point_moved')
+    def handle_point_moved(self, move):
+        point, x, y = move
+        if point not in self.registry:
+            return
+        participant = self.registry.participantOf(point)
+        layers = self.viewer.layers
+        if isinstance(point, ReferenceLandmark):
+            changes = {'x': x, 'y': y, 'dir_x': point.dir_x + x - point.x, 'dir_y': point.dir_y + y - point.y}
+            self.record(update_record(point, changes))
+            for key, value in changes.items():
+                setattr(point, key, value)
+            layers.setReference(point)
+            self.liveErrors.setReference(reference_tuple(point))
+        else:
+            old_x, old_y = point.x, point.y
+            old_extent = layers.extentOf([point])
+            self.record(update_record(point, {'x': x, 'y': y}, participant))
+            point.x, point.y = x, y
+            layers.refreshMany([point], old_extent)
+            self.registry.moved(point)
+            if participant is not None:
+                self.liveErrors.update([point])
+            elif isinstance(point, TrueLandmark):
+                self.updateDependents(self.dependencies.moveLandmark(point, old_x, old_y), point)
+        self.updateErrorLabel()
+        self.scheduleHeatmap()
+
+    # Point the estimates of a true landmark at its current position, as one
+    # batch for the layers and the live errors
+    def updateDependents(self, estimates, landmark):
+        stale = [estimate for estimate in estimates
+                 if (estimate.true_x, estimate.true_y) != (landmark.x, landmark.y)]
+        if not stale:
+            return
+        layers = self.viewer.layers
+        old_extent = layers.extentOf(stale)
+        for estimate in stale:
+            self.record(update_record(estimate, {'true_x': landmark.x, 'true_y': landmark.y},
+                                      self.registry.participantOf(estimate)))
+            estimate.true_x, estimate.true_y = landmark.x, landmark.y
+        layers.refreshMany(stale, old_extent)
+        self.liveErrors.update(stale)
+
+    # Add points to the dependency graph and the live errors, pairs are
+    # (point, participant or None). Landmarks go first so estimates in the
+    # same batch find them.
+    def trackPoints(self, pairs):
+        estimates = []
+        for point, participant in pairs:
+            if participant is not None:
+                estimates.append((point, participant.id))
+            elif isinstance(point, ReferenceLandmark):
+                self.liveErrors.setReference(reference_tuple(point))
+            elif isinstance(point, TrueLandmark):
+                self.updateDependents(self.dependencies.addLandmark(point), point)
+        for estimate, _ in estimates:
+            self.dependencies.addEstimate(estimate)
+        self.liveErrors.addMany(estimates)
+
+    # Count and mean errors of the current participant's estimates
+    def updateErrorLabel(self):
+        index = self.participantSelector.currentIndex()
+        if not 0 <= index < len(self.participants):
+            self.errorLabel.setText('')
+            return
+        summary = self.liveErrors.participantSummary(self.participants[index].id)
+        lines = [str(summary['count']) + ' estimates']
+        if not isnan(summary['distance_px']):
+            if isnan(summary['distance_m']):
+                lines.append('Mean distance: {:.1f} px'.format(summary['distance_px']))
+            else:
+                lines.append('Mean distance: {:.2f} m'.format(summary['distance_m']))
+        if not isnan(summary['angle_error']):
+            lines.append('Mean angle error: {:.1f}°'.format(summary['angle_error']))
+        self.errorLabel.setText('\n'.join(lines))
  
     # Catch the scale set event
+    @timed('handle_scale_set')
     def handle_scale_set(self, scale):
         self.scale_value = scale
+        self.liveErrors.setScale(scale)
+        self.record({'op': 'scale', 'value': scale})
+        self.updateErrorLabel()
+
+    def handle_facility_changed(self):
+        self.document.facility_id = self.facility_id_input.text()
+        self.record({'op': 'facility', 'id': self.facility_id_input.text()})
+
+    # Match the current participant's unlabeled estimates to the true
+    # landmarks they have not estimated yet, minimizing the total distance
+    def autoAssign(self):
+        if not self.participants:
+            return
+        participant = self.getCurrentParticipant()
+        unlabeled = [estimate for estimate in participant.estimates
+                     if isinstance(estimate, EstimatedLandmark) and isnan(estimate.true_x)]
+        taken = {(estimate.true_x, estimate.true_y) for estimate in participant.estimates
+                 if isinstance(estimate, EstimatedLandmark)}
+        landmarks = [landmark for landmark in self.registry.trueLandmarks() if (landmark.x, landmark.y) not in taken]
+
+        matches = spatial.auto_assign([(estimate.x, estimate.y) for estimate in unlabeled],
+                                      [(landmark.x, landmark.y) for landmark in landmarks])
+        removed = []
+        added = []
+        for estimate, match in zip(unlabeled, matches.tolist()):
+            if match < 0:
+                continue
+            landmark = landmarks[match]
+            removed.append(estimate)
+            added.append((EstimatedLandmark(estimate.x, estimate.y, landmark.id, landmark.x, landmark.y, participant.id),
+                          participant.id))
+        if not removed:
+            return
+        # Every match replaces an unlabeled estimate, recorded as one batch
+        self.startBatch()
+        try:
+            self.removeEstimates(removed)
+            self.importPoints(added)
+        finally:
+            self.finishBatch()
+
+    # Remove estimates in one go, with one update of the error label and heatmap
+    def removeEstimates(self, estimates):
+        for estimate in estimates:
+            participant = self.registry.remove(estimate)
+            participant.removeEstimate(estimate)
+            self.dependencies.removeEstimate(estimate)
+            self.liveErrors.remove(estimate)
+            self.viewer.layers.remove(estimate)
+            self.record(point_record('delete', estimate, participant))
+        self.updateErrorLabel()
+        self.scheduleHeatmap()
+
+    # Import landmark and estimate tables digitized elsewhere, see importer.py
+    # for the columns. Files are read in the order selected, so tables with
+    # true landmarks should come before estimates referring to them by ID.
+    def importCoordinates(self):
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Import Coordinates", "", "CSV Files (*.csv)")
+        if not filenames:
+            return
+        true_landmarks = {landmark.id: landmark for landmark in self.registry.trueLandmarks()}
+        progress = QProgressDialog('Importing coordinates', 'Cancel', 0, 0, self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(300)
+        imported = 0
+        # Repaint once at the end instead of after every chunk
+        self.viewer.setUpdatesEnabled(False)
+        try:
+            for filename in filenames:
+                progress.setLabelText('Importing ' + os.path.basename(filename))
+                for chunk in read_csv(filename, true_landmarks):
+                    imported += self.importPoints(chunk)
+                    progress.setValue(0)
+                    QApplication.processEvents()
+                    if progress.wasCanceled():
+                        return
+        except (OSError, ValueError, UnicodeDecodeError) as error:
+            QMessageBox.warning(self, 'Import Coordinates', 'Could not read ' + filename + ': ' + str(error) +
+                                '\n' + str(imported) + ' points were imported before the error.')
+        finally:
+            progress.reset()
+            self.viewer.setUpdatesEnabled(True)
+
+    # Add many points at once: registry and participants first, then one
+    # insertion per annotation layer. pairs are (point, participant ID) as
+    # produced by importer.read_csv. Returns the number of points added.
+    def importPoints(self, pairs):
+        participants = {participant.id: participant for participant in self.participants}
+        points = []
+        tracked = []
+        for point, participant_id in pairs:
+            participant = None
+            if participant_id is not None:
+                participant = participants.get(participant_id)
+                if participant is None:
+                    participant = participants[participant_id] = Participant(participant_id)
+                    self.participants.append(participant)
+                    self.participantSelector.addItem(participant_id)
+                    self.record({'op': 'participant', 'id': participant_id})
+                participant.addEstimate(point)
+            elif isinstance(point, ReferenceLandmark):
+                if self.reference_point:
+                    self.handle_item_deleted(self.reference_point)
+                self.reference_point = point
+            self.registry.add(point, participant)
+            points.append(point)
+            tracked.append((point, participant))
+            self.record(point_record('point', point, participant))
+        self.viewer.layers.addMany(points)
+        self.trackPoints(tracked)
+        self.updateErrorLabel()
+        self.scheduleHeatmap()
+        return len(points)
+
+    def showDebugPanel(self):
+        if self.debugPanel is None:
+            self.debugPanel = DebugPanel(recorder, self.stallDetector, self)
+        self.debugPanel.show()
+        self.debugPanel.raise_()
+
+    # Recompute the heatmap once edits have settled
+    def scheduleHeatmap(self):
+        if self.heatmapSelector.currentText() != NO_HEATMAP:
+            self.heatmapTimer.start()
+
+    # Show the density of all estimates over the image, or of the estimates
+    # of one true landmark around it. Computed in the background and cached
+    # until the estimates change.
+    def updateHeatmap(self):
+        text = self.heatmapSelector.currentText()
+        landmark = None
+        rect = None
+        if text == ALL_ESTIMATES:
+            if self.viewer.imageItem is not None:
+                scene_rect = self.viewer.sceneRect()
+                rect = (scene_rect.x(), scene_rect.y(), scene_rect.width(), scene_rect.height())
+        elif text != NO_HEATMAP and self.registry.trueLandmark(text) is not None:
+            point = self.registry.trueLandmark(text)
+            landmark = (point.x, point.y)
+        else:
+            self.heatmapRenderer.cancel()
+            self.viewer.heatmap.clear()
+            return
+
+        connections = self.viewer.layers.connections
+        key = (self.viewer.document.serial, text, landmark, rect, connections.version)
+        self.heatmapRenderer.request(key, connections.coords[:len(connections)].copy(), landmark, rect)
+
+    # Heatmaps of documents that are no longer shown are dropped
+    def handle_heatmap_ready(self, key, image, rect):
+        if key[0] == self.viewer.document.serial:
+            self.viewer.heatmap.setImage(image, rect)
+
+    # Results of every estimate of the open documents, one participant at a time
+    def exportSources(self):
+        for document in self.workspace:
+            reference = reference_tuple(document.reference_point) if document.reference_point else None
+            image = os.path.splitext(os.path.basename(document.filename))[0] if document.filename else ''
+            for table in participant_tables(document.participants, reference, document.scale_value):
+                yield document.facility_id, image, table
+
+    # Write the errors of all open images to a file, chunk by chunk
+    def exportResults(self):
+        filename, selected = QFileDialog.getSaveFileName(self, 'Export Results', '',
+            'CSV Files (*.csv);;JSON Lines (*.jsonl);;Compressed Columns (*' + COLUMNAR_EXTENSION + ')')
+        if not filename:
+            return
+        format = 'columnar' if COLUMNAR_EXTENSION in selected else 'jsonl' if 'jsonl' in selected else 'csv'
+        extension = {'csv': '.csv', 'jsonl': '.jsonl', 'columnar': COLUMNAR_EXTENSION}[format]
+        if not filename.endswith(extension):
+            filename += extension
+        progress = QProgressDialog('Exporting results', 'Cancel', 0, 0, self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(300)
+        exported = 0
+        try:
+            writer = open_output(filename, EXPORT_COLUMNS, format, workers=os.cpu_count() or 1)
+            try:
+                for chunk in result_chunks(self.exportSources()):
+                    writer.writeChunk(chunk)
+                    exported += len(chunk['estimate'])
+                    progress.setLabelText('Exported ' + str(exported) + ' rows')
+                    QApplication.processEvents()
+                    if progress.wasCanceled():
+                        break
+            finally:
+                writer.close()
+        except OSError as error:
+            QMessageBox.warning(self, 'Export Results', 'Could not write ' + filename + ': ' + str(error))
+        finally:
+            progress.reset()
 
     def calculateError(self):
-        # Calculate the error for each participant
-        for participant in self.participants:
-            participant.calculateError(self.reference_point, self.scale_value)
+        # Calculate the error for all participants at once
+        reference = reference_tuple(self.reference_point) if self.reference_point else None
+        self.errors = metrics.compute_errors(self.participants, reference, self.scale_value)
+        return self.errors
+
+    # Append an edit to the journal of the open project and share it with
+    # the sync session of the document
+    def record(self, record):
+        if self.batch is not None:
+            self.batch.append(record)
+            return
+        if self.journal is not None:
+            self.journal.append(record)
+        if self.document is self.syncDocument and not self.applyingRemote and self.syncClient.isActive():
+            self.syncClient.send(record)
+
+    # Collect the records of an edit made of many steps until finishBatch,
+    # which records them as one batch record. Batches do not nest.
+    def startBatch(self):
+        if self.batch is None:
+            self.batch = []
+            return True
+        return False
+
+    def finishBatch(self, started: bool = True):
+        if not started:
+            return
+        records, self.batch = self.batch, None
+        if records:
+            self.record({'op': 'batch', 'records': records})
+
+    # Share the edits of the document shown with other annotators through a
+    # sync server (python sync.py). Annotators joining a session should open
+    # the project it was started from; they then receive every edit since.
+    def toggleSync(self):
+        if self.syncClient.isActive():
+            self.syncClient.disconnectFrom()
+            return
+        address, ok = QInputDialog.getText(self, 'Start Sync', 'Server address (host:port or unix:path):', text=self.syncAddress)
+        if not ok or not address:
+            return
+        try:
+            parse_address(address)
+        except ValueError as error:
+            QMessageBox.warning(self, 'Start Sync', str(error))
+            return
+        session, ok = QInputDialog.getText(self, 'Start Sync', 'Session:', text=self.document.facility_id or self.document.title())
+        if not ok or not session:
+            return
+        # Resume after the last edit received when reconnecting
+        since = self.syncClient.seq if self.syncDocument is self.document and session == self.syncClient.session else 0
+        self.syncAddress = address
+        self.syncDocument = self.document
+        self.syncClient.connectTo(address, session, since)
+        self.syncBtn.setText('Stop Sync')
+
+    def handle_sync_disconnected(self, message):
+        if self.syncClient.isActive():
+            return
+        self.syncBtn.setText('Start Sync')
+        if message:
+            QMessageBox.warning(self, 'Sync', 'Sync stopped: ' + message)
+
+    # Edits of other annotators arrive in batches; those for a document that
+    # is not shown wait until it is shown again
+    @timed('handle_sync_received')
+    def handle_sync_received(self, records):
+        document = self.syncDocument
+        if document is None or document not in self.workspace.documents:
+            return
+        document.syncPending.extend(records)
+        if document is self.document:
+            self.applyRemote()
+
+    # Apply the received edits of the document shown. They are journaled like
+    # local edits but not sent back.
+    def applyRemote(self):
+        records, self.document.syncPending = self.document.syncPending, []
+        self.applyingRemote = True
+        try:
+            self.applyRecords(records)
+        finally:
+            self.applyingRemote = False
+
+    # Apply records in order. Runs of new points and of deleted estimates are
+    # each applied in one go, batch records are journaled as one batch again.
+    def applyRecords(self, records):
+        points = []
+        removed = []
+        for record in records:
+            if record['op'] == 'point' and not removed:
+                points.append((point_from_record(record), record.get('participant')))
+                continue
+            if points:
+                self.importPoints(points)
+                points = []
+            if record['op'] == 'delete' and record.get('participant') is not None:
+                participant = next((participant for participant in self.participants
+                                    if participant.id == record['participant']), None)
+                point = find_point(record, self.registry, self.reference_point, participant)
+                if point is not None and point in self.registry and point not in removed:
+                    removed.append(point)
+                continue
+            if removed:
+                self.removeEstimates(removed)
+                removed = []
+            if record['op'] == 'point':
+                points.append((point_from_record(record), record.get('participant')))
+            elif record['op'] == 'batch':
+                started = self.startBatch()
+                try:
+                    self.applyRecords(record['records'])
+                finally:
+                    self.finishBatch(started)
+            else:
+                self.applyRecord(record)
+        if removed:
+            self.removeEstimates(removed)
+        if points:
+            self.importPoints(points)
+
+    def applyRecord(self, record):
+        op = record['op']
+        if op == 'delete' or op == 'update':
+            participant = next((participant for participant in self.participants
+                                if participant.id == record.get('participant')), None)
+            point = find_point(record, self.registry, self.reference_point, participant)
+            if point is None or point not in self.registry:
+                return
+            if op == 'delete':
+                self.handle_item_deleted(point)
+            else:
+                self.applyUpdate(point, record['to'])
+        elif op == 'scale':
+            self.handle_scale_set(record['value'])
+        elif op == 'participant':
+            if all(participant.id != record['id'] for participant in self.participants):
+                self.participants.append(Participant(record['id']))
+                self.participantSelector.addItem(record['id'])
+                self.record(record)
+        elif op == 'facility':
+            self.document.facility_id = record['id']
+            self.facility_id_input.setText(record['id'])
+            self.record(record)
+
+    # Apply an update record: moves go through handle_point_moved, new true
+    # coordinates of an estimate relink it to its landmark
+    def applyUpdate(self, point, changes):
+        if 'x' in changes:
+            self.handle_point_moved((point, changes['x'], changes['y']))
+        if 'true_x' in changes and (point.true_x, point.true_y) != (changes['true_x'], changes['true_y']):
+            layers = self.viewer.layers
+            old_extent = layers.extentOf([point])
+            self.record(update_record(point, {'true_x': changes['true_x'], 'true_y': changes['true_y']},
+                                      self.registry.participantOf(point)))
+            point.true_x, point.true_y = changes['true_x'], changes['true_y']
+            layers.refreshMany([point], old_extent)
+            self.dependencies.removeEstimate(point)
+            self.dependencies.addEstimate(point)
+            self.liveErrors.update([point])
+            self.updateErrorLabel()
+            self.scheduleHeatmap()
 
     # Save the data to a file
     def saveData(self):
-        pass
+        if self.projectPath is None:
+            filename, _ = QFileDialog.getSaveFileName(self, "Save Project", "", "Projects (*" + PROJECT_EXTENSION + ")")
+            if not filename:
+                return
+            if not filename.endswith(PROJECT_EXTENSION):
+                filename += PROJECT_EXTENSION
+            self.projectPath = filename
+        self.writeSnapshot()
+
+    # Write a full snapshot and start a new journal after it
+    def writeSnapshot(self):
+        if self.journal is not None:
+            self.journal.close()
+        self.generation += 1
+        save_project(self.projectPath, self.imageFile, self.facility_id_input.text(), self.scale_value,
+                     self.reference_point, self.registry.trueLandmarks(), self.participants, self.generation)
+        self.journal = Journal(journal_path(self.projectPath), truncate=True, generation=self.generation)
+
+    def openProject(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Open Project", "", "Projects (*" + PROJECT_EXTENSION + ")")
+        if not filename:
+            return
+        try:
+            project = load_project(filename)
+        except (OSError, ValueError, KeyError) as error:
+            QMessageBox.warning(self, 'Open Project', 'Could not read ' + filename + ': ' + str(error))
+            return
+
+        # Reuse the document of the project if it is open, or an empty one
+        document = next((document for document in self.workspace if document.projectPath == filename), None)
+        if document is None:
+            document = self.document if self.document.isEmpty() else self.addDocument()
+        if document.journal is not None:
+            document.journal.close()
+            document.journal = None
+        self.showDocument(document)
+        self.projectPath = filename
+        self.generation = project.generation
+        self.applyProject(project)
+        # Fold recovered edits into a fresh snapshot
+        self.writeSnapshot()
+
+    # Replace the current annotations with those of a loaded project
+    def applyProject(self, project):
+        self.viewer.layers.clear()
+        self.registry.clear()
+        self.dependencies.clear()
+        self.liveErrors.clear()
+        self.participants = project.participants
+        self.participantSelector.clear()
+        self.participantSelector.addItems([participant.id for participant in self.participants])
+
+        points = []
+        for point, participant in project.registry.items():
+            self.registry.add(point, participant)
+            points.append(point)
+        self.viewer.layers.addMany(points)
+        self.scheduleHeatmap()
+        self.reference_point = project.reference_point
+        self.scale_value = project.scale_value
+        self.liveErrors.setScale(project.scale_value)
+        self.liveErrors.setReference(None)
+        self.trackPoints(project.registry.items())
+        self.updateErrorLabel()
+        self.facility_id_input.setText(project.facility_id)
+        self.document.facility_id = project.facility_id
+
+        if project.image and os.path.exists(project.image):
+            if self.document.filename != project.image:
+                self.workspace.dropImage(self.document)
+                self.document.thumbnail = None
+            self.document.filename = project.image
+            self.thumbnailStrip.updateDocument(self.document)
+            self.showDocument(self.document)
+
+    def closeEvent(self, event):
+        self.syncClient.disconnectFrom()
+        if self.folderPreparer is not None:
+            self.folderPreparer.stop()
+        self.imageLoader.shutdown()
+        self.viewer.tileLoader.shutdown()
+        self.heatmapRenderer.shutdown()
+        self.stallDetector.stop()
+        self.thumbnailStrip.shutdown()
+        for document in self.workspace:
+            if document.journal is not None:
+                document.journal.close()
+                document.journal = None
+        super().closeEvent(event)
         
 if __name__ == '__main__':
     import sys
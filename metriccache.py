@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from points import EdgePoint
+from metrics import ErrorTable
+
+# Bumped whenever the metrics or the entry layout change, so old entries miss
+METRIC_CACHE_VERSION = 1
+ENTRY_EXTENSION = '.npz'
+SIGNATURE_EXTENSION = '.sig'
+
+TABLE_ARRAYS = ['participant_index', 'is_edge', 'est_xy', 'true_xy', 'distance_px', 'distance_m', 'angle', 'angle_error']
+
+
+# Hash of everything the metrics of a project depend on: reference landmark,
+# scale, true landmarks and the estimates of every participant. The facility
+# ID is included since it is stored with the results.
+def input_key(project):
+    digest = hashlib.blake2b(digest_size=20)
+    reference = project.reference_point
+    meta = {
+        'version': METRIC_CACHE_VERSION,
+        'facility_id': project.facility_id,
+        'scale': project.scale_value,
+        'reference': None if reference is None else [reference.x, reference.y, reference.dir_x, reference.dir_y],
+        'participants': [participant.id for participant in project.participants],
+    }
+    digest.update(json.dumps(meta, sort_keys=True).encode('utf-8'))
+    true_landmarks = project.registry.trueLandmarks()
+    digest.update(json.dumps([point.id for point in true_landmarks]).encode('utf-8'))
+    digest.update(np.array([(point.x, point.y) for point in true_landmarks], dtype=np.float64).tobytes())
+    for participant in project.participants:
+        estimates = list(participant.estimates)
+        digest.update(json.dumps([participant.id] + [estimate.id for estimate in estimates]).encode('utf-8'))
+        digest.update(np.array([isinstance(estimate, EdgePoint) for estimate in estimates], dtype=bool).tobytes())
+        digest.update(np.array([(estimate.x, estimate.y, estimate.true_x, estimate.true_y) for estimate in estimates],
+                               dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+# Size and modification time of a project and its journal. Projects whose
+# signature is unchanged are not even loaded on a cache hit. The cache
+# version is part of it too, so a bump also misses on this fast path.
+def file_signature(path: str):
+    parts = [METRIC_CACHE_VERSION, os.path.abspath(path)]
+    for name in (path, path + '.journal'):
+        try:
+            stat = os.stat(name)
+            parts.append((stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            parts.append(None)
+    return hashlib.blake2b(json.dumps(parts).encode('utf-8'), digest_size=20).hexdigest()
+
+
+# Write a file atomically, so concurrent workers never read partial files
+def _replace(folder: str, path: str, write):
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# On-disk cache of metric results keyed by input_key. A second small file per
+# project file signature points to the entry, so unchanged projects are
+# served without loading them. Safe to use from several worker processes;
+# eviction of the least recently used entries runs separately via evict().
+class MetricCache():
+    def __init__(self, folder: str, budget: int = 1024 * 1024 * 1024):
+        self.folder = folder
+        self.budget = budget
+        os.makedirs(folder, exist_ok=True)
+
+    def entryPath(self, key: str):
+        return os.path.join(self.folder, key + ENTRY_EXTENSION)
+
+    def signaturePath(self, signature: str):
+        return os.path.join(self.folder, signature + SIGNATURE_EXTENSION)
+
+    # Cached (ErrorTable, facility ID) for a project file, or None
+    def lookup(self, path: str):
+        try:
+            with open(self.signaturePath(file_signature(path)), 'r') as file:
+                key = file.read().strip()
+        except OSError:
+            return None
+        return self.get(key)
+
+    # Cached (ErrorTable, facility ID) for an input key, or None
+    def get(self, key: str):
+        path = self.entryPath(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+                arrays = {name: data[name] for name in TABLE_ARRAYS}
+                estimate_ids = data['estimate_ids'].tolist()
+            # Mark as recently used for eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        table = ErrorTable(meta['participant_ids'], arrays['participant_index'], estimate_ids, arrays['is_edge'],
+                           arrays['est_xy'], arrays['true_xy'], arrays['distance_px'], arrays['distance_m'],
+                           arrays['angle'], arrays['angle_error'])
+        return table, meta['facility_id']
+
+    def put(self, key: str, table, facility_id: str, path: str = None):
+        meta = {'participant_ids': list(table.participant_ids), 'facility_id': facility_id}
+        arrays = {name: getattr(table, name) for name in TABLE_ARRAYS}
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+        arrays['estimate_ids'] = np.array(table.estimate_ids, dtype=np.str_)
+        _replace(self.folder, self.entryPath(key), lambda file: np.savez(file, **arrays))
+        if path is not None:
+            self.link(path, key)
+
+    # Remember the input key of a project file
+    def link(self, path: str, key: str):
+        _replace(self.folder, self.signaturePath(file_signature(path)), lambda file: file.write(key.encode('ascii')))
+
+    # Delete the least recently used entries until the cache fits the budget,
+    # together with signature files pointing to missing entries
+    def evict(self):
+        entries = []
+        signatures = []
+        for name in os.listdir(self.folder):
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            if name.endswith(ENTRY_EXTENSION):
+                entries.append((stat.st_mtime, stat.st_size, name))
+            elif name.endswith(SIGNATURE_EXTENSION):
+                signatures.append(name)
+
+        used = sum(size for _, size, _ in entries)
+        kept = {name[:-len(ENTRY_EXTENSION)] for _, _, name in entries}
+        for _, size, name in sorted(entries):
+            if used <= self.budget:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            used -= size
+            kept.discard(name[:-len(ENTRY_EXTENSION)])
+
+        for name in signatures:
+            try:
+                with open(os.path.join(self.folder, name), 'r') as file:
+                    key = file.read().strip()
+                if key not in kept:
+                    os.remove(os.path.join(self.folder, name))
+            except OSError:
+                continue
@@ -0,0 +1,250 @@
+import numpy as np
+from points import EdgePoint
+
+
+# Euclidean distance between estimated and true positions, row by row
+def distance_errors(est_xy, true_xy):
+    est_xy = np.asarray(est_xy, dtype=np.float64).reshape(-1, 2)
+    true_xy = np.asarray(true_xy, dtype=np.float64).reshape(-1, 2)
+    return np.hypot(est_xy[:, 0] - true_xy[:, 0], est_xy[:, 1] - true_xy[:, 1])
+
+# Signed angle in degrees between the line point -> reference and the
+# reference direction, in the range (-180, 180]
+def reference_angles(xy, ref_x: float, ref_y: float, dir_x: float, dir_y: float):
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    px = ref_x - xy[:, 0]
+    py = ref_y - xy[:, 1]
+    rx = dir_x - ref_x
+    ry = dir_y - ref_y
+    return np.degrees(np.arctan2(px * ry - py * rx, px * rx + py * ry))
+
+# Unsigned angle between point -> reference and the reference direction,
+# same convention as EstimatedPoint.getAngleError (0 to 180 degrees)
+def point_angles(xy, ref_x: float, ref_y: float, dir_x: float, dir_y: float):
+    return np.abs(reference_angles(xy, ref_x, ref_y, dir_x, dir_y))
+
+# Difference between the angle of the estimate and the angle of its true
+# landmark, both relative to the reference direction (0 to 180 degrees)
+def angle_errors(est_xy, true_xy, ref_x: float, ref_y: float, dir_x: float, dir_y: float):
+    diff = reference_angles(est_xy, ref_x, ref_y, dir_x, dir_y) - reference_angles(true_xy, ref_x, ref_y, dir_x, dir_y)
+    return np.abs((diff + 180.0) % 360.0 - 180.0)
+
+
+class ErrorTable():
+    def __init__(self, participant_ids, participant_index, estimate_ids, is_edge, est_xy, true_xy,
+                 distance_px, distance_m, angle, angle_error):
+        self.participant_ids = participant_ids
+        self.participant_index = participant_index
+        self.estimate_ids = estimate_ids
+        self.is_edge = is_edge
+        self.est_xy = est_xy
+        self.true_xy = true_xy
+        self.distance_px = distance_px
+        self.distance_m = distance_m
+        self.angle = angle
+        self.angle_error = angle_error
+
+    def __len__(self):
+        return len(self.estimate_ids)
+
+    # Mask selecting the rows of one participant
+    def participantMask(self, participant_id: str):
+        return self.participant_index == self.participant_ids.index(participant_id)
+
+    # Per-participant mean errors over the rows where they are defined, NaN
+    # where a participant has none. count is the number of estimates, as in
+    # LiveErrors.participantSummary, so unlabeled estimates (NaN true
+    # position) are counted but do not poison the means.
+    def participantMeans(self):
+        size = len(self.participant_ids)
+        means = {'count': np.bincount(self.participant_index, minlength=size)}
+        for name in ('distance_px', 'distance_m', 'angle_error'):
+            values = getattr(self, name)
+            defined = np.isfinite(values)
+            total = np.bincount(self.participant_index, np.where(defined, values, 0.0), size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[name] = total / np.bincount(self.participant_index, defined, size)
+        return means
+
+    # One dict per estimate, in participant order
+    def rows(self):
+        kinds = np.where(self.is_edge, 'edge', 'landmark')
+        columns = zip(self.participant_index.tolist(), self.estimate_ids, kinds.tolist(),
+                      self.est_xy.tolist(), self.true_xy.tolist(), self.distance_px.tolist(),
+                      self.distance_m.tolist(), self.angle.tolist(), self.angle_error.tolist())
+        for index, id, kind, (x, y), (true_x, true_y), distance_px, distance_m, angle, angle_error in columns:
+            yield {
+                'participant': self.participant_ids[index], 'estimate': id, 'kind': kind,
+                'x': x, 'y': y, 'true_x': true_x, 'true_y': true_y,
+                'distance_px': distance_px, 'distance_m': distance_m,
+                'angle': angle, 'angle_error': angle_error,
+            }
+
+    # One dict per participant with the mean errors
+    def participantRows(self):
+        means = self.participantMeans()
+        for index, id in enumerate(self.participant_ids):
+            yield {
+                'participant': id, 'count': int(means['count'][index]),
+                'distance_px': float(means['distance_px'][index]),
+                'distance_m': float(means['distance_m'][index]),
+                'angle_error': float(means['angle_error'][index]),
+            }
+
+
+# Gather the coordinates of every estimate of every participant into flat
+# arrays. Works on anything with the attributes of Participant/EstimatedPoint,
+# so no graphics scene is needed.
+def collect_estimates(participants):
+    participant_ids = []
+    participant_index = []
+    estimate_ids = []
+    is_edge = []
+    coords = []
+    for index, participant in enumerate(participants):
+        participant_ids.append(participant.id)
+        for estimate in participant.estimates:
+            participant_index.append(index)
+            estimate_ids.append(estimate.id)
+            is_edge.append(isinstance(estimate, EdgePoint))
+            coords.append((estimate.x, estimate.y, estimate.true_x, estimate.true_y))
+
+    coords = np.array(coords, dtype=np.float64).reshape(-1, 4)
+    return (participant_ids, np.array(participant_index, dtype=np.intp), estimate_ids,
+            np.array(is_edge, dtype=bool), coords[:, :2], coords[:, 2:])
+
+# Compute distance and angle errors for all participants at once.
+# reference is (ref_x, ref_y, dir_x, dir_y) or None, scale_value is meters
+# per scene pixel or None; missing values yield NaN columns.
+def compute_errors(participants, reference=None, scale_value=None):
+    participant_ids, participant_index, estimate_ids, is_edge, est_xy, true_xy = collect_estimates(participants)
+    return compute_errors_from_arrays(participant_ids, participant_index, estimate_ids, is_edge,
+                                      est_xy, true_xy, reference, scale_value)
+
+def compute_errors_from_arrays(participant_ids, participant_index, estimate_ids, is_edge, est_xy, true_xy,
+                               reference=None, scale_value=None):
+    distance_px = distance_errors(est_xy, true_xy)
+    distance_m = distance_px * (scale_value if scale_value is not None else np.nan)
+
+    if reference is not None:
+        angle = point_angles(est_xy, *reference)
+        angle_error = angle_errors(est_xy, true_xy, *reference)
+    else:
+        angle = np.full(len(distance_px), np.nan)
+        angle_error = np.full(len(distance_px), np.nan)
+
+    return ErrorTable(participant_ids, participant_index, estimate_ids, is_edge, est_xy, true_xy,
+                      distance_px, distance_m, angle, angle_error)
+
+
+# Errors of every estimate kept up to date edit by edit. Rows are stored like
+# the annotation layers, with swap removal; changed estimates are recomputed
+# in batches and per-participant means are taken over the stored columns.
+class LiveErrors():
+    def __init__(self):
+        self.estimates = []
+        self.slots = {}
+        self.coords = np.empty((64, 4))
+        self.owner = np.empty(64, dtype=np.intp)
+        self.distance_px = np.empty(64)
+        self.angle_error = np.empty(64)
+        self.participant_index = {}
+        self.reference = None
+        self.scale_value = None
+
+    def __len__(self):
+        return len(self.estimates)
+
+    def __contains__(self, estimate):
+        return estimate in self.slots
+
+    def grow(self, size: int):
+        if size <= len(self.coords):
+            return
+        size = max(size, 2 * len(self.coords))
+        count = len(self.estimates)
+        for name in ('coords', 'owner', 'distance_px', 'angle_error'):
+            old = getattr(self, name)
+            new = np.empty((size,) + old.shape[1:], dtype=old.dtype)
+            new[:count] = old[:count]
+            setattr(self, name, new)
+
+    # Add estimates as (estimate, participant ID) pairs
+    def addMany(self, pairs):
+        pairs = list(pairs)
+        if not pairs:
+            return
+        start = len(self.estimates)
+        self.grow(start + len(pairs))
+        for index, (estimate, participant_id) in enumerate(pairs, start):
+            self.slots[estimate] = index
+            self.estimates.append(estimate)
+            self.owner[index] = self.participant_index.setdefault(participant_id, len(self.participant_index))
+        self.recompute(np.arange(start, start + len(pairs)))
+
+    def remove(self, estimate):
+        index = self.slots.pop(estimate)
+        last = len(self.estimates) - 1
+        if index != last:
+            moved = self.estimates[last]
+            self.estimates[index] = moved
+            self.slots[moved] = index
+            for array in (self.coords, self.owner, self.distance_px, self.angle_error):
+                array[index] = array[last]
+        self.estimates.pop()
+
+    # Recompute the rows of estimates changed in place
+    def update(self, estimates):
+        rows = [self.slots[estimate] for estimate in estimates if estimate in self.slots]
+        if rows:
+            self.recompute(np.array(rows, dtype=np.intp))
+
+    def recompute(self, rows):
+        estimates = self.estimates
+        self.coords[rows] = [(estimates[row].x, estimates[row].y, estimates[row].true_x, estimates[row].true_y)
+                             for row in rows.tolist()]
+        coords = self.coords[rows]
+        self.distance_px[rows] = distance_errors(coords[:, :2], coords[:, 2:])
+        if self.reference is None:
+            self.angle_error[rows] = np.nan
+        else:
+            self.angle_error[rows] = angle_errors(coords[:, :2], coords[:, 2:], *self.reference)
+
+    # Only the angles depend on the reference, (ref_x, ref_y, dir_x, dir_y) or None
+    def setReference(self, reference):
+        self.reference = reference
+        count = len(self.estimates)
+        if self.reference is None:
+            self.angle_error[:count] = np.nan
+        elif count:
+            coords = self.coords[:count]
+            self.angle_error[:count] = angle_errors(coords[:, :2], coords[:, 2:], *reference)
+
+    # The scale only converts distances when they are read
+    def setScale(self, scale_value):
+        self.scale_value = scale_value
+
+    def clear(self):
+        self.estimates = []
+        self.slots = {}
+        self.participant_index = {}
+
+    # Count and mean errors of one participant, NaN where undefined
+    def participantSummary(self, participant_id: str):
+        count = len(self.estimates)
+        index = self.participant_index.get(participant_id)
+        mask = self.owner[:count] == index if index is not None else np.zeros(count, dtype=bool)
+        n = int(mask.sum())
+        if n == 0:
+            return {'count': 0, 'distance_px': np.nan, 'distance_m': np.nan, 'angle_error': np.nan}
+        distance = self.distance_px[:count][mask]
+        angle = self.angle_error[:count][mask]
+        with np.errstate(invalid='ignore'):
+            distance_px = float(np.nanmean(distance)) if np.isfinite(distance).any() else np.nan
+            angle_error = float(np.nanmean(angle)) if np.isfinite(angle).any() else np.nan
+        return {
+            'count': n,
+            'distance_px': distance_px,
+            'distance_m': distance_px * self.scale_value if self.scale_value is not None else np.nan,
+            'angle_error': angle_error,
+        }
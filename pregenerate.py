@@ -0,0 +1,200 @@
+# Prepare the images of a folder before a session, e.g.
+#
+#   python pregenerate.py scans/ --workers 4
+#
+# Images are decoded in a process pool and stored in the shared image cache:
+# a small preview for every image and, as far as half the cache budget
+# allows, the full image with its downsampled levels. Work is resumable:
+# files whose content hash already has cache entries are skipped, and
+# unchanged files are recognized without hashing them again.
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtGui import QImageReader
+from imagecache import DiskImageCache, default_cache_folder
+from loader import decode_image, image_files
+
+
+# Runs in a worker process. Returns whether anything had to be decoded.
+def pregenerate_file(filename: str, folder: str, levels: bool, budget: int):
+    cache = DiskImageCache(folder, budget)
+    has_preview = cache.hasPreview(filename)
+    has_levels = cache.contains(filename)
+    if has_preview and (has_levels or not levels):
+        return False
+    image = decode_image(filename)
+    if image.isNull():
+        raise ValueError('could not decode the image')
+    if levels and not has_levels:
+        cache.store(filename, image, map=False)
+    else:
+        cache.storePreview(filename, image)
+    return True
+
+# Pixels of an image, from its header only
+def pixel_count(filename: str):
+    size = QImageReader(filename).size()
+    return max(size.width(), 0) * max(size.height(), 0)
+
+# Bytes of the cache entry of an image with its levels
+def entry_bytes(pixels: int):
+    return pixels * 4 * 4 // 3
+
+# Image files named by folders and files
+def find_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from image_files(path)
+        elif os.path.isfile(path):
+            yield path
+
+
+# Prepare images in a process pool, reporting every file to on_result(filename,
+# decoded) or on_error(filename, error). Full levels are stored for the first
+# images until half the cache budget is used, so later ones do not evict them.
+# Only decoded images count: images known to be cached are not charged, and
+# the others give their share back when the worker finds them cached.
+# Images with more than max_pixels pixels are skipped. stop is an optional
+# threading.Event that ends the run early: queued images are dropped and the
+# ones being decoded finish in the worker processes without being waited for.
+def run(filenames, folder: str, on_result, on_error, workers: int = None, budget: int = None, stop=None,
+        max_pixels: int = None):
+    workers = workers or os.cpu_count() or 1
+    cache = DiskImageCache(folder, budget) if budget is not None else DiskImageCache(folder)
+    budget = cache.budget
+    filenames = iter(filenames)
+    levels_left = budget // 2
+    # Qt is not safe to fork, workers start fresh interpreters
+    context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    stopped = False
+    try:
+        running = {}
+        # Bytes of levels reserved by the running files
+        reserved = {}
+        while True:
+            stopped = stop is not None and stop.is_set()
+            if stopped:
+                return
+            while len(running) < 2 * workers:
+                filename = next(filenames, None)
+                if filename is None:
+                    break
+                pixels = pixel_count(filename)
+                if max_pixels is not None and pixels > max_pixels:
+                    on_result(filename, False)
+                    continue
+                # Only the signature, hashing new files is left to the workers
+                try:
+                    key = cache.knownKey(filename)
+                except OSError as error:
+                    on_error(filename, error)
+                    continue
+                cached = key is not None and os.path.exists(cache.entryPath(key))
+                size = 0 if cached else entry_bytes(pixels)
+                levels = size <= levels_left
+                if levels:
+                    levels_left -= size
+                future = executor.submit(pregenerate_file, filename, folder, levels, budget)
+                running[future] = filename
+                reserved[future] = size if levels else 0
+            if not running:
+                break
+            # Wake up now and then to notice a stop
+            done, _ = wait(running, timeout=0.1 if stop is not None else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename = running.pop(future)
+                size = reserved.pop(future)
+                try:
+                    decoded = future.result()
+                except Exception as error:
+                    levels_left += size
+                    on_error(filename, error)
+                    continue
+                if not decoded:
+                    levels_left += size
+                on_result(filename, decoded)
+    finally:
+        executor.shutdown(wait=not stopped, cancel_futures=stopped)
+
+
+# Runs pregeneration on a background thread for the viewer and reports
+# progress as signals in the GUI thread. Neither start nor stop waits for a
+# run: a superseded run winds down on its own thread and reports nothing.
+# A run that fails as a whole reports failed with the error, its remaining
+# files count as failed.
+class FolderPreparer(QObject):
+    progress = pyqtSignal(int, int)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal(int, int)
+
+    def __init__(self, folder: str, workers: int = None, max_pixels: int = None, parent=None):
+        super().__init__(parent)
+        self.folder = folder
+        self.workers = workers or max(1, (os.cpu_count() or 1) - 1)
+        self.maxPixels = max_pixels
+        self.stopping = None
+
+    def start(self, filenames):
+        self.stop()
+        self.stopping = threading.Event()
+        filenames = list(filenames)
+        threading.Thread(target=self.prepare, args=(filenames, self.stopping), name='pregenerate', daemon=True).start()
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+            self.stopping = None
+
+    def prepare(self, filenames, stopping):
+        counts = {'done': 0, 'failed': 0}
+
+        def on_result(filename, decoded):
+            counts['done'] += 1
+            if not stopping.is_set():
+                self.progress.emit(counts['done'] + counts['failed'], len(filenames))
+
+        def on_error(filename, error):
+            counts['failed'] += 1
+            if not stopping.is_set():
+                self.progress.emit(counts['done'] + counts['failed'], len(filenames))
+
+        try:
+            run(filenames, self.folder, on_result, on_error, self.workers, stop=stopping, max_pixels=self.maxPixels)
+        except Exception as error:
+            counts['failed'] = len(filenames) - counts['done']
+            if not stopping.is_set():
+                self.failed.emit(str(error) or type(error).__name__)
+        finally:
+            if not stopping.is_set():
+                self.finished.emit(counts['done'], counts['failed'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode images ahead of a session and store previews and levels in the image cache.')
+    parser.add_argument('paths', nargs='+', help='image folders or files')
+    parser.add_argument('--cache', default=default_cache_folder(), help='image cache folder, defaults to the one of the viewer')
+    parser.add_argument('--workers', type=int, help='number of worker processes, defaults to the number of cores')
+    parser.add_argument('--cache-size', type=int, default=2048, help='cache size limit in MiB')
+    args = parser.parse_args(argv)
+
+    counts = {'decoded': 0, 'skipped': 0, 'failed': 0}
+
+    def on_result(filename, decoded):
+        counts['decoded' if decoded else 'skipped'] += 1
+
+    def on_error(filename, error):
+        print('{}: {}'.format(filename, error), file=sys.stderr)
+        counts['failed'] += 1
+
+    run(find_images(args.paths), args.cache, on_result, on_error, args.workers, args.cache_size * 1024 * 1024)
+    print('{} images prepared, {} unchanged, {} failed'.format(counts['decoded'], counts['skipped'], counts['failed']),
+          file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import json
+import os
+import queue
+import threading
+import numpy as np
+from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint, Participant
+from registry import AnnotationRegistry
+
+PROJECT_VERSION = 1
+PROJECT_EXTENSION = '.dtproj'
+
+# Estimate kinds as stored in the packed arrays
+KIND_LANDMARK = 0
+KIND_EDGE = 1
+
+
+# Annotation state of one image as stored in a project file
+class Project():
+    def __init__(self):
+        self.image = None
+        self.facility_id = ''
+        self.scale_value = None
+        self.reference_point = None
+        self.participants = []
+        self.registry = AnnotationRegistry()
+        # Number of journal records replayed while loading
+        self.recovered = 0
+        # Generation of the snapshot, see save_project
+        self.generation = 0
+
+    def participant(self, id: str):
+        for participant in self.participants:
+            if participant.id == id:
+                return participant
+        participant = Participant(id)
+        self.participants.append(participant)
+        return participant
+
+    def addPoint(self, point, participant=None):
+        if isinstance(point, ReferenceLandmark):
+            if self.reference_point is not None:
+                self.registry.remove(self.reference_point)
+            self.reference_point = point
+        elif participant is not None:
+            participant.addEstimate(point)
+        self.registry.add(point, participant)
+
+    def removePoint(self, point):
+        participant = self.registry.remove(point)
+        if participant is not None:
+            participant.removeEstimate(point)
+        elif point is self.reference_point:
+            self.reference_point = None
+
+    # Apply one journal record
+    def apply(self, record):
+        op = record['op']
+        if op == 'point':
+            point = point_from_record(record)
+            participant = self.participant(record['participant']) if 'participant' in record else None
+            self.addPoint(point, participant)
+        elif op == 'delete':
+            point = self.findPoint(record)
+            if point is not None:
+                self.removePoint(point)
+        elif op == 'update':
+            point = self.findPoint(record)
+            if point is not None:
+                for key, value in record['to'].items():
+                    setattr(point, key, value)
+                self.registry.moved(point)
+        elif op == 'scale':
+            self.scale_value = record['value']
+        elif op == 'participant':
+            self.participant(record['id'])
+        elif op == 'facility':
+            self.facility_id = record['id']
+        elif op == 'image':
+            self.image = record['path']
+        elif op == 'batch':
+            for member in record['records']:
+                self.apply(member)
+
+    # Point described by a delete or update record
+    def findPoint(self, record):
+        participant = self.participant(record['participant']) if 'participant' in record else None
+        return find_point(record, self.registry, self.reference_point, participant)
+
+
+# Point described by a delete or update record, participant owns the point
+# for estimate records
+def find_point(record, registry, reference_point, participant=None):
+    kind = record['kind']
+    if kind == 'reference':
+        return reference_point
+    if kind == 'true':
+        point = registry.trueLandmark(record['id'])
+        candidates = registry.trueLandmarks()
+    else:
+        point = registry.estimate(record['participant'], record['id'])
+        candidates = participant.estimates if participant is not None else []
+    if point is not None and point.x == record['x'] and point.y == record['y']:
+        return point
+    # Several points share the ID, fall back to matching the position
+    for candidate in candidates:
+        if candidate.id == record['id'] and candidate.x == record['x'] and candidate.y == record['y']:
+            return candidate
+    return point
+
+# Journal record for a created or deleted point
+def point_record(op: str, point, participant=None):
+    record = {'op': op, 'id': point.id, 'x': point.x, 'y': point.y}
+    if isinstance(point, ReferenceLandmark):
+        record['kind'] = 'reference'
+        record['dir_x'] = point.dir_x
+        record['dir_y'] = point.dir_y
+    elif isinstance(point, TrueLandmark):
+        record['kind'] = 'true'
+    else:
+        record['kind'] = 'edge' if isinstance(point, EdgePoint) else 'landmark'
+        record['true_x'] = point.true_x
+        record['true_y'] = point.true_y
+        record['participant'] = participant.id if participant is not None else point.participant
+    return record
+
+# Journal record for a point changed in place, made before the change so it
+# identifies the point. changes maps attribute names to the new values.
+def update_record(point, changes: dict, participant=None):
+    record = point_record('update', point, participant)
+    record['to'] = changes
+    return record
+
+def point_from_record(record):
+    kind = record['kind']
+    if kind == 'reference':
+        return ReferenceLandmark(record['x'], record['y'], record['id'], record['dir_x'], record['dir_y'])
+    if kind == 'true':
+        return TrueLandmark(record['x'], record['y'], record['id'])
+    cls = EdgePoint if kind == 'edge' else EstimatedLandmark
+    return cls(record['x'], record['y'], record['id'], record['true_x'], record['true_y'], record['participant'])
+
+
+# Write a snapshot of the project. Coordinates are stored as packed arrays in
+# an uncompressed NumPy archive; the file is replaced atomically. Every
+# snapshot gets a new generation, which the journal started after it stamps
+# on its records: if the old journal is left behind by a crash before it was
+# truncated, its records are already in the snapshot and are skipped.
+def save_project(path: str, image, facility_id: str, scale_value, reference_point, true_landmarks, participants,
+                 generation: int = 0):
+    true_landmarks = list(true_landmarks)
+    estimates = [(index, estimate) for index, participant in enumerate(participants) for estimate in participant.estimates]
+
+    meta = {
+        'version': PROJECT_VERSION,
+        'image': os.path.relpath(image, os.path.dirname(os.path.abspath(path))) if image else None,
+        'facility_id': facility_id,
+        'scale': scale_value,
+        'reference': point_record('point', reference_point) if reference_point is not None else None,
+        'generation': generation,
+    }
+    arrays = {
+        'meta': np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8),
+        'participant_ids': np.array([participant.id for participant in participants], dtype=np.str_),
+        'true_ids': np.array([point.id for point in true_landmarks], dtype=np.str_),
+        'true_xy': np.array([(point.x, point.y) for point in true_landmarks], dtype=np.float64).reshape(-1, 2),
+        'estimate_ids': np.array([estimate.id for _, estimate in estimates], dtype=np.str_),
+        'estimate_owner': np.array([index for index, _ in estimates], dtype=np.int32),
+        'estimate_kind': np.array([KIND_EDGE if isinstance(estimate, EdgePoint) else KIND_LANDMARK for _, estimate in estimates], dtype=np.uint8),
+        'estimate_coords': np.array([(estimate.x, estimate.y, estimate.true_x, estimate.true_y) for _, estimate in estimates], dtype=np.float64).reshape(-1, 4),
+    }
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file, **arrays)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+# Read a snapshot and replay the journal written since it was taken
+def load_project(path: str):
+    project = Project()
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+        if meta['version'] > PROJECT_VERSION:
+            raise ValueError('Unsupported project version: ' + str(meta['version']))
+
+        if meta['image']:
+            project.image = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(path)), meta['image']))
+        project.facility_id = meta['facility_id']
+        project.scale_value = meta['scale']
+        project.generation = meta.get('generation', 0)
+        if meta['reference'] is not None:
+            project.addPoint(point_from_record(meta['reference']))
+
+        for id, (x, y) in zip(data['true_ids'].tolist(), data['true_xy'].tolist()):
+            project.addPoint(TrueLandmark(x, y, id))
+
+        project.participants = [Participant(id) for id in data['participant_ids'].tolist()]
+        for id, owner, kind, (x, y, true_x, true_y) in zip(data['estimate_ids'].tolist(), data['estimate_owner'].tolist(),
+                                                           data['estimate_kind'].tolist(), data['estimate_coords'].tolist()):
+            participant = project.participants[owner]
+            cls = EdgePoint if kind == KIND_EDGE else EstimatedLandmark
+            project.addPoint(cls(x, y, id, true_x, true_y, participant.id), participant)
+
+    for record in read_journal(journal_path(path)):
+        if record.pop('gen', 0) < project.generation:
+            continue
+        project.apply(record)
+        project.recovered += 1
+    return project
+
+
+def journal_path(path: str):
+    return path + '.journal'
+
+# Records of a journal file, stopping at a torn last line after a crash
+def read_journal(path: str):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+# Append-only log of edits since the last snapshot. Records are queued by the
+# GUI and written and synced to disk by a background thread, stamped with the
+# generation of the snapshot they follow.
+class Journal():
+    def __init__(self, path: str, truncate: bool = False, interval: float = 1.0, generation: int = 0):
+        self.path = path
+        self.interval = interval
+        self.generation = generation
+        self.file = open(path, 'wb' if truncate else 'ab')
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='journal', daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        self.queue.put(json.dumps(dict(record, gen=self.generation), separators=(',', ':')).encode('utf-8') + b'\n')
+
+    def run(self):
+        running = True
+        while running:
+            try:
+                lines = [self.queue.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            # Write everything queued so far in one go
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lines:
+                running = False
+                lines = [line for line in lines if line is not None]
+            self.file.write(b''.join(lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    # Write out pending records and close the file
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
@@ -0,0 +1,80 @@
+from points import TrueLandmark
+
+
+# Central index of all annotations of an image. Maps points and IDs to the
+# participant owning the point, so deletion and lookup do not need to scan
+# lists. Hit testing of points is done by layers.AnnotationLayers.
+class AnnotationRegistry():
+    def __init__(self):
+        self.owners = {}
+        self.true_landmarks = {}
+        self.estimates_by_id = {}
+        # Incremented whenever the set or position of true landmarks changes
+        self.version = 0
+        # Highest number of the '?N' IDs of unlabeled estimates added so far
+        self.unlabeled = 0
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __contains__(self, point):
+        return point in self.owners
+
+    # Register a point, participant is None for true and reference landmarks
+    def add(self, point, participant=None):
+        self.owners[point] = participant
+        if participant is None:
+            if isinstance(point, TrueLandmark):
+                self.true_landmarks[point.id] = point
+                self.version += 1
+        else:
+            self.estimates_by_id[(participant.id, point.id)] = point
+            if point.id.startswith('?') and point.id[1:].isdigit():
+                self.unlabeled = max(self.unlabeled, int(point.id[1:]))
+
+    def remove(self, point):
+        participant = self.owners.pop(point)
+        if participant is None:
+            if self.true_landmarks.get(point.id) is point:
+                del self.true_landmarks[point.id]
+            self.version += 1
+        elif self.estimates_by_id.get((participant.id, point.id)) is point:
+            del self.estimates_by_id[(participant.id, point.id)]
+        return participant
+
+    # Call after a point was moved in place
+    def moved(self, point):
+        if point in self.owners and self.owners[point] is None:
+            self.version += 1
+
+    def clear(self):
+        self.owners.clear()
+        self.true_landmarks.clear()
+        self.estimates_by_id.clear()
+        self.version += 1
+        self.unlabeled = 0
+
+    def participantOf(self, point):
+        return self.owners.get(point)
+
+    def trueLandmark(self, id: str):
+        return self.true_landmarks.get(id)
+
+    def trueLandmarkIds(self):
+        return list(self.true_landmarks)
+
+    # All true landmarks in insertion order, including ones sharing an ID
+    def trueLandmarks(self):
+        return [point for point, owner in self.owners.items() if owner is None and isinstance(point, TrueLandmark)]
+
+    # ID for the next unlabeled estimate, after those of the points loaded
+    # from a project or received from other annotators
+    def nextUnlabeledId(self):
+        return '?' + str(self.unlabeled + 1)
+
+    def estimate(self, participant_id: str, id: str):
+        return self.estimates_by_id.get((participant_id, id))
+
+    # All registered points with their owning participant
+    def items(self):
+        return self.owners.items()
@@ -0,0 +1,165 @@
+from math import ceil, floor, sqrt
+import numpy as np
+
+
+# Below this many points a query simply measures the distance to all of them
+BRUTE_FORCE_POINTS = 64
+
+
+# Uniform grid over a fixed set of points for nearest neighbour queries. The
+# cell size is chosen so that a cell holds about two points on average; for
+# points along a line it follows the length of the line instead of the area.
+class GridIndex():
+    def __init__(self, xy, points_per_cell: float = 2.0):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.cells = {}
+        if len(self.xy) == 0:
+            self.origin = (0.0, 0.0)
+            self.cell_size = 1.0
+            self.span = (0, 0)
+            return
+
+        low = self.xy.min(axis=0)
+        high = self.xy.max(axis=0)
+        extent = high - low
+        self.origin = (float(low[0]), float(low[1]))
+        self.cell_size = max(sqrt(extent[0] * extent[1] * points_per_cell / len(self.xy)),
+                             float(extent.max()) * points_per_cell / len(self.xy), 1.0)
+        keys = np.floor((self.xy - low) / self.cell_size).astype(np.int64)
+        for index, (cx, cy) in enumerate(keys.tolist()):
+            self.cells.setdefault((cx, cy), []).append(index)
+        self.span = (int(keys[:, 0].max()) + 1, int(keys[:, 1].max()) + 1)
+
+    def __len__(self):
+        return len(self.xy)
+
+    # Indices of the k points closest to (x, y), closest first
+    def nearest(self, x: float, y: float, k: int = 1):
+        k = min(k, len(self.xy))
+        if k == 0:
+            return []
+        if len(self.xy) <= BRUTE_FORCE_POINTS:
+            return self.bruteForce(x, y, k)
+        cx = floor((x - self.origin[0]) / self.cell_size)
+        cy = floor((y - self.origin[1]) / self.cell_size)
+        # Rings only reach the points past this many empty ones
+        outside = max(-cx, -cy, cx - self.span[0] + 1, cy - self.span[1] + 1, 0)
+        if 4 * outside**2 > len(self.xy):
+            return self.bruteForce(x, y, k)
+
+        # Grow a square ring of cells until the k-th candidate found so far is
+        # closer than anything outside the ring can be. Far from the points
+        # most cells are empty, so after visiting a few cells per point the
+        # distances to all points are cheaper.
+        candidates = []
+        ring = 0
+        visited = 0
+        max_ring = max(abs(cx), abs(cy), abs(cx - self.span[0]), abs(cy - self.span[1])) + 1
+        while ring <= max_ring:
+            for cell in ring_cells(cx, cy, ring):
+                candidates.extend(self.cells.get(cell, ()))
+            visited += max(1, 8 * ring)
+            if len(candidates) >= k:
+                distances = np.hypot(self.xy[candidates, 0] - x, self.xy[candidates, 1] - y)
+                if np.partition(distances, k - 1)[k - 1] <= ring * self.cell_size:
+                    break
+            if visited > 4 * len(self.xy):
+                return self.bruteForce(x, y, k)
+            ring += 1
+
+        candidates = np.array(candidates)
+        distances = np.hypot(self.xy[candidates, 0] - x, self.xy[candidates, 1] - y)
+        order = np.argsort(distances, kind='stable')[:k]
+        return candidates[order].tolist()
+
+    def bruteForce(self, x: float, y: float, k: int):
+        distances = np.hypot(self.xy[:, 0] - x, self.xy[:, 1] - y)
+        closest = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        return closest[np.argsort(distances[closest], kind='stable')].tolist()
+
+# Cells on the border of the square of cells ring steps around (cx, cy)
+def ring_cells(cx: int, cy: int, ring: int):
+    if ring == 0:
+        yield (cx, cy)
+        return
+    for gx in range(cx - ring, cx + ring + 1):
+        yield (gx, cy - ring)
+        yield (gx, cy + ring)
+    for gy in range(cy - ring + 1, cy + ring):
+        yield (cx - ring, gy)
+        yield (cx + ring, gy)
+
+
+# Minimum cost assignment of rows to columns (Hungarian method with shortest
+# augmenting paths). Returns row and column indices of the assigned pairs;
+# with a rectangular matrix the surplus rows or columns stay unassigned.
+def linear_assignment(cost):
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # owner[j] is the 1-based row assigned to column j, 0 if none
+    owner = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current = owner[column]
+            free = ~used
+            free[0] = False
+            slack = cost[current - 1] - u[current] - v[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = column
+
+            masked = np.where(free, min_slack, np.inf)
+            next_column = int(np.argmin(masked))
+            delta = masked[next_column]
+            np.add.at(u, owner[used], delta)
+            v[used] -= delta
+            min_slack[free] -= delta
+            column = next_column
+            if owner[column] == 0:
+                break
+
+        # Flip the augmenting path
+        while column != 0:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    columns = np.flatnonzero(owner[1:])
+    rows = owner[1:][columns] - 1
+    order = np.argsort(rows)
+    rows, columns = rows[order], columns[order]
+    if transposed:
+        rows, columns = columns, rows
+        order = np.argsort(rows)
+        rows, columns = rows[order], columns[order]
+    return rows, columns
+
+# Match estimates to true landmarks so the summed distance is minimal.
+# Returns for every estimate the index of its landmark, or -1 if it was left
+# unmatched (more estimates than landmarks, or farther than max_distance).
+def auto_assign(est_xy, true_xy, max_distance: float = None):
+    est_xy = np.asarray(est_xy, dtype=np.float64).reshape(-1, 2)
+    true_xy = np.asarray(true_xy, dtype=np.float64).reshape(-1, 2)
+    result = np.full(len(est_xy), -1, dtype=np.int64)
+    if len(est_xy) == 0 or len(true_xy) == 0:
+        return result
+
+    cost = np.hypot(est_xy[:, None, 0] - true_xy[None, :, 0], est_xy[:, None, 1] - true_xy[None, :, 1])
+    rows, columns = linear_assignment(cost)
+    if max_distance is not None:
+        keep = cost[rows, columns] <= max_distance
+        rows, columns = rows[keep], columns[keep]
+    result[rows] = columns
+    return result
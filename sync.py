@@ -0,0 +1,322 @@
+# Live sharing of edits between annotators working on the same facility.
+# Clients send the journal records of their edits to a small asyncio server,
+# which numbers them and forwards them to the other clients of the session.
+# Messages are JSON lines; a session keeps its records, so clients joining
+# late or reconnecting catch up from the last record they have seen. Older
+# records are compacted to their net effect to bound the memory of long
+# sessions. The server does not need Qt; the client is syncclient.SyncClient.
+import argparse
+import asyncio
+import json
+import sys
+
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+# Time spent collecting records before a batch is written or handed to the GUI
+BATCH_INTERVAL = 0.02
+# Bytes read from a socket at a time
+READ_SIZE = 64 * 1024
+# Clients with more unsent data than this are too slow and are disconnected
+MAX_PENDING = 8 * 1024 * 1024
+# Records a session keeps as they were sent; beyond this the older half is
+# compacted
+HISTORY_LIMIT = 100000
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+# Split received bytes into complete lines, returns the lines and the rest
+def split_lines(buffer: bytes):
+    end = buffer.rfind(b'\n') + 1
+    return buffer[:end].splitlines(), buffer[end:]
+
+# 'host:port' for TCP or 'unix:path' for a Unix socket
+def parse_address(address: str):
+    if address.startswith('unix:'):
+        return None, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('expected host:port or unix:path, got ' + address)
+    return host, int(port)
+
+async def open_connection(address: str):
+    host, port = parse_address(address)
+    if host is None:
+        return await asyncio.open_unix_connection(port)
+    return await asyncio.open_connection(host, port)
+
+
+# Identity of the point an edit record refers to, matching how
+# project.find_point looks points up: by ID and position, the reference
+# point is unique. changes are applied first if given.
+def point_identity(record, changes=None):
+    if changes:
+        record = dict(record, **changes)
+    if record['kind'] == 'reference':
+        return ('reference',)
+    if record['kind'] == 'true':
+        return ('true', record['id'], record['x'], record['y'])
+    return ('estimate', record.get('participant'), record['id'], record['x'], record['y'])
+
+# Shorten a run of edit records to records of the same net effect on the
+# project a session started from: points created and deleted again vanish,
+# the moves of a point are merged into its creation or into one update, and
+# only the last scale, facility and image records stay. Batch records are
+# compacted as their members.
+def compact_records(records):
+    records = flatten_records(records)
+    kept = {}
+    # Positions in kept of the records describing the points at an identity
+    points = {}
+    settings = {}
+    for number, record in enumerate(records):
+        op = record['op']
+        if op == 'point':
+            kept[number] = dict(record)
+            points.setdefault(point_identity(record), []).append(number)
+        elif op == 'update' or op == 'delete':
+            found = points.get(point_identity(record))
+            previous = found.pop() if found else None
+            if previous is None:
+                # A point of the project the session started from
+                kept[number] = dict(record, to=dict(record['to'])) if op == 'update' else record
+                if op == 'update':
+                    points.setdefault(point_identity(record, record['to']), []).append(number)
+                continue
+            earlier = kept.pop(previous)
+            if op == 'delete':
+                if earlier['op'] == 'update':
+                    # Delete the point where the project has it
+                    kept[previous] = dict({key: value for key, value in earlier.items() if key != 'to'}, op='delete')
+                continue
+            if earlier['op'] == 'point':
+                earlier.update(record['to'])
+                identity = point_identity(earlier)
+            else:
+                earlier['to'].update(record['to'])
+                identity = point_identity(earlier, earlier['to'])
+            kept[previous] = earlier
+            points.setdefault(identity, []).append(previous)
+        elif op in ('scale', 'facility', 'image', 'participant'):
+            key = (op, record['id']) if op == 'participant' else op
+            if key in settings:
+                if op == 'participant':
+                    continue
+                kept.pop(settings[key], None)
+            settings[key] = number
+            kept[number] = record
+        else:
+            kept[number] = record
+    return [kept[number] for number in sorted(kept)]
+
+
+# Members of batch records in place of the batches
+def flatten_records(records):
+    flat = []
+    for record in records:
+        if record['op'] == 'batch':
+            flat.extend(flatten_records(record['records']))
+        else:
+            flat.append(record)
+    return flat
+
+
+# Records of one session, numbered from 1 in the order the server received
+# them. Records up to base are kept only in compacted form as the snapshot,
+# all numbered base, which clients joining from the start receive first.
+class Session():
+    def __init__(self, name: str, limit: int = HISTORY_LIMIT):
+        self.name = name
+        self.limit = limit
+        self.snapshot = []
+        self.base = 0
+        self.history = []
+        self.clients = set()
+
+    # Number of the last record
+    def count(self):
+        return self.base + len(self.history)
+
+    def append(self, line: bytes):
+        self.history.append(line)
+        if len(self.history) > self.limit:
+            self.compact(len(self.history) - self.limit // 2)
+
+    # Fold the oldest records into the snapshot
+    def compact(self, count: int):
+        old, self.history = self.history[:count], self.history[count:]
+        self.base += len(old)
+        records = [json.loads(line) for line in self.snapshot + old]
+        for record in records:
+            record.pop('seq', None)
+        self.snapshot = [encode(dict(record, seq=self.base)) for record in compact_records(records)]
+
+    # Lines to send a client that has the records up to seq, None if the
+    # records it is missing were compacted
+    def since(self, seq: int):
+        seq = max(seq, 0)
+        if seq >= self.base:
+            return self.history[seq - self.base:]
+        if seq > 0:
+            return None
+        return self.snapshot + self.history
+
+
+# One connected client. Outgoing lines are queued and written in batches by
+# a writer task, so one slow socket never holds up the others.
+class Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.session = None
+        self.pending = []
+        self.pendingBytes = 0
+        self.wake = asyncio.Event()
+        self.closed = False
+
+    # Queue a line, limit is False for the catch-up after the hello
+    def queue(self, line: bytes, limit: bool = True):
+        if self.closed:
+            return
+        self.pending.append(line)
+        self.pendingBytes += len(line)
+        if limit and self.pendingBytes > MAX_PENDING:
+            self.close()
+        else:
+            self.wake.set()
+
+    async def writeLoop(self):
+        try:
+            while not self.closed:
+                await self.wake.wait()
+                await asyncio.sleep(BATCH_INTERVAL)
+                self.wake.clear()
+                lines, self.pending, self.pendingBytes = self.pending, [], 0
+                if lines:
+                    self.writer.write(b''.join(lines))
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self.pending = []
+        self.wake.set()
+        self.writer.close()
+
+
+# Forwards the records of each client to the other clients of its session.
+# A client starts with a hello message naming the session and the number of
+# the last record it has; the server answers with the records after it.
+class SyncServer():
+    def __init__(self, history_limit: int = HISTORY_LIMIT):
+        self.sessions = {}
+        self.historyLimit = history_limit
+        self.server = None
+        self.handlers = set()
+
+    async def start(self, address: str = DEFAULT_ADDRESS):
+        host, port = parse_address(address)
+        if host is None:
+            self.server = await asyncio.start_unix_server(self.handle, port)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    # Bound address, useful when started on port 0
+    def address(self):
+        name = self.server.sockets[0].getsockname()
+        if isinstance(name, str):
+            return 'unix:' + name
+        return name[0] + ':' + str(name[1])
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for session in self.sessions.values():
+            for connection in list(session.clients):
+                connection.close()
+        # Let the handlers finish instead of leaving them to be cancelled
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+
+    async def handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        connection = Connection(reader, writer)
+        writing = asyncio.ensure_future(connection.writeLoop())
+        buffer = b''
+        try:
+            while not connection.closed:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                lines, buffer = split_lines(buffer + data)
+                for line in lines:
+                    self.receive(connection, json.loads(line))
+                # Tell the sender the number of its last record, so it
+                # resumes after it when reconnecting
+                if connection.session is not None and lines:
+                    connection.queue(encode({'op': 'ack', 'seq': connection.session.count()}), limit=False)
+        except (ConnectionError, OSError, ValueError, KeyError):
+            pass
+        finally:
+            if connection.session is not None:
+                connection.session.clients.discard(connection)
+            connection.close()
+            await writing
+            self.handlers.discard(asyncio.current_task())
+
+    def receive(self, connection, message):
+        session = connection.session
+        if message.get('op') == 'hello':
+            if session is not None:
+                session.clients.discard(connection)
+            session = self.sessions.get(message['session'])
+            if session is None:
+                session = self.sessions[message['session']] = Session(message['session'], self.historyLimit)
+            lines = session.since(message.get('since', 0))
+            if lines is None:
+                connection.session = None
+                connection.queue(encode({'op': 'error', 'message': 'Too far behind the session, open the project '
+                                         'again and join from the start'}), limit=False)
+                return
+            connection.session = session
+            session.clients.add(connection)
+            connection.queue(encode({'op': 'welcome', 'count': session.count()}), limit=False)
+            for line in lines:
+                connection.queue(line, limit=False)
+            return
+        if session is None:
+            raise ValueError('record before hello')
+        message['seq'] = session.count() + 1
+        line = encode(message)
+        session.append(line)
+        for client in session.clients:
+            if client is not connection:
+                client.queue(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Share annotation edits between annotators.')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='host:port to listen on, or unix:path for a Unix socket')
+    parser.add_argument('--history', type=int, default=HISTORY_LIMIT,
+                        help='records kept per session before older ones are compacted')
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = SyncServer(max(args.history, 2))
+        await server.start(args.address)
+        print('listening on ' + server.address(), file=sys.stderr)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# Client side of sync.py for the viewer, kept apart so the server runs
+# without Qt
+import asyncio
+import collections
+import json
+import threading
+from PyQt6.QtCore import QObject, pyqtSignal
+from sync import BATCH_INTERVAL, READ_SIZE, encode, split_lines, open_connection
+
+
+# Connection to a sync server, run by an event loop on its own thread so the
+# GUI never waits on the network. Records are sent in batches; received
+# records are delivered to the GUI thread in batches by the received signal.
+class SyncClient(QObject):
+    received = pyqtSignal(object)
+    connected = pyqtSignal()
+    disconnected = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.loop = None
+        self.thread = None
+        self.task = None
+        self.outbox = collections.deque()
+        self.wake = None
+        self.wakePending = False
+        self.session = None
+        # Number of the last record received, to resume after reconnecting
+        self.seq = 0
+
+    def isActive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def connectTo(self, address: str, session: str, since: int = 0):
+        self.disconnectFrom()
+        if session != self.session:
+            self.outbox.clear()
+        self.session = session
+        self.seq = since
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.run(address))
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.task,), name='sync', daemon=True)
+        self.thread.start()
+
+    def disconnectFrom(self):
+        if self.thread is None:
+            return
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+        self.loop.close()
+        self.loop = self.thread = self.task = None
+
+    # Queue a record for the server, callable from the GUI thread
+    def send(self, record):
+        if not self.isActive():
+            return
+        self.outbox.append(encode(record))
+        if not self.wakePending:
+            self.wakePending = True
+            self.loop.call_soon_threadsafe(self.wakeUp)
+
+    def wakeUp(self):
+        self.wakePending = False
+        if self.wake is not None:
+            self.wake.set()
+
+    async def run(self, address: str):
+        self.wake = asyncio.Event()
+        if self.outbox:
+            self.wake.set()
+        writer = None
+        try:
+            reader, writer = await open_connection(address)
+            writer.write(encode({'op': 'hello', 'session': self.session, 'since': self.seq}))
+            self.connected.emit()
+            sending = asyncio.ensure_future(self.sendLoop(writer))
+            try:
+                await self.receiveLoop(reader)
+            finally:
+                sending.cancel()
+            self.disconnected.emit('Connection closed by the server')
+        except asyncio.CancelledError:
+            self.disconnected.emit('')
+        except (ConnectionError, OSError, ValueError) as error:
+            self.disconnected.emit(str(error))
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def sendLoop(self, writer):
+        while True:
+            await self.wake.wait()
+            await asyncio.sleep(BATCH_INTERVAL)
+            self.wake.clear()
+            lines = []
+            while self.outbox:
+                lines.append(self.outbox.popleft())
+            if lines:
+                writer.write(b''.join(lines))
+                await writer.drain()
+
+    async def receiveLoop(self, reader):
+        buffer = b''
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                return
+            lines, buffer = split_lines(buffer + data)
+            records = []
+            for line in lines:
+                message = json.loads(line)
+                if message.get('op') == 'error':
+                    raise ValueError(message['message'])
+                seq = message.pop('seq', None)
+                if seq is None:
+                    continue
+                self.seq = max(self.seq, seq)
+                if message.get('op') != 'ack':
+                    records.append(message)
+            if records:
+                self.received.emit(records)
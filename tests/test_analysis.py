@@ -0,0 +1,49 @@
+from math import nan
+import numpy as np
+from points import EstimatedLandmark, Participant
+import analysis
+import metrics
+
+
+def random_participants(count, estimates, seed):
+    rng = np.random.default_rng(seed)
+    participants = []
+    for number in range(count):
+        participant = Participant('p' + str(number))
+        for index in range(estimates):
+            true_x, true_y = rng.uniform(0, 100, 2)
+            x, y = rng.normal((true_x, true_y), 5)
+            participant.addEstimate(EstimatedLandmark(x, y, 'T' + str(index), true_x, true_y, participant.id))
+        participants.append(participant)
+    return participants
+
+def test_bidimensional_regression_recovers_a_similarity_transform():
+    rng = np.random.default_rng(1)
+    true_xy = rng.uniform(-50, 50, (20, 2))
+    angle = np.radians(30)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    est_xy = 2.5 * true_xy @ rotation.T + (7, -3)
+    result = analysis.bidimensional_regression(true_xy, est_xy)
+    assert np.isclose(result['r'], 1)
+    assert np.isclose(result['distortion'], 0, atol=1e-5)
+    assert np.isclose(result['scale'], 2.5)
+    assert np.isclose(result['rotation'], 30)
+    assert np.isclose(result['translation_x'], 7)
+    assert np.isclose(result['translation_y'], -3)
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    table = metrics.compute_errors(random_participants(5, 12, 2), (0.0, 0.0, 100.0, 0.0), 0.1)
+    one = analysis.analyze(table, resamples=500, seed=3, workers=1)
+    three = analysis.analyze(table, resamples=500, seed=3, workers=3)
+    assert one == three
+    assert analysis.analyze(table, resamples=500, seed=4, workers=1) != one
+
+def test_single_estimate_has_no_interval():
+    participant = Participant('p1')
+    participant.addEstimate(EstimatedLandmark(10.0, 0.0, 'A', 13.0, 4.0, 'p1'))
+    participant.addEstimate(EstimatedLandmark(50.0, 50.0, '?1', nan, nan, 'p1'))
+    table = metrics.compute_errors([participant], (0.0, 0.0, 100.0, 0.0), 0.5)
+    result = analysis.analyze(table, resamples=100, workers=1)['participants']['p1']
+    assert result['n'] == 1
+    assert np.isclose(result['estimate']['mean_distance'], 2.5)
+    assert all(np.isnan(low) and np.isnan(high) for low, high in result['ci'].values())
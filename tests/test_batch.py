@@ -0,0 +1,44 @@
+import csv
+import json
+from math import nan
+from points import TrueLandmark, EstimatedLandmark, Participant
+from project import save_project
+import batch
+
+
+def write_projects(folder, count):
+    paths = []
+    for index in range(count):
+        participant = Participant('p1')
+        participant.addEstimate(EstimatedLandmark(10.0, 0.0, 'A', 13.0, 4.0, 'p1'))
+        participant.addEstimate(EstimatedLandmark(50.0, 50.0, '?1', nan, nan, 'p1'))
+        path = str(folder / 'study' / 'site{}.dtproj'.format(index))
+        save_project(path, None, 'F' + str(index), 0.5, None, [TrueLandmark(13.0, 4.0, 'A')], [participant])
+        paths.append(path)
+    return paths
+
+def test_batch_writes_every_project(tmp_path):
+    (tmp_path / 'study').mkdir()
+    write_projects(tmp_path, 3)
+    estimates = str(tmp_path / 'estimates.csv')
+    participants = str(tmp_path / 'participants.jsonl')
+    assert batch.main([str(tmp_path / 'study'), '--estimates', estimates, '--participants', participants,
+                       '--workers', '2']) == 0
+
+    with open(estimates, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == 6
+    assert sorted({row['facility_id'] for row in rows}) == ['F0', 'F1', 'F2']
+    with open(participants) as file:
+        summaries = [json.loads(line) for line in file]
+    assert len(summaries) == 3
+    # The unlabeled estimate is counted but leaves the means defined
+    assert all(summary['count'] == 2 and summary['distance_px'] == 5.0 and summary['distance_m'] == 2.5
+               for summary in summaries)
+
+def test_broken_project_is_reported(tmp_path):
+    (tmp_path / 'study').mkdir()
+    write_projects(tmp_path, 1)
+    (tmp_path / 'study' / 'broken.dtproj').write_bytes(b'not a project')
+    estimates = str(tmp_path / 'estimates.csv')
+    assert batch.main([str(tmp_path / 'study'), '--estimates', estimates, '--workers', '1']) == 1
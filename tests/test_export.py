@@ -0,0 +1,65 @@
+from math import nan
+import numpy as np
+from points import EstimatedLandmark, EdgePoint, Participant
+import export
+import metrics
+
+
+def tables(count, participants=3):
+    rng = np.random.default_rng(0)
+    for index in range(participants):
+        participant = Participant('p' + str(index))
+        for number in range(count):
+            cls = EdgePoint if number % 5 == 0 else EstimatedLandmark
+            true_x = nan if number % 7 == 0 else float(rng.random())
+            participant.addEstimate(cls(float(rng.random()), float(rng.random()), 'é' + str(number), true_x, 0.5,
+                                        participant.id))
+        yield 'F1', 'image ' + str(index), metrics.compute_errors([participant], (0.0, 0.0, 1.0, 0.0), 2.0)
+
+def concatenated(chunks):
+    chunks = list(chunks)
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in export.EXPORT_COLUMNS}
+
+def test_chunks_have_the_requested_size():
+    sizes = [len(chunk['estimate']) for chunk in export.result_chunks(tables(100), chunk_size=64)]
+    assert sizes == [64, 64, 64, 64, 44]
+
+def test_columnar_round_trip(tmp_path):
+    for workers in (0, 3):
+        path = str(tmp_path / ('results' + str(workers) + export.COLUMNAR_EXTENSION))
+        assert export.export(path, tables(100), chunk_size=64, workers=workers) == 300
+        expected = concatenated(export.result_chunks(tables(100), chunk_size=64))
+        read = list(export.read_columnar(path))
+        assert [len(chunk['estimate']) for chunk in read] == [64, 64, 64, 64, 44]
+        read = concatenated(read)
+        for name in export.EXPORT_COLUMNS:
+            if name in export.FLOAT_COLUMNS:
+                assert np.array_equal(read[name], expected[name], equal_nan=True)
+            else:
+                assert read[name].tolist() == [str(value) for value in expected[name].tolist()]
+
+def test_columnar_export_to_stdout(tmp_path, capsysbinary, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert export.export('-', tables(10), format='columnar') == 30
+    assert not (tmp_path / '-').exists()
+    path = tmp_path / ('stdout' + export.COLUMNAR_EXTENSION)
+    path.write_bytes(capsysbinary.readouterr().out)
+    assert sum(len(chunk['estimate']) for chunk in export.read_columnar(str(path))) == 30
+
+def test_empty_export(tmp_path):
+    path = str(tmp_path / ('empty' + export.COLUMNAR_EXTENSION))
+    assert export.export(path, []) == 0
+    assert list(export.read_columnar(path)) == []
+
+def test_text_formats_write_missing_values_as_empty(tmp_path):
+    csv_path = str(tmp_path / 'results.csv')
+    jsonl_path = str(tmp_path / 'results.jsonl')
+    export.export(csv_path, tables(7, participants=1))
+    export.export(jsonl_path, tables(7, participants=1))
+    with open(csv_path, encoding='utf-8') as file:
+        lines = file.read().splitlines()
+    assert lines[0] == ','.join(export.EXPORT_COLUMNS) and len(lines) == 8
+    assert lines[1].endswith(',,,')
+    with open(jsonl_path, encoding='utf-8') as file:
+        first = file.readline()
+    assert '"distance_px": null' in first
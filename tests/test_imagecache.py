@@ -0,0 +1,30 @@
+import gc
+import os
+import pytest
+from PyQt6.QtGui import QImage, QColor
+from imagecache import DiskImageCache, CACHE_EXTENSION
+
+
+def mapped_entries():
+    with open('/proc/self/maps') as maps:
+        return sum(1 for line in maps if line.rstrip().endswith(CACHE_EXTENSION))
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/maps'), reason='needs /proc/self/maps')
+def test_released_mapping_lives_as_long_as_its_images(tmp_path):
+    filename = str(tmp_path / 'plan.png')
+    image = QImage(3000, 2000, QImage.Format.Format_RGB32)
+    image.fill(QColor(10, 20, 30))
+    image.save(filename)
+    cache = DiskImageCache(str(tmp_path / 'cache'))
+    before = mapped_entries()
+    levels = cache.load(filename, QImage)[1]
+    assert len(levels) > 1 and mapped_entries() == before + 1
+
+    cache.release(filename)
+    gc.collect()
+    assert cache.mappings == {}
+    assert levels[-1].pixelColor(1, 1).getRgb() == (10, 20, 30, 255)
+    del levels
+    gc.collect()
+    assert mapped_entries() == before
+    assert cache.open(filename) is not None
@@ -0,0 +1,55 @@
+import os
+from points import TrueLandmark, EstimatedLandmark, Participant
+from project import save_project, load_project
+import batch
+import metriccache
+import metrics
+
+
+def write_project(path, x=10.0):
+    participant = Participant('p1')
+    participant.addEstimate(EstimatedLandmark(x, 0.0, 'A', 13.0, 4.0, 'p1'))
+    save_project(path, None, 'F1', 0.5, None, [TrueLandmark(13.0, 4.0, 'A')], [participant])
+
+def test_unchanged_project_is_served_from_the_cache(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    cache_folder = str(tmp_path / 'cache')
+    write_project(path)
+    estimates, _, cached = batch.analyze_project(path, cache_folder)
+    assert not cached
+    again, _, cached = batch.analyze_project(path, cache_folder)
+    assert cached
+    assert [row['distance_m'] for row in again] == [row['distance_m'] for row in estimates] == [2.5]
+
+def test_changed_project_misses(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    cache = metriccache.MetricCache(str(tmp_path / 'cache'))
+    write_project(path)
+    project = load_project(path)
+    cache.put(metriccache.input_key(project), metrics.compute_errors(project.participants), project.facility_id, path)
+    assert cache.lookup(path) is not None
+
+    write_project(path, x=20.0)
+    os.utime(path, ns=(0, 1))
+    assert cache.lookup(path) is None
+    assert cache.get(metriccache.input_key(load_project(path))) is None
+
+def test_version_bump_invalidates_entries(tmp_path, monkeypatch):
+    path = str(tmp_path / 'a.dtproj')
+    cache_folder = str(tmp_path / 'cache')
+    write_project(path)
+    batch.analyze_project(path, cache_folder)
+    monkeypatch.setattr(metriccache, 'METRIC_CACHE_VERSION', metriccache.METRIC_CACHE_VERSION + 1)
+    cache = metriccache.MetricCache(cache_folder)
+    assert cache.lookup(path) is None
+    assert cache.get(metriccache.input_key(load_project(path))) is None
+    _, _, cached = batch.analyze_project(path, cache_folder)
+    assert not cached
+
+def test_evict_removes_signatures_of_evicted_entries(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    cache_folder = str(tmp_path / 'cache')
+    write_project(path)
+    batch.analyze_project(path, cache_folder)
+    metriccache.MetricCache(cache_folder, budget=0).evict()
+    assert os.listdir(cache_folder) == []
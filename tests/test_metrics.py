@@ -0,0 +1,58 @@
+from math import nan
+import numpy as np
+from points import EstimatedLandmark, Participant
+from registry import AnnotationRegistry
+import metrics
+
+
+def make_participant(id, estimates):
+    participant = Participant(id)
+    for estimate in estimates:
+        participant.addEstimate(EstimatedLandmark(*estimate, participant=id))
+    return participant
+
+REFERENCE = (0.0, 0.0, 100.0, 0.0)
+
+def test_unlabeled_estimates_do_not_poison_participant_means():
+    participant = make_participant('p1', [
+        (10.0, 0.0, 'A', 13.0, 4.0),
+        (20.0, 20.0, 'B', 20.0, 30.0),
+        (50.0, 50.0, '?1', nan, nan),
+    ])
+    table = metrics.compute_errors([participant], REFERENCE, 0.5)
+    means = table.participantMeans()
+    assert means['count'][0] == 3
+    assert np.isclose(means['distance_px'][0], 7.5)
+    assert np.isclose(means['distance_m'][0], 3.75)
+    assert np.isfinite(means['angle_error'][0])
+
+def test_participant_means_match_live_errors():
+    participants = [
+        make_participant('p1', [(10.0, 0.0, 'A', 13.0, 4.0), (50.0, 50.0, '?1', nan, nan)]),
+        make_participant('p2', [(30.0, 5.0, 'A', 13.0, 4.0), (25.0, 25.0, 'B', 20.0, 30.0)]),
+        make_participant('p3', [(1.0, 1.0, '?1', nan, nan)]),
+    ]
+    table = metrics.compute_errors(participants, REFERENCE, 2.0)
+    live = metrics.LiveErrors()
+    live.setReference(REFERENCE)
+    live.setScale(2.0)
+    live.addMany((estimate, participant.id) for participant in participants for estimate in participant.estimates)
+    for row in table.participantRows():
+        summary = live.participantSummary(row['participant'])
+        assert row['count'] == summary['count']
+        for name in ('distance_px', 'distance_m', 'angle_error'):
+            assert np.allclose(row[name], summary[name], equal_nan=True)
+
+def test_participant_without_estimates_has_nan_means():
+    table = metrics.compute_errors([Participant('empty'), make_participant('p1', [(0.0, 0.0, 'A', 3.0, 4.0)])])
+    rows = list(table.participantRows())
+    assert rows[0]['count'] == 0 and np.isnan(rows[0]['distance_px'])
+    assert rows[1]['distance_px'] == 5.0
+
+def test_unlabeled_ids_continue_after_loaded_ones():
+    registry = AnnotationRegistry()
+    participant = Participant('p1')
+    assert registry.nextUnlabeledId() == '?1'
+    registry.add(EstimatedLandmark(0.0, 0.0, '?7', nan, nan, 'p1'), participant)
+    registry.add(EstimatedLandmark(0.0, 0.0, 'A', 1.0, 1.0, 'p1'), participant)
+    assert registry.nextUnlabeledId() == '?8'
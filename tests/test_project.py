@@ -0,0 +1,73 @@
+import json
+from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint, Participant
+from project import Journal, save_project, load_project, journal_path, point_record, update_record
+
+
+def sample():
+    participant = Participant('p1')
+    participant.addEstimate(EstimatedLandmark(1.5, 2.0, 'A', 3.0, 4.0, 'p1'))
+    participant.addEstimate(EdgePoint(5.0, 6.0, 'E', 7.0, 8.0, 'p1'))
+    reference = ReferenceLandmark(0.0, 0.0, 'R', 10.0, 0.0)
+    return reference, [TrueLandmark(3.0, 4.0, 'A')], [participant, Participant('p2')]
+
+def save(path, generation=0):
+    reference, true_landmarks, participants = sample()
+    save_project(path, None, 'F1', 0.25, reference, true_landmarks, participants, generation)
+
+def points_of(project):
+    return sorted((type(point).__name__, point.id, point.x, point.y, owner.id if owner else None)
+                  for point, owner in project.registry.items())
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    save(path)
+    project = load_project(path)
+    assert project.facility_id == 'F1' and project.scale_value == 0.25
+    assert [participant.id for participant in project.participants] == ['p1', 'p2']
+    assert (project.reference_point.dir_x, project.reference_point.dir_y) == (10.0, 0.0)
+    assert points_of(project) == [('EdgePoint', 'E', 5.0, 6.0, 'p1'), ('EstimatedLandmark', 'A', 1.5, 2.0, 'p1'),
+                                  ('ReferenceLandmark', 'R', 0.0, 0.0, None), ('TrueLandmark', 'A', 3.0, 4.0, None)]
+    assert project.recovered == 0
+
+def test_journal_is_replayed(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    save(path, generation=1)
+    journal = Journal(journal_path(path), truncate=True, generation=1)
+    new = TrueLandmark(9.0, 9.0, 'B')
+    journal.append(point_record('point', new))
+    journal.append(update_record(new, {'x': 11.0, 'y': 12.0}))
+    journal.append({'op': 'scale', 'value': 0.5})
+    journal.close()
+
+    project = load_project(path)
+    assert project.recovered == 3
+    assert project.scale_value == 0.5
+    assert ('TrueLandmark', 'B', 11.0, 12.0, None) in points_of(project)
+
+def test_torn_last_record_is_ignored(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    save(path)
+    with open(journal_path(path), 'wb') as file:
+        file.write(json.dumps({'op': 'scale', 'value': 0.5}).encode('utf-8') + b'\n{"op": "sca')
+    project = load_project(path)
+    assert project.recovered == 1 and project.scale_value == 0.5
+
+def test_journal_of_an_older_snapshot_is_skipped(tmp_path):
+    # Crash after the new snapshot replaced the file but before the journal
+    # was truncated: its records are already part of the snapshot
+    path = str(tmp_path / 'a.dtproj')
+    journal = Journal(journal_path(path), truncate=True, generation=1)
+    journal.append(point_record('point', TrueLandmark(3.0, 4.0, 'A')))
+    journal.close()
+    save(path, generation=2)
+
+    project = load_project(path)
+    assert project.recovered == 0
+    assert len(project.registry.trueLandmarks()) == 1
+
+def test_journal_without_generations_is_replayed(tmp_path):
+    path = str(tmp_path / 'a.dtproj')
+    save(path)
+    with open(journal_path(path), 'wb') as file:
+        file.write(json.dumps({'op': 'facility', 'id': 'F2'}).encode('utf-8') + b'\n')
+    assert load_project(path).facility_id == 'F2'
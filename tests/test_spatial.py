@@ -0,0 +1,65 @@
+import itertools
+import time
+import numpy as np
+import spatial
+
+
+def brute_force_assignment(cost):
+    rows, columns = cost.shape
+    best = np.inf
+    if rows <= columns:
+        for permutation in itertools.permutations(range(columns), rows):
+            best = min(best, cost[np.arange(rows), list(permutation)].sum())
+    else:
+        for permutation in itertools.permutations(range(rows), columns):
+            best = min(best, cost[list(permutation), np.arange(columns)].sum())
+    return best
+
+def test_linear_assignment_is_optimal():
+    rng = np.random.default_rng(1)
+    for shape in [(1, 1), (3, 3), (5, 5), (4, 6), (6, 4), (2, 7)]:
+        for _ in range(10):
+            cost = rng.random(shape) * 100
+            rows, columns = spatial.linear_assignment(cost)
+            assert len(rows) == min(shape)
+            assert len(set(rows.tolist())) == len(rows) and len(set(columns.tolist())) == len(columns)
+            assert np.all(np.diff(rows) > 0)
+            assert np.isclose(cost[rows, columns].sum(), brute_force_assignment(cost))
+
+def test_auto_assign_leaves_far_estimates_unmatched():
+    est_xy = [(0.0, 0.0), (10.0, 0.0), (500.0, 500.0)]
+    true_xy = [(11.0, 0.0), (1.0, 0.0), (400.0, 400.0)]
+    assert spatial.auto_assign(est_xy, true_xy, max_distance=50).tolist() == [1, 0, -1]
+    assert spatial.auto_assign(est_xy, [], max_distance=50).tolist() == [-1, -1, -1]
+
+def test_grid_index_matches_brute_force():
+    rng = np.random.default_rng(2)
+    xy = np.concatenate([rng.random((200, 2)) * 1000, rng.normal(500, 5, (50, 2))])
+    index = spatial.GridIndex(xy)
+    queries = np.concatenate([rng.random((100, 2)) * 1400 - 200, xy[:10]])
+    for x, y in queries.tolist():
+        distances = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+        for k in (1, 3, 10):
+            found = index.nearest(x, y, k)
+            assert len(found) == k
+            assert np.allclose(np.sort(distances[found]), np.sort(distances)[:k])
+
+def test_grid_index_empty_and_small():
+    assert spatial.GridIndex([]).nearest(1.0, 2.0, 3) == []
+    assert spatial.GridIndex([(5.0, 5.0)]).nearest(-100.0, 40.0, 3) == [0]
+
+def test_grid_index_far_queries_with_few_or_collinear_points():
+    rng = np.random.default_rng(3)
+    layouts = [
+        np.array([(100.0, 100.0)]),
+        np.column_stack([np.linspace(0, 5000, 300), np.full(300, 50.0)]),
+        np.concatenate([rng.random((100, 2)) * 10, [(20000.0, 20000.0)]]),
+    ]
+    for xy in layouts:
+        index = spatial.GridIndex(xy)
+        for x, y in [(400.0, 400.0), (900.0, 900.0), (1e6, -1e6), (2500.0, 3000.0)]:
+            start = time.perf_counter()
+            found = index.nearest(x, y, 3)
+            assert time.perf_counter() - start < 0.5
+            distances = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+            assert np.allclose(np.sort(distances[found]), np.sort(distances)[:len(found)])
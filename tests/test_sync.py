@@ -0,0 +1,121 @@
+import asyncio
+import json
+import random
+from points import TrueLandmark, EstimatedLandmark
+from project import Project, point_record, update_record
+import sync
+
+
+def base_project():
+    project = Project()
+    participant = project.participant('p1')
+    for index in range(5):
+        project.addPoint(TrueLandmark(10.0 * index, 0.0, 'T' + str(index)))
+        project.addPoint(EstimatedLandmark(10.0 * index, 5.0, 'T' + str(index), 10.0 * index, 0.0, 'p1'), participant)
+    return project
+
+def state(project):
+    points = sorted((type(point).__name__, point.id, point.x, point.y, getattr(point, 'true_x', None),
+                     getattr(point, 'true_y', None), owner.id if owner else None)
+                    for point, owner in project.registry.items())
+    return points, project.scale_value, project.facility_id, [participant.id for participant in project.participants]
+
+# Random edits of new and existing points, made against a live project so
+# the records describe the points like the viewer's records do
+def random_edits(project, count, seed):
+    rng = random.Random(seed)
+    records = []
+    for number in range(count):
+        points = list(project.registry.items())
+        choice = rng.random()
+        if choice < 0.4 or not points:
+            if rng.random() < 0.5:
+                point = TrueLandmark(rng.randint(0, 50), rng.randint(0, 50), 'N' + str(number))
+                record = point_record('point', point)
+            else:
+                participant = rng.choice(['p1', 'p2'])
+                point = EstimatedLandmark(rng.randint(0, 50), rng.randint(0, 50), '?' + str(number), 1.0, 2.0, participant)
+                record = point_record('point', point, project.participant(participant))
+        elif choice < 0.65:
+            point, owner = rng.choice(points)
+            record = point_record('delete', point, owner)
+        elif choice < 0.9:
+            point, owner = rng.choice(points)
+            record = update_record(point, {'x': rng.randint(0, 50), 'y': rng.randint(0, 50)}, owner)
+        else:
+            record = {'op': 'scale', 'value': rng.random()}
+        records.append(record)
+        project.apply(json.loads(json.dumps(record)))
+    return records
+
+def test_compacted_records_have_the_same_effect():
+    for seed in range(20):
+        records = random_edits(base_project(), 300, seed)
+        compacted = sync.compact_records(json.loads(json.dumps(records)))
+        assert len(compacted) < len(records)
+        full = base_project()
+        for record in records:
+            full.apply(record)
+        short = base_project()
+        for record in compacted:
+            short.apply(record)
+        assert state(short) == state(full)
+
+def test_batch_records_compact_like_their_members():
+    records = random_edits(base_project(), 300, 7)
+    batched = [{'op': 'batch', 'records': records[start:start + 10]} for start in range(0, len(records), 10)]
+    full = base_project()
+    for record in batched:
+        full.apply(record)
+    short = base_project()
+    for record in sync.compact_records(json.loads(json.dumps(batched))):
+        short.apply(record)
+    assert state(short) == state(full)
+    assert all(record['op'] != 'batch' for record in sync.compact_records(batched))
+
+
+async def exchange(address, session, since, records=(), settle=0.2):
+    reader, writer = await sync.open_connection(address)
+    writer.write(sync.encode({'op': 'hello', 'session': session, 'since': since}))
+    for record in records:
+        writer.write(sync.encode(record))
+    await writer.drain()
+    await asyncio.sleep(settle)
+    writer.close()
+    data = b''
+    while True:
+        chunk = await reader.read(sync.READ_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return [json.loads(line) for line in data.splitlines()]
+
+def test_late_joiner_catches_up_from_the_snapshot():
+    async def scenario():
+        server = sync.SyncServer(history_limit=10)
+        await server.start('127.0.0.1:0')
+        try:
+            address = server.address()
+            records = random_edits(base_project(), 50, 1)
+            await exchange(address, 's', 0, records)
+            session = server.sessions['s']
+            assert session.count() == 50 and session.base > 0 and len(session.history) <= 10
+
+            messages = await exchange(address, 's', 0)
+            received = [message for message in messages if message['op'] not in ('welcome', 'ack')]
+            joined = base_project()
+            for message in received:
+                message.pop('seq')
+                joined.apply(message)
+            full = base_project()
+            for record in records:
+                full.apply(record)
+            assert state(joined) == state(full)
+
+            resumed = await exchange(address, 's', 48)
+            assert [message['seq'] for message in resumed if message['op'] not in ('welcome', 'ack')] == [49, 50]
+            behind = await exchange(address, 's', 1)
+            assert behind[0]['op'] == 'error'
+        finally:
+            await server.close()
+    asyncio.run(scenario())
@@ -0,0 +1,268 @@
+import weakref
+from collections import OrderedDict
+from math import ceil, floor, log2
+from PyQt6.QtCore import QObject, QRunnable, QThread, QThreadPool, QRect, QRectF, QSize, pyqtSignal
+from PyQt6.QtGui import QImage, QImageIOHandler, QImageReader, QPainter
+from PyQt6.QtWidgets import QGraphicsItem
+
+# Edge length of a tile in pixels of its pyramid level
+TILE_SIZE = 512
+# Images with more pixels than this are shown as a tiled pyramid
+TILED_THRESHOLD = 4096 * 4096
+# Levels whose full image is at most this many pixels are decoded in one go
+# and cut into tiles instead of decoding every tile separately
+WHOLE_LEVEL_PIXELS = 2048 * 2048
+
+
+# Least recently used cache of decoded tiles with a memory budget in bytes
+class TileCache():
+    def __init__(self, budget: int = 256 * 1024 * 1024):
+        self.budget = budget
+        self.used = 0
+        self.tiles = OrderedDict()
+
+    def get(self, key):
+        image = self.tiles.get(key)
+        if image is not None:
+            self.tiles.move_to_end(key)
+        return image
+
+    def put(self, key, image: QImage):
+        if key in self.tiles:
+            self.used -= self.tiles.pop(key).sizeInBytes()
+        self.tiles[key] = image
+        self.used += image.sizeInBytes()
+        # Evict the oldest tiles until we are within budget again
+        while self.used > self.budget and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.used -= old.sizeInBytes()
+
+    # Drop all tiles of one image
+    def discard(self, filename: str):
+        for key in [key for key in self.tiles if key[0] == filename]:
+            self.used -= self.tiles.pop(key).sizeInBytes()
+
+    def clear(self):
+        self.tiles.clear()
+        self.used = 0
+
+
+# Size of an image as shown, with its EXIF orientation applied like the
+# decoders do
+def oriented_size(filename: str):
+    reader = QImageReader(filename)
+    size = reader.size()
+    if reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+        size.transpose()
+    return size
+
+# Rectangle in the stored image of a rectangle of the image as shown. The
+# reader clips and scales the stored image, then mirrors, flips and rotates
+# it clockwise by 90 degrees as its orientation says.
+def stored_rect(rect: QRect, size: QSize, transformation):
+    x, y, width, height = rect.x(), rect.y(), rect.width(), rect.height()
+    if transformation & QImageIOHandler.Transformation.TransformationRotate90:
+        x, y, width, height = y, size.height() - x - width, height, width
+    if transformation & QImageIOHandler.Transformation.TransformationMirror:
+        x = size.width() - x - width
+    if transformation & QImageIOHandler.Transformation.TransformationFlip:
+        y = size.height() - y - height
+    return QRect(x, y, width, height)
+
+# Decode a region of the image, given in full resolution pixels of the image
+# as shown, down to the given pyramid level. The image reader decodes
+# straight to the reduced size.
+def decode_region(filename: str, rect: QRect, level: int):
+    reader = QImageReader(filename)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    region = stored_rect(rect, size, reader.transformation())
+    if region != QRect(0, 0, size.width(), size.height()):
+        reader.setClipRect(region)
+    if level > 0:
+        reader.setScaledSize(QSize(max(1, ceil(region.width() / 2**level)), max(1, ceil(region.height() / 2**level))))
+    return reader.read()
+
+
+class TileTask(QRunnable):
+    def __init__(self, key, rect: QRect, level: int, loader):
+        super().__init__()
+        self.key = key
+        self.rect = rect
+        self.level = level
+        self.loader = loader
+
+    def run(self):
+        self.loader.decoded.emit(self.key, decode_region(self.key[0], self.rect, self.level))
+
+# Decodes tiles on worker threads into the tile cache and repaints the
+# items showing their image when a tile arrives
+class TileLoader(QObject):
+    decoded = pyqtSignal(object, QImage)
+
+    def __init__(self, cache: TileCache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, QThread.idealThreadCount() - 1))
+        self.pending = set()
+        self.items = weakref.WeakSet()
+        self.decoded.connect(self.onDecoded)
+
+    # Queue the decoding of a tile, key is (filename, level, ...)
+    def request(self, key, rect: QRect, level: int, item):
+        self.items.add(item)
+        if key not in self.pending:
+            self.pending.add(key)
+            self.pool.start(TileTask(key, rect, level, self))
+
+    def shutdown(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+
+    def onDecoded(self, key, image):
+        self.pending.discard(key)
+        self.cache.put(key, image)
+        for item in list(self.items):
+            if item.filename == key[0] and item.scene() is not None:
+                item.update()
+
+
+# Graphics item showing a large image as a pyramid of tiles. Tiles are decoded
+# in the background when they first become visible at the current zoom
+# level; until then the same area of a coarser level is drawn. The item
+# always covers the full resolution rectangle, so scene coordinates do not
+# change.
+class TiledImageItem(QGraphicsItem):
+    def __init__(self, filename: str, cache: TileCache, loader: TileLoader, parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.cache = cache
+        self.loader = loader
+        size = oriented_size(filename)
+        self.width = size.width()
+        self.height = size.height()
+        # Coarsest level fits into a single tile
+        self.max_level = max(0, ceil(log2(max(self.width, self.height, 1) / TILE_SIZE)))
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    # Pyramid level matching the current zoom, 0 is full resolution
+    def levelFor(self, scale: float):
+        if scale <= 0:
+            return self.max_level
+        return max(0, min(self.max_level, floor(log2(1 / scale))))
+
+    # Decoded tile, or None after queueing it when request is set
+    def tile(self, level: int, tx: int, ty: int, request: bool = True):
+        key = (self.filename, level, tx, ty)
+        image = self.cache.get(key)
+        if image is not None:
+            return image
+
+        level_pixels = ceil(self.width / 2**level) * ceil(self.height / 2**level)
+        if level_pixels <= WHOLE_LEVEL_PIXELS:
+            image = self.levelTile(level, tx, ty, request)
+            if image is not None:
+                self.cache.put(key, image)
+        elif request:
+            self.loader.request(key, self.tileRect(level, tx, ty), level, self)
+        return image
+
+    # Cut a tile from a whole coarse level, which is decoded once
+    def levelTile(self, level: int, tx: int, ty: int, request: bool):
+        key = (self.filename, level, 'full')
+        full = self.cache.get(key)
+        if full is None:
+            if request:
+                self.loader.request(key, QRect(0, 0, self.width, self.height), level, self)
+            return None
+        x = tx * TILE_SIZE
+        y = ty * TILE_SIZE
+        return full.copy(x, y, min(TILE_SIZE, full.width() - x), min(TILE_SIZE, full.height() - y))
+
+    # Full resolution rectangle covered by a tile
+    def tileRect(self, level: int, tx: int, ty: int):
+        span = TILE_SIZE * 2**level
+        return QRect(tx * span, ty * span, min(span, self.width - tx * span), min(span, self.height - ty * span))
+
+    # Draw the area of a missing tile from the finest coarser level at hand
+    def drawCoarser(self, painter: QPainter, level: int, rect: QRect):
+        for coarser in range(level + 1, self.max_level + 1):
+            span = TILE_SIZE * 2**coarser
+            tx = rect.x() // span
+            ty = rect.y() // span
+            image = self.tile(coarser, tx, ty, request=False)
+            if image is None or image.isNull():
+                continue
+            scale = 2**coarser
+            source = QRectF((rect.x() - tx * span) / scale, (rect.y() - ty * span) / scale,
+                            rect.width() / scale, rect.height() / scale)
+            painter.drawImage(QRectF(rect), image, source)
+            return
+
+    def paint(self, painter: QPainter, option, widget=None):
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.levelFor(scale)
+        span = TILE_SIZE * 2**level
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+        # The coarsest level backs every missing tile
+        self.tile(self.max_level, 0, 0)
+        first_x = max(0, int(exposed.left() // span))
+        first_y = max(0, int(exposed.top() // span))
+        last_x = min(ceil(self.width / span) - 1, int(exposed.right() // span))
+        last_y = min(ceil(self.height / span) - 1, int(exposed.bottom() // span))
+        for ty in range(first_y, last_y + 1):
+            for tx in range(first_x, last_x + 1):
+                rect = self.tileRect(level, tx, ty)
+                image = self.tile(level, tx, ty)
+                if image is None:
+                    self.drawCoarser(painter, level, rect)
+                elif not image.isNull():
+                    painter.drawImage(QRectF(rect), image)
+
+
+# Graphics item drawing a decoded image straight from QImage memory, so a
+# memory-mapped image is not copied into a pixmap. levels holds the full
+# resolution image followed by halved versions for zoomed out views.
+class ImageItem(QGraphicsItem):
+    def __init__(self, levels, parent=None):
+        super().__init__(parent)
+        self.levels = list(levels)
+        self.width = self.levels[0].width()
+        self.height = self.levels[0].height()
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def levelFor(self, scale: float):
+        if scale <= 0:
+            return len(self.levels) - 1
+        return max(0, min(len(self.levels) - 1, floor(log2(1 / scale))))
+
+    def paint(self, painter: QPainter, option, widget=None):
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+        image = self.levels[self.levelFor(option.levelOfDetailFromTransform(painter.worldTransform()))]
+        fx = image.width() / self.width
+        fy = image.height() / self.height
+        source = QRectF(exposed.x() * fx, exposed.y() * fy, exposed.width() * fx, exposed.height() * fy)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+        painter.drawImage(exposed, image, source)
+
+
+# Small preview stretched over the area of the full image, shown until the
+# full image is loaded
+class PreviewItem(ImageItem):
+    def __init__(self, image: QImage, width: int, height: int, parent=None):
+        super().__init__([image], parent)
+        self.width = width
+        self.height = height
@@ -1,8 +1,14 @@
 from PyQt6.QtCore import QObject, pyqtSignal, Qt
-from PyQt6.QtGui import QPen, QBrush, QColor, QTransform
+from PyQt6.QtGui import QPen, QBrush, QColor
 from PyQt6.QtWidgets import QGraphicsEllipseItem, QGraphicsSceneMouseEvent, QInputDialog, QDialog, QVBoxLayout, QLineEdit, QLabel, QComboBox, QPushButton
 from abc import ABC, abstractmethod
+from math import nan
 from points import ReferenceLandmark, TrueLandmark, EstimatedLandmark, EdgePoint
+from layers import MARKER_RADIUS
+from spatial import GridIndex
+
+# Number of nearest true landmarks listed first in the estimate dialog
+NEAREST_CANDIDATES = 5
 
 
 class SignalHolder(QObject):
@@ -41,7 +47,7 @@ class ReferenceMarkingTool(Tool):
             point = self.viewer.mapToScene(event.pos())
             id, ok = QInputDialog.getText(self.viewer, 'Reference Landmark', 'Enter ID for reference landmark')
             if ok:
-                ref_landmark = ReferenceLandmark(self.firstPoint.x(), self.firstPoint.y(), id, self.viewer.scene(), point.x(), point.y())
+                ref_landmark = ReferenceLandmark(self.firstPoint.x(), self.firstPoint.y(), id, point.x(), point.y())
                 self.signalEmitter.signal.emit(ref_landmark)
 
             # Remove temporary marker
@@ -59,55 +65,123 @@ class TrueLandmarkTool(Tool):
         point = self.viewer.mapToScene(event.pos())
         id, ok = QInputDialog.getText(self.viewer, 'True Landmark', 'Enter ID for true landmark')
         if ok:
-            true_landmark = TrueLandmark(point.x(), point.y(), id, self.viewer.scene())
+            true_landmark = TrueLandmark(point.x(), point.y(), id)
             self.signalEmitter.signal.emit(true_landmark)
 
 class EstimatedLandmarkTool(Tool):
-    def __init__(self, viewer, true_landmarks, participantSelector):
+    def __init__(self, viewer, registry, participantSelector):
         super().__init__(viewer)
-        self.true_landmarks = true_landmarks
+        self.registry = registry
         self.participantSelector = participantSelector
         self.signalEmitter = SignalHolder()
-
+        self.index = None
+        self.index_points = []
+        self.index_version = None
+
+    # True landmarks closest to a scene position, closest first
+    def nearestLandmarks(self, x: float, y: float, k: int = NEAREST_CANDIDATES):
+        if self.index_version != self.registry.version:
+            self.index_points = self.registry.trueLandmarks()
+            self.index = GridIndex([(landmark.x, landmark.y) for landmark in self.index_points])
+            self.index_version = self.registry.version
+        return [self.index_points[index] for index in self.index.nearest(x, y, k)]
 
     def mousePressEvent(self, event):
         # Position of the estimation
         point = self.viewer.mapToScene(event.pos())
 
         # True landmark which is estimated
-        # Get the ids of the true landmarks
-        true_landmark_ids = [true_landmark.id for true_landmark in self.true_landmarks]
-        dialog = ReferenceDialog(true_landmark_ids)
+        # List the nearest true landmarks first, the nearest one preselected
+        nearest = {}
+        for landmark in self.nearestLandmarks(point.x(), point.y()):
+            nearest.setdefault(landmark.id, landmark)
+        others = [id for id in self.registry.trueLandmarkIds() if id not in nearest]
+        dialog = ReferenceDialog(list(nearest) + others, len(nearest))
         
         if dialog.exec() == QDialog.DialogCode.Accepted:
             # Get the data
             estimation_id, estimation_type, true_landmark_id = dialog.get_data()
             # Get the position of the true landmark
-            true_x, true_y = [(true_landmark.x, true_landmark.y) for true_landmark in self.true_landmarks if true_landmark.id == true_landmark_id][0]
+            true_landmark = nearest.get(true_landmark_id) or self.registry.trueLandmark(true_landmark_id)
+            if true_landmark is None:
+                return
+            true_x, true_y = true_landmark.x, true_landmark.y
             # Current participant
             current_participant = self.participantSelector.currentText()
 
             # Create the estimated landmark or edge point
             if estimation_type == "Landmark":
-                estimated_point = EstimatedLandmark(point.x(), point.y(), estimation_id, self.viewer.scene(), true_x, true_y, current_participant)
+                estimated_point = EstimatedLandmark(point.x(), point.y(), estimation_id, true_x, true_y, current_participant)
             elif estimation_type == "Edge":
-                estimated_point = EdgePoint(point.x(), point.y(), estimation_id, self.viewer.scene(), true_x, true_y, current_participant)
+                estimated_point = EdgePoint(point.x(), point.y(), estimation_id, true_x, true_y, current_participant)
             # Emit the point to be picked up by the MainWindow
             self.signalEmitter.signal.emit(estimated_point)
 
+# Place estimates without choosing a true landmark, they are matched later
+# with MainWindow.autoAssign
+class UnlabeledEstimateTool(Tool):
+    def __init__(self, viewer, registry, participantSelector):
+        super().__init__(viewer)
+        self.registry = registry
+        self.participantSelector = participantSelector
+        self.signalEmitter = SignalHolder()
+
+    def mousePressEvent(self, event):
+        point = self.viewer.mapToScene(event.pos())
+        estimated_point = EstimatedLandmark(point.x(), point.y(), self.registry.nextUnlabeledId(), nan, nan,
+                                            self.participantSelector.currentText())
+        self.signalEmitter.signal.emit(estimated_point)
+
 class DeleteTool(Tool):
-    def __init__(self, viewer):
+    def __init__(self, viewer, registry):
         super().__init__(viewer)
+        self.registry = registry
         self.signalEmitter = SignalHolder()
 
-    # Detect the item that is clicked on and emit it to the MainWindow
+    # Detect the annotation that is clicked on and emit it to the MainWindow
     def mousePressEvent(self, event):
         point = self.viewer.mapToScene(event.pos())
-        item = self.viewer.scene().itemAt(point, QTransform())
-        if item:
-            print(type(item))
-            if isinstance(item, QGraphicsEllipseItem):
-                self.signalEmitter.signal.emit(item)
+        # Keep markers clickable when zoomed far out
+        tolerance = max(MARKER_RADIUS, 3 / max(self.viewer.transform().m11(), 1e-9))
+        annotation = self.viewer.layers.pointAt(point, tolerance)
+        if annotation is not None and annotation in self.registry:
+            self.signalEmitter.signal.emit(annotation)
+
+# Move an annotation: the first click picks it up, the second puts it down.
+# Emits (point, x, y) to the MainWindow.
+class MoveTool(Tool):
+    def __init__(self, viewer, registry):
+        super().__init__(viewer)
+        self.registry = registry
+        self.selected = None
+        self.tempMarker = None
+        self.signalEmitter = SignalHolder()
+
+    def mousePressEvent(self, event):
+        point = self.viewer.mapToScene(event.pos())
+        if self.selected is None:
+            # Keep markers clickable when zoomed far out
+            tolerance = max(MARKER_RADIUS, 3 / max(self.viewer.transform().m11(), 1e-9))
+            annotation = self.viewer.layers.pointAt(point, tolerance)
+            if annotation is None or annotation not in self.registry:
+                return
+            self.selected = annotation
+            # Highlight the picked up annotation
+            ellipse = QGraphicsEllipseItem(annotation.x - 2 * MARKER_RADIUS, annotation.y - 2 * MARKER_RADIUS,
+                                           4 * MARKER_RADIUS, 4 * MARKER_RADIUS)
+            ellipse.setPen(QPen(QColor('black')))
+            ellipse.setZValue(10)
+            self.viewer.scene().addItem(ellipse)
+            self.tempMarker = ellipse
+        else:
+            self.signalEmitter.signal.emit((self.selected, point.x(), point.y()))
+            self.cancel()
+
+    def cancel(self):
+        if self.tempMarker is not None and self.tempMarker.scene() is not None:
+            self.tempMarker.scene().removeItem(self.tempMarker)
+        self.tempMarker = None
+        self.selected = None
 
 class SetScaleTool(Tool):
     def __init__(self, viewer):
@@ -137,7 +211,7 @@ class SetScaleTool(Tool):
 
 # Dialog for creating an estimation
 class ReferenceDialog(QDialog):
-    def __init__(self, reference_landmarks):
+    def __init__(self, reference_landmarks, nearest_count=0):
         super().__init__()
 
         # Set up the dialog layout
@@ -161,6 +235,9 @@ class ReferenceDialog(QDialog):
         landmark_label = QLabel("Select reference landmark:")
         self.landmark_combo = QComboBox()
         self.landmark_combo.addItems(reference_landmarks)
+        # Separate the nearest landmarks from the rest
+        if 0 < nearest_count < len(reference_landmarks):
+            self.landmark_combo.insertSeparator(nearest_count)
         layout.addWidget(landmark_label)
         layout.addWidget(self.landmark_combo)
 
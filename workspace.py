@@ -0,0 +1,253 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader, QIcon, QPixmap
+from PyQt6.QtWidgets import QGraphicsScene, QListWidget, QListWidgetItem, QListView
+from layers import AnnotationLayers
+from heatmap import HeatmapItem
+from registry import AnnotationRegistry
+from dependencies import DependencyGraph
+from metrics import LiveErrors
+from tiles import ImageItem, PreviewItem
+import itertools
+import os
+
+# Edge length of the thumbnails in the strip
+THUMBNAIL_SIZE = 96
+
+_serials = itertools.count(1)
+
+
+# Annotation state of one image in the workspace. Every document has its own
+# scene, so switching images only swaps the scene shown by the viewer.
+class ImageDocument():
+    def __init__(self, filename: str = None):
+        self.filename = filename
+        # Identifies the document in results computed in the background
+        self.serial = next(_serials)
+        self.scene = QGraphicsScene()
+        # The scene holds a few large layer items, a spatial index does not pay off
+        self.scene.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.NoIndex)
+        self.layers = AnnotationLayers(self.scene)
+        self.heatmap = HeatmapItem()
+        self.heatmap.setZValue(-5)
+        self.scene.addItem(self.heatmap)
+        self.imageItem = None
+
+        self.registry = AnnotationRegistry()
+        self.dependencies = DependencyGraph()
+        self.liveErrors = LiveErrors()
+        self.participants = []
+        self.currentParticipant = -1
+        self.reference_point = None
+        self.scale_value = None
+        self.facility_id = ''
+        self.projectPath = None
+        self.journal = None
+        # Generation of the last snapshot written, see project.save_project
+        self.generation = 0
+        # Edits from other annotators received while another document was shown
+        self.syncPending = []
+
+        # View state restored when the document is shown again
+        self.transform = None
+        self.center = None
+        self.lastShown = 0
+        self.thumbnail = None
+
+    # Nothing loaded or annotated yet, can be reused for the next image
+    def isEmpty(self):
+        return self.filename is None and len(self.registry) == 0 and not self.participants and self.projectPath is None
+
+    # No image or only its preview is shown
+    def needsImage(self):
+        return self.imageItem is None or isinstance(self.imageItem, PreviewItem)
+
+    # Replace the image, annotation layers stay in the scene
+    def setImageItem(self, image_item):
+        self.dropImage()
+        image_item.setZValue(-10)
+        self.scene.addItem(image_item)
+        self.imageItem = image_item
+        self.scene.setSceneRect(image_item.boundingRect())
+
+    # Release the decoded image; the scene keeps its size so the view state
+    # stays valid until the image is loaded again
+    def dropImage(self):
+        if self.imageItem is not None:
+            self.scene.removeItem(self.imageItem)
+            self.imageItem = None
+
+    def title(self):
+        return os.path.basename(self.filename) if self.filename else 'Untitled'
+
+
+# Bytes of decoded image data held by an image item. Tiled images are served
+# from the shared tile cache, which has its own budget.
+def image_bytes(image_item):
+    if isinstance(image_item, ImageItem):
+        return sum(level.sizeInBytes() for level in image_item.levels)
+    return 0
+
+# Open documents with a memory budget for their decoded images. Images of the
+# documents shown least recently are released when the budget is exceeded;
+# they are loaded again, usually from the image caches, when shown. release
+# is called with the filename of every full image dropped.
+class Workspace():
+    def __init__(self, budget: int = 1024 * 1024 * 1024, release=None):
+        self.budget = budget
+        self.release = release
+        self.documents = []
+        self.clock = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def add(self, document: ImageDocument):
+        self.documents.append(document)
+        return document
+
+    def remove(self, document: ImageDocument):
+        self.documents.remove(document)
+        self.dropImage(document)
+
+    def dropImage(self, document: ImageDocument):
+        image_item = document.imageItem
+        document.dropImage()
+        if self.release is not None and document.filename and type(image_item) is ImageItem:
+            self.release(document.filename)
+
+    def find(self, filename: str):
+        path = os.path.abspath(filename)
+        for document in self.documents:
+            if document.filename is not None and os.path.abspath(document.filename) == path:
+                return document
+        return None
+
+    def touch(self, document: ImageDocument):
+        self.clock += 1
+        document.lastShown = self.clock
+
+    def used(self):
+        return sum(image_bytes(document.imageItem) for document in self.documents)
+
+    # Release images until the budget is met, never the one of keep
+    def trim(self, keep: ImageDocument = None):
+        used = self.used()
+        for document in sorted(self.documents, key=lambda document: document.lastShown):
+            if used <= self.budget:
+                break
+            if document is keep or document.imageItem is None:
+                continue
+            used -= image_bytes(document.imageItem)
+            self.dropImage(document)
+
+
+# Decode a small version of an image, the reader scales while decoding
+def decode_thumbnail(filename: str, size: int = THUMBNAIL_SIZE):
+    reader = QImageReader(filename)
+    reader.setAutoTransform(True)
+    full = reader.size()
+    if full.isValid() and max(full.width(), full.height()) > size:
+        reader.setScaledSize(full.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio))
+    return reader.read()
+
+class ThumbnailTask(QRunnable):
+    def __init__(self, filename: str, strip):
+        super().__init__()
+        self.filename = filename
+        self.strip = strip
+
+    def run(self):
+        self.strip.decoded.emit(self.filename, decode_thumbnail(self.filename))
+
+
+# Horizontal strip with one thumbnail per document. Thumbnails are decoded in
+# the background once their entry scrolls into view.
+class ThumbnailStrip(QListWidget):
+    documentSelected = pyqtSignal(object)
+    decoded = pyqtSignal(str, QImage)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setFlow(QListView.Flow.LeftToRight)
+        self.setWrapping(False)
+        self.setMovement(QListView.Movement.Static)
+        self.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.setFixedHeight(THUMBNAIL_SIZE + 48)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.pending = set()
+        self.decoded.connect(self.onDecoded)
+        self.itemClicked.connect(lambda item: self.documentSelected.emit(item.data(Qt.ItemDataRole.UserRole)))
+        self.horizontalScrollBar().valueChanged.connect(self.requestVisible)
+
+    def itemFor(self, document):
+        for row in range(self.count()):
+            if self.item(row).data(Qt.ItemDataRole.UserRole) is document:
+                return self.item(row)
+        return None
+
+    def addDocument(self, document):
+        item = QListWidgetItem(document.title())
+        item.setData(Qt.ItemDataRole.UserRole, document)
+        item.setToolTip(document.filename or '')
+        self.addItem(item)
+        self.requestVisible()
+
+    def removeDocument(self, document):
+        item = self.itemFor(document)
+        if item is not None:
+            self.takeItem(self.row(item))
+
+    def updateDocument(self, document):
+        item = self.itemFor(document)
+        if item is None:
+            return
+        item.setText(document.title())
+        item.setToolTip(document.filename or '')
+        if document.thumbnail is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(document.thumbnail)))
+        self.requestVisible()
+
+    def setCurrentDocument(self, document):
+        item = self.itemFor(document)
+        if item is not None:
+            self.setCurrentItem(item)
+            self.scrollToItem(item)
+
+    # Start decoding thumbnails of the entries in view
+    def requestVisible(self):
+        area = self.viewport().rect()
+        for row in range(self.count()):
+            item = self.item(row)
+            document = item.data(Qt.ItemDataRole.UserRole)
+            if (document.thumbnail is None and document.filename and document.filename not in self.pending
+                    and self.visualItemRect(item).intersects(area)):
+                self.pending.add(document.filename)
+                self.pool.start(ThumbnailTask(document.filename, self))
+
+    def onDecoded(self, filename: str, image: QImage):
+        self.pending.discard(filename)
+        if image.isNull():
+            return
+        for row in range(self.count()):
+            item = self.item(row)
+            document = item.data(Qt.ItemDataRole.UserRole)
+            if document.filename == filename:
+                document.thumbnail = image
+                item.setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.requestVisible()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.requestVisible()
+
+    def shutdown(self):
+        self.pool.clear()
+        self.pool.waitForDone()